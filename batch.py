@@ -0,0 +1,141 @@
+"""
+Simulates many gcode files in a process pool, e.g. a nightly directory of sliced jobs.
+
+python batch.py jobs/ other.gcode [--output-directory batch-output] [--processes 4] [--summary summary.json]
+    [--set NAME=VALUE]
+
+The largest files are started first, so a large file started last does not extend the total wall time. Every job
+writes <name>_contact_temps.gcode, <name>_time_over_tgt.gcode (see simulator.export_for_gcode) and <name>.roads (see
+simulator.write_road_results) to the output directory and a summary table is printed at the end.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import traceback
+
+import simulator
+
+
+def find_gcode_files(paths: list[str]) -> list[str]:
+    """
+    :param paths: gcode files and directories containing gcode files (not recursive, exported files are skipped)
+    :return: the gcode files, the largest first
+    """
+    gcode_filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            gcode_filenames += sorted(os.path.join(path, name) for name in os.listdir(path)
+                                      if name.lower().endswith(".gcode") and not name.startswith("export"))
+        else:
+            gcode_filenames.append(path)
+    return sorted(dict.fromkeys(gcode_filenames), key=os.path.getsize, reverse=True)
+
+
+def output_filenames(gcode_filenames: list[str], output_directory: str) -> dict[str, tuple[str, str, str]]:
+    """
+    :return: per gcode file the filenames for export_for_gcode and write_road_results, files with the same name get a
+    number appended
+    """
+    filenames = {}
+    used_names = set()
+    for gcode_filename in gcode_filenames:
+        name = base_name = os.path.splitext(os.path.basename(gcode_filename))[0]
+        number = 1
+        while name in used_names:
+            number += 1
+            name = "%s_%d" % (base_name, number)
+        used_names.add(name)
+        filenames[gcode_filename] = (os.path.join(output_directory, name + "_contact_temps.gcode"),
+                                     os.path.join(output_directory, name + "_time_over_tgt.gcode"),
+                                     os.path.join(output_directory, name + ".roads"))
+    return filenames
+
+
+def run_job(job) -> dict:
+    """
+    Simulates one gcode file with simulator.main, runs in a new process for every job so the peak memory is the
+    one of this job.
+    :param job: gcode filename, the output filenames and the module constants of the simulator to change
+    :return: runtime in seconds, peak memory (maximum resident set size) in MiB and the summary of simulator.main,
+    the error if the simulation failed
+    """
+    gcode_filename, (contact_temps_filename, time_over_tgt_filename, result_filename), settings = job
+    simulator.set_constants(settings)
+    result = {"gcode_filename": gcode_filename, "contact_temps_filename": contact_temps_filename,
+              "time_over_tgt_filename": time_over_tgt_filename, "result_filename": result_filename}
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result.update(simulator.main(gcode_filename, contact_temps_filename, time_over_tgt_filename,
+                                         result_filename))
+    except Exception as error:
+        result["error"] = "".join(traceback.format_exception_only(type(error), error)).strip() or type(error).__name__
+    result["runtime"] = time.perf_counter() - start
+    result["peak_memory"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+    return result
+
+
+def run_batch(gcode_filenames: list[str], output_directory: str, settings: dict, processes=None) -> list[dict]:
+    """
+    :param gcode_filenames: started in the given order
+    :param output_directory: created if necessary
+    :param settings: module constants of the simulator to change
+    :param processes: number of parallel jobs, None uses all cores
+    :return: the results of run_job in the order of gcode_filenames
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    filenames = output_filenames(gcode_filenames, output_directory)
+    jobs = [(gcode_filename, filenames[gcode_filename], settings) for gcode_filename in gcode_filenames]
+    results = {}
+    context = multiprocessing.get_context("spawn")  # the simulator keeps module level caches
+    with context.Pool(min(processes or os.cpu_count(), len(jobs)) or 1, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(run_job, jobs):
+            print("%s %s in %.1f s" % ("failed" if "error" in result else "finished", result["gcode_filename"],
+                                      result["runtime"]))
+            results[result["gcode_filename"]] = result
+    return [results[gcode_filename] for gcode_filename in gcode_filenames]
+
+
+def print_summary(results: list[dict]):
+    print("%-55s %10s %12s %10s %12s %12s" % ("file", "time (s)", "memory (MiB)", "max (°C)", "HDT line", "HDT (s)"))
+    for result in results:
+        if "error" in result:
+            print("%-55s %10.1f %12.1f  failed: %s" % (result["gcode_filename"], result["runtime"],
+                                                        result["peak_memory"], result["error"]))
+        else:
+            print("%-55s %10.1f %12.1f %10.1f %12d %12.1f" % (
+                result["gcode_filename"], result["runtime"], result["peak_memory"], result["max_temperature"],
+                result["longest_above_hdt_line_number"], result["longest_above_hdt_duration"]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Thermal simulation of many gcode files.")
+    parser.add_argument("paths", nargs="+", help="gcode files or directories containing gcode files")
+    parser.add_argument("--output-directory", default="batch-output")
+    parser.add_argument("--processes", type=int, help="number of parallel jobs, default: number of cores")
+    parser.add_argument("--summary", help="write the results as JSON")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="change a module constant of the simulator, e.g. TIME_INTEGRATION=implicit")
+    arguments = parser.parse_args()
+
+    try:
+        settings = simulator.parse_constants(arguments.set)
+    except ValueError as error:
+        parser.error(str(error))
+    gcode_filenames = find_gcode_files(arguments.paths)
+    if not gcode_filenames:
+        parser.error("no gcode files found")
+    start = time.perf_counter()
+    results = run_batch(gcode_filenames, arguments.output_directory, settings, arguments.processes)
+    print_summary(results)
+    print("Total wall time: %.1f s" % (time.perf_counter() - start))
+    if arguments.summary:
+        with open(arguments.summary, "w") as summary_file:
+            json.dump(results, summary_file, indent=2)
+    if any("error" in result for result in results):
+        sys.exit(1)
@@ -0,0 +1,857 @@
+"""
+Benchmarks for simulator.py on the sample gcode files.
+
+python benchmark.py suite [gcode files] [--output results.json] [--compare baseline.json] [--set NAME=VALUE]
+python benchmark.py time-integration [gcode files]
+python benchmark.py time-stepping [gcode files]
+python benchmark.py fast-forward [gcode files]
+python benchmark.py meshing [gcode files]
+python benchmark.py gcode-parser [gcode files]
+python benchmark.py gcode-parser-check [gcode files]
+python benchmark.py jit [gcode files]
+python benchmark.py threads [gcode files]
+python benchmark.py checkpoint [gcode files]
+python benchmark.py contact-engine [gcode files]
+python benchmark.py candidate-index [gcode files]
+python benchmark.py active-body [gcode files]
+python benchmark.py travel-moves [gcode files]
+python benchmark.py export [gcode files]
+python benchmark.py memory [gcode files]
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+import shapely.strtree
+
+import instrumentation
+import simulator
+
+SAMPLE_FILES = ("sample-input-output/cube_test.gcode",
+                "sample-input-output/bridge.gcode",
+                "sample-input-output/cylinder_fast.gcode",
+                "sample-input-output/uberhangtest_6s.gcode",
+                "sample-input-output/CFFFP_bridge-torture-test_50mm.gcode")
+
+# fixed time step of the reference of compare_time_stepping and compare_cooling_fast_forward
+REFERENCE_TIME_STEP = 0.02  # seconds
+# pause before every layer of the copies of the gcode files in compare_cooling_fast_forward
+LAYER_PAUSE = 10.0  # seconds
+# STEPPING_THREADS of compare_stepping_threads
+THREAD_COUNTS = (1, 2, 4, 8)
+# edge cases of check_gcode_parsers: blank last lines, a line that is only a move command, a number longer than
+# simulator._GCODE_MAXIMUM_FIELD_LENGTH and a file without a line end at the end
+PARSER_EDGE_CASES = ("\n", "\n\n", "G1 X1 Y2 E1\n; end\n\n\n", "G1\n", "G1 X1 Y2 E1",
+                     "G1 X1.000000000000000000000000000001 Y2 E1\n\n"
+                     "G0 X-1.00000000000000000000000000000001e2 F3000\n\n")
+# MINIMUM_ELEMENT_LENGTH and MAXIMUM_SEGMENT_LENGTH of the meshes in compare_meshing, None: no meshing
+MESHES = ((None, None), (0.5, float("inf")), (1.0, float("inf")), (0.5, 4), (0.5, 2), (0.5, 1))  # mm
+
+PHASES = ("parsing", "geometry", "contacts", "free_areas", "time_stepping", "export")
+
+
+def prepare_roads(gcode_filename):
+    """Runs everything before the time stepping, the progress output of the simulator is suppressed."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        roads_by_geomid, roads_by_layer_number, number_of_layers = simulator.read_roads(gcode_filename)
+        simulator.calculate_contacts(roads_by_geomid, roads_by_layer_number, number_of_layers)
+        simulator.calculate_free_areas(roads_by_geomid)
+    return list(roads_by_geomid.values())
+
+
+def run_simulation(gcode_filename, **settings):
+    """
+    Simulates with the given module constants of the simulator, they are restored afterwards.
+    :return: dict with the runtime, the number of Road objects, moves (passes through the time loop) and time steps,
+    the simulated roads summed over the time steps, the active body statistics, the per road results and the results
+    per gcode line (see simulator.line_results), None if the simulation failed
+    """
+    previous_settings = {name: getattr(simulator, name) for name in settings}
+    try:
+        for name, value in settings.items():
+            setattr(simulator, name, value)
+        roads = prepare_roads(gcode_filename)
+        road_store = simulator.RoadStore(roads)
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                simulator.simulate_deposition(roads, len(roads), road_store)
+        except AssertionError:
+            return None
+        runtime = time.perf_counter() - start
+        line_results = simulator.road_results(roads)
+        if simulator.MESH_ROADS:
+            line_results = simulator.line_results(line_results, *(
+                np.array([getattr(road, name) for road in roads], dtype=np.int64)
+                for name in ("first_line_number", "last_line_number")))
+    finally:
+        for name, value in previous_settings.items():
+            setattr(simulator, name, value)
+    return {"runtime": runtime,
+            "roads": len(roads),
+            "moves": len(roads) + sum(1 for road in roads if road.travel_duration > 0),
+            "time_steps": road_store.time_step_count,
+            "road_steps": sum(road_store.active_road_counts),
+            "active_body": road_store.active_body_statistics(),
+            "temperature": road_store.temperature.copy(),
+            "duration_temp_above_hdt": road_store.duration_temp_above_hdt.copy(),
+            "line_results": line_results}
+
+
+def run_time_integration(gcode_filename, time_integration):
+    """
+    :return: see run_simulation
+    """
+    return run_simulation(gcode_filename, TIME_INTEGRATION=time_integration)
+
+
+def compare_time_integration(gcode_filenames):
+    """Prints runtime, step count and the deviation of the implicit to the explicit results."""
+    print("%-55s %10s %8s %10s %8s %8s %14s %14s" % ("file", "explicit", "steps", "implicit", "steps", "speedup",
+                                                     "mean dT (K)", "p99 dHDT (s)"))
+    for gcode_filename in gcode_filenames:
+        explicit = run_time_integration(gcode_filename, "explicit")
+        implicit = run_time_integration(gcode_filename, "implicit")
+        if explicit is None:
+            print("%-55s %10s %8s %10.2f %8d" % (gcode_filename, "failed", "-", implicit["runtime"],
+                                                 implicit["time_steps"]))
+            continue
+        print("%-55s %10.2f %8d %10.2f %8d %8.1f %14.2f %14.2f" % (
+            gcode_filename, explicit["runtime"], explicit["time_steps"], implicit["runtime"],
+            implicit["time_steps"], explicit["runtime"] / implicit["runtime"],
+            np.abs(explicit["temperature"] - implicit["temperature"]).mean(),
+            np.percentile(np.abs(explicit["duration_temp_above_hdt"] - implicit["duration_temp_above_hdt"]), 99)))
+
+
+def compare_time_stepping(gcode_filenames, time_integrations=("explicit", "implicit")):
+    """
+    Prints step count and runtime of the fixed and the adaptive time stepping and the deviation of the adaptive results
+    to the fixed ones. Both are also compared to a reference with fixed steps of REFERENCE_TIME_STEP.
+    """
+    reference_settings = {"MAX_SIMULATION_TIME_STEP": REFERENCE_TIME_STEP,
+                          "MIN_SIMULATION_TIME_STEP": REFERENCE_TIME_STEP / 2,
+                          "IMPLICIT_MAX_SIMULATION_TIME_STEP": REFERENCE_TIME_STEP,
+                          "IMPLICIT_MIN_SIMULATION_TIME_STEP": REFERENCE_TIME_STEP / 2}
+
+    def deviation(results, reference_results):
+        return "%6.2f %6.2f" % (np.abs(results["temperature"] - reference_results["temperature"]).mean(),
+                                np.percentile(np.abs(results["duration_temp_above_hdt"] -
+                                                     reference_results["duration_temp_above_hdt"]), 99))
+
+    print("%-55s %9s %8s %8s %8s %8s %13s %13s %13s" % (
+        "file", "", "fixed", "steps", "adaptive", "steps", "to fixed", "fixed to ref", "adapt. to ref"))
+    print("%-55s %9s %8s %8s %8s %8s %13s %13s %13s" % ("", "", "(s)", "", "(s)", "", *["dT(K) dHDT(s)"] * 3))
+    for gcode_filename in gcode_filenames:
+        for time_integration in time_integrations:
+            fixed = run_simulation(gcode_filename, TIME_INTEGRATION=time_integration)
+            adaptive = run_simulation(gcode_filename, TIME_INTEGRATION=time_integration, TIME_STEPPING="adaptive")
+            reference = run_simulation(gcode_filename, TIME_INTEGRATION=time_integration, **reference_settings)
+            if fixed is None or adaptive is None or reference is None:
+                print("%-55s %9s failed" % (gcode_filename, time_integration))
+                continue
+            print("%-55s %9s %8.2f %8d %8.2f %8d %13s %13s %13s" % (
+                gcode_filename, time_integration, fixed["runtime"], fixed["time_steps"], adaptive["runtime"],
+                adaptive["time_steps"], deviation(adaptive, fixed), deviation(fixed, reference),
+                deviation(adaptive, reference)))
+
+
+def write_with_layer_pauses(gcode_filename, output_filename, pause=LAYER_PAUSE):
+    """
+    Writes a copy of the gcode file with a pause before every layer change: a slow travel move 10 mm along X (the
+    simulator does not read dwell commands), the next move restores the feedrate.
+    """
+    x, feedrate, extruded = 0.0, 3000.0, False
+    with open(gcode_filename) as gcode_file, open(output_filename, "w") as output_file:
+        for line in gcode_file:
+            if line.startswith(("G0", "G1")):
+                fields = {field[:1]: field[1:] for field in line.split(";")[0].split()[1:]}
+                if "Z" in fields and extruded:
+                    output_file.write("G0 F%.3f X%.3f\nG0 F%.3f\n" % (600 / pause, x + 10, feedrate))
+                x = float(fields.get("X", x))
+                feedrate = float(fields.get("F", feedrate))
+                extruded |= "E" in fields
+            output_file.write(line)
+
+
+def compare_cooling_fast_forward(gcode_filenames):
+    """
+    Prints runtime, time steps and the simulated roads summed over the time steps without and with
+    COOLING_FAST_FORWARD and the deviation of both to a reference with fixed steps of REFERENCE_TIME_STEP, for the
+    gcode files and copies of them with a pause of LAYER_PAUSE before every layer.
+    """
+    reference_settings = {"MAX_SIMULATION_TIME_STEP": REFERENCE_TIME_STEP,
+                          "MIN_SIMULATION_TIME_STEP": REFERENCE_TIME_STEP / 2,
+                          "IMPLICIT_MAX_SIMULATION_TIME_STEP": REFERENCE_TIME_STEP,
+                          "IMPLICIT_MIN_SIMULATION_TIME_STEP": REFERENCE_TIME_STEP / 2}
+
+    def deviation(results, reference_results):
+        return "%6.2f %6.2f" % (np.abs(results["temperature"] - reference_results["temperature"]).mean(),
+                                np.percentile(np.abs(results["duration_temp_above_hdt"] -
+                                                     reference_results["duration_temp_above_hdt"]), 99))
+
+    print("%-55s %9s %7s %8s %10s %8s %10s %13s %13s" % (
+        "file", "", "steps", "stepped", "road steps", "fast-fw.", "road steps", "stepped", "fast-fw."))
+    print("%-55s %9s %7s %8s %10s %8s %10s %13s %13s" % ("", "", "", "(s)", "", "(s)", "", *["dT(K) dHDT(s)"] * 2))
+    with tempfile.TemporaryDirectory() as directory:
+        for gcode_filename in gcode_filenames:
+            paused_filename = os.path.join(directory, "paused_" + os.path.basename(gcode_filename))
+            write_with_layer_pauses(gcode_filename, paused_filename)
+            for filename, name in ((gcode_filename, gcode_filename), (paused_filename, "  with layer pauses")):
+                for time_integration in ("explicit", "implicit"):
+                    stepped = run_simulation(filename, TIME_INTEGRATION=time_integration)
+                    fast_forward = run_simulation(filename, TIME_INTEGRATION=time_integration,
+                                                  COOLING_FAST_FORWARD=True)
+                    reference = run_simulation(filename, TIME_INTEGRATION=time_integration, **reference_settings)
+                    if stepped is None or fast_forward is None or reference is None:
+                        print("%-55s %9s failed" % (name, time_integration))
+                        continue
+                    print("%-55s %9s %7d %8.2f %10d %8.2f %10d %13s %13s" % (
+                        name, time_integration, stepped["time_steps"], stepped["runtime"], stepped["road_steps"],
+                        fast_forward["runtime"], fast_forward["road_steps"], deviation(stepped, reference),
+                        deviation(fast_forward, reference)))
+
+
+def compare_meshing(gcode_filenames):
+    """
+    Prints the number of roads, the runtime of everything (parsing to simulation) and of the simulation for the MESHES
+    and the deviation of the results per gcode line to the ones without meshing.
+    """
+    print("%-55s %9s %6s %6s %7s %8s %8s %10s %12s" % (
+        "file", "", "min", "max", "roads", "total(s)", "sim.(s)", "mean dT(K)", "max dHDT (s)"))
+    for gcode_filename in gcode_filenames:
+        for time_integration in ("explicit", "implicit"):
+            unmeshed = None
+            for minimum_element_length, maximum_element_length in MESHES:
+                settings = {"TIME_INTEGRATION": time_integration}
+                if minimum_element_length is not None:
+                    settings.update(MESH_ROADS=True, MINIMUM_ELEMENT_LENGTH=minimum_element_length,
+                                    MAXIMUM_SEGMENT_LENGTH=maximum_element_length)
+                start = time.perf_counter()
+                results = run_simulation(gcode_filename, **settings)
+                if results is None:
+                    print("%-55s %9s %6s %6s failed" % (gcode_filename, time_integration, minimum_element_length,
+                                                        maximum_element_length))
+                    continue
+                total_runtime = time.perf_counter() - start
+                if minimum_element_length is None:
+                    unmeshed = results["line_results"]
+                if unmeshed is None:
+                    deviation = ("", "")
+                else:
+                    line_results = results["line_results"]
+                    deviation = ("%10.3f" % np.nanmean(np.abs(line_results["temperature"] - unmeshed["temperature"])),
+                                 "%12.3f" % np.abs(line_results["duration_temp_above_hdt"] -
+                                                   unmeshed["duration_temp_above_hdt"]).max())
+                print("%-55s %9s %6s %6s %7d %8.2f %8.2f %10s %12s" % (
+                    gcode_filename, time_integration, minimum_element_length or "-", maximum_element_length or "-",
+                    results["roads"], total_runtime, results["runtime"], *deviation))
+
+
+def compare_travel_coalescing(gcode_filenames):
+    """
+    Prints the number of Road objects, of passes through the time loop (roads and joined travel moves) and of time
+    steps, the runtime of everything (parsing to simulation) and of the simulation without and with
+    COALESCE_TRAVEL_MOVES, and the deviation of the results.
+    """
+    print("%-55s %9s %7s %7s %7s %7s %7s %7s %8s %8s %8s %8s %10s %12s" % (
+        "file", "", "roads", "joined", "moves", "joined", "steps", "joined", "total(s)", "joined", "sim.(s)", "joined",
+        "max dT (K)", "max dHDT (s)"))
+    for gcode_filename in gcode_filenames:
+        for time_integration in ("explicit", "implicit"):
+            runs = []
+            for coalesce in (False, True):
+                start = time.perf_counter()
+                runs.append(run_simulation(gcode_filename, TIME_INTEGRATION=time_integration,
+                                           COALESCE_TRAVEL_MOVES=coalesce))
+                if runs[-1] is not None:
+                    runs[-1]["total_runtime"] = time.perf_counter() - start
+            every, joined = runs
+            if every is None or joined is None:
+                print("%-55s %9s failed" % (gcode_filename, time_integration))
+                continue
+            print("%-55s %9s %7d %7d %7d %7d %7d %7d %8.2f %8.2f %8.2f %8.2f %10.3f %12.3f" % (
+                gcode_filename, time_integration, every["roads"], joined["roads"], every["moves"], joined["moves"],
+                every["time_steps"], joined["time_steps"], every["total_runtime"], joined["total_runtime"],
+                every["runtime"], joined["runtime"],
+                np.abs(every["temperature"] - joined["temperature"]).max(),
+                np.abs(every["duration_temp_above_hdt"] - joined["duration_temp_above_hdt"]).max()))
+
+
+def compare_active_body(gcode_filenames):
+    """
+    Prints runtime and simulated roads per time step without and with the active body, and the deviation of the
+    results. Uses the implicit time integration, the explicit one fails on some sample files.
+    """
+    print("%-55s %8s %8s %8s %10s %10s %10s %12s %14s %14s" % (
+        "file", "full", "active", "speedup", "mean roads", "mean act.", "max act.", "inactive>HDT", "max dT (K)",
+        "p99 dHDT (s)"))
+    for gcode_filename in gcode_filenames:
+        full = run_simulation(gcode_filename, TIME_INTEGRATION="implicit", ACTIVE_BODY=False)
+        active = run_simulation(gcode_filename, TIME_INTEGRATION="implicit", ACTIVE_BODY=True)
+        statistics = active["active_body"]
+        print("%-55s %8.2f %8.2f %8.1f %10.0f %10.0f %10.0f %12d %14.2f %14.2f" % (
+            gcode_filename, full["runtime"], active["runtime"], full["runtime"] / active["runtime"],
+            statistics["mean_simulated_roads"], statistics["mean_active_roads"], statistics["max_active_roads"],
+            statistics["max_inactive_above_hdt"], np.abs(full["temperature"] - active["temperature"]).max(),
+            np.percentile(np.abs(full["duration_temp_above_hdt"] - active["duration_temp_above_hdt"]), 99)))
+
+
+def compare_jit(gcode_filenames):
+    """
+    Prints the time to compile (or load from the cache) the kernel of the "numba" SIMULATION_ENGINE, and the runtime
+    of the time stepping with the "numpy" and the "numba" engine and whether the results are identical.
+    """
+    start = time.perf_counter()
+    compiled = simulator._numba_kernels() is not None
+    print("numba kernel %s in %.2f s" % ("loaded" if compiled else "not available", time.perf_counter() - start))
+    print("%-55s %9s %10s %9s %9s %8s %6s" % ("file", "", "road steps", "numpy(s)", "numba(s)", "speedup", "same"))
+    for gcode_filename in gcode_filenames:
+        for active_body in (False, True):
+            runs = [run_simulation(gcode_filename, SIMULATION_ENGINE=engine, ACTIVE_BODY=active_body)
+                    for engine in ("numpy", "numba")]
+            if None in runs:
+                print("%-55s %9s failed" % (gcode_filename, "active" if active_body else ""))
+                continue
+            numpy_run, numba_run = runs
+            print("%-55s %9s %10d %9.2f %9.2f %8.2f %6s" % (
+                gcode_filename, "active" if active_body else "", numpy_run["road_steps"], numpy_run["runtime"],
+                numba_run["runtime"], numpy_run["runtime"] / numba_run["runtime"],
+                np.array_equal(numpy_run["temperature"], numba_run["temperature"]) and
+                np.array_equal(numpy_run["duration_temp_above_hdt"], numba_run["duration_temp_above_hdt"])))
+
+
+def compare_stepping_threads(gcode_filenames):
+    """
+    Prints the runtime of the time stepping of the "numba" engine with THREAD_COUNTS STEPPING_THREADS, the mean
+    number of blocks per kernel call (see STEPPING_MINIMUM_BLOCK_ROADS), the speedup to one thread and whether the
+    results are identical to one thread. More threads than usable cores only add overhead.
+    """
+    print("%d usable cores" % len(os.sched_getaffinity(0)))
+    print("%-55s %9s %7s %10s %7s %9s %8s %6s" % ("file", "", "threads", "road steps", "blocks", "time(s)", "speedup",
+                                                  "same"))
+    for gcode_filename in gcode_filenames:
+        for time_integration in ("explicit", "implicit"):
+            single = None
+            for threads in THREAD_COUNTS:
+                instrumentation.enable()
+                results = run_simulation(gcode_filename, SIMULATION_ENGINE="numba", STEPPING_THREADS=threads,
+                                         TIME_INTEGRATION=time_integration)
+                instrumentation.disable()
+                counters = instrumentation.summary()["counters"]
+                if results is None:
+                    print("%-55s %9s %7d failed" % (gcode_filename, time_integration, threads))
+                    break
+                single = single or results
+                print("%-55s %9s %7d %10d %7.2f %9.2f %8.2f %6s" % (
+                    gcode_filename, time_integration, threads, results["road_steps"],
+                    counters.get("stepping_blocks", 0) / max(counters.get("stepping_calls", 0), 1), results["runtime"],
+                    single["runtime"] / results["runtime"],
+                    np.array_equal(single["temperature"], results["temperature"]) and
+                    np.array_equal(single["duration_temp_above_hdt"], results["duration_temp_above_hdt"])))
+
+
+class _Interrupted(Exception):
+    pass
+
+
+class _InterruptedRoadStore(simulator.LeanRoadStore):
+    """Stops the simulation after the given number of checkpoints, see compare_checkpoints."""
+    def __init__(self, arrays, checkpoints):
+        super().__init__(arrays)
+        self.checkpoints = checkpoints
+
+    def checkpoint(self, filename, key, position):
+        super().checkpoint(filename, key, position)
+        self.checkpoints -= 1
+        if self.checkpoints == 0:
+            raise _Interrupted()
+
+
+def run_lean_simulation(arrays, road_store, **settings):
+    """
+    Simulates the lean roads with the given module constants of the simulator, they are restored afterwards.
+    :return: the runtime and the results of the roads (see LeanRoadStore.results), None if the simulation failed
+    """
+    previous_settings = {name: getattr(simulator, name) for name in settings}
+    try:
+        for name, value in settings.items():
+            setattr(simulator, name, value)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            simulator.simulate_lean_deposition(arrays, road_store)
+        return time.perf_counter() - start, road_store.results(arrays)
+    except AssertionError:
+        return None
+    finally:
+        for name, value in previous_settings.items():
+            setattr(simulator, name, value)
+
+
+def compare_checkpoints(gcode_filenames):
+    """
+    Prints the runtime of the lean simulation without checkpoints and with a checkpoint at every layer change, the
+    time and size of the checkpoints and whether a simulation interrupted halfway and resumed from its last checkpoint
+    has the same results as one without interruption.
+    """
+    print("%-55s %7s %9s %9s %7s %12s %10s %9s %8s" % (
+        "file", "layers", "sim.(s)", "every(s)", "count", "ms each", "% of sim.", "size(KiB)", "resumed"))
+    for gcode_filename in gcode_filenames:
+        with contextlib.redirect_stdout(io.StringIO()):
+            arrays = simulator.prepare_road_arrays(gcode_filename)
+        layers = len(np.unique(arrays["layer_number"]))
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_filename = os.path.join(directory, "simulation.checkpoint")
+            checkpoints = {"CHECKPOINT_FILENAME": checkpoint_filename, "CHECKPOINT_INTERVAL": 0.0}
+            uninterrupted = run_lean_simulation(arrays, simulator.LeanRoadStore(arrays))
+            if uninterrupted is None:
+                print("%-55s %7d failed" % (gcode_filename, layers))
+                continue
+            instrumentation.enable()
+            every_layer = run_lean_simulation(arrays, simulator.LeanRoadStore(arrays), **checkpoints)
+            instrumentation.disable()
+            checkpoint_phase = instrumentation.summary()["phases"].get("checkpoint", {"duration": 0, "count": 0})
+            try:
+                run_lean_simulation(arrays, _InterruptedRoadStore(arrays, max(layers // 2, 1)), **checkpoints)
+            except _Interrupted:
+                pass
+            size = os.path.getsize(checkpoint_filename) if os.path.exists(checkpoint_filename) else 0
+            resumed = run_lean_simulation(arrays, simulator.LeanRoadStore(arrays), **checkpoints)
+        print("%-55s %7d %9.2f %9.2f %7d %12.2f %10.2f %9.0f %8s" % (
+            gcode_filename, layers, uninterrupted[0], every_layer[0], checkpoint_phase["count"],
+            1000 * checkpoint_phase["duration"] / max(checkpoint_phase["count"], 1),
+            100 * checkpoint_phase["duration"] / every_layer[0], size / 1024,
+            all(np.array_equal(uninterrupted[1][name], resumed[1][name], equal_nan=True) for name in resumed[1])))
+
+
+def compare_gcode_parsers(gcode_filenames, repetitions=5):
+    """Prints the throughput of gcode_moves and gcode_move_batches, alone and with the conversion to roads."""
+    def initial_state():
+        return {"X": 0, "Y": 0, "Z": 0, "E": 0, "F": 3000, "layer_number": 0, "layer_height": 0}
+
+    def lines_parser(gcode_filename):
+        for _ in simulator.gcode_moves(gcode_filename):
+            pass
+
+    def lines_roads(gcode_filename):
+        position_and_state = initial_state()
+        for move in simulator.gcode_moves(gcode_filename):
+            road, position_and_state = simulator.convert_move_to_road(move, position_and_state)
+
+    def chunks_parser(gcode_filename):
+        for _ in simulator.gcode_move_batches(gcode_filename):
+            pass
+
+    def chunks_roads(gcode_filename):
+        position_and_state = initial_state()
+        for moves in simulator.gcode_move_batches(gcode_filename):
+            roads, position_and_state = simulator.convert_move_batch_to_roads(moves, position_and_state)
+
+    print("%-55s %16s %16s %16s %16s" % ("lines per second", "gcode_moves", "+ roads", "move_batches", "+ roads"))
+    for gcode_filename in gcode_filenames:
+        with open(gcode_filename, "rb") as gcode_file:
+            line_count = sum(1 for _ in gcode_file)
+        throughputs = []
+        for function in (lines_parser, lines_roads, chunks_parser, chunks_roads):
+            runtime = min(timeit.repeat(lambda: function(gcode_filename), number=1, repeat=repetitions))
+            throughputs.append(line_count / runtime)
+        print("%-55s %16d %16d %16d %16d" % (gcode_filename, *throughputs))
+
+
+def same_gcode_moves(gcode_filename, chunk_size=None):
+    """:return: whether gcode_move_batches with the given chunk size finds the same moves as gcode_moves"""
+    expected = list(simulator.gcode_moves(gcode_filename))
+    moves = [move for batch in simulator.gcode_move_batches(gcode_filename, chunk_size) for move in batch]
+    return len(moves) == len(expected) and all(
+        move["gcode_line_number"] == expected_move["gcode_line_number"] and
+        {field: move[field] for field in simulator._GCODE_FIELDS if not np.isnan(move[field])} ==
+        {field: value for field, value in expected_move.items() if field != "gcode_line_number"}
+        for move, expected_move in zip(moves, expected))
+
+
+def check_gcode_parsers(gcode_filenames):
+    """
+    Prints whether gcode_move_batches finds the same moves as gcode_moves, for the gcode files and PARSER_EDGE_CASES.
+    The edge cases are split into chunks of every size, so every chunk boundary (e.g. on a blank line) is checked.
+    """
+    print("%-55s %6s" % ("file", "same"))
+    for gcode_filename in gcode_filenames:
+        print("%-55s %6s" % (gcode_filename, same_gcode_moves(gcode_filename)))
+    with tempfile.TemporaryDirectory() as directory:
+        gcode_filename = os.path.join(directory, "edge_case.gcode")
+        for edge_case in PARSER_EDGE_CASES:
+            with open(gcode_filename, "w") as gcode_file:
+                gcode_file.write(edge_case)
+            print("%-55s %6s" % (repr(edge_case)[:55], all(same_gcode_moves(gcode_filename, chunk_size)
+                                                            for chunk_size in range(1, len(edge_case) + 2))))
+
+
+def measure_export(gcode_filenames, repetitions=5):
+    """
+    Prints the throughput of export_gcode_channels with the two channels of export_for_gcode and with six channels.
+    The roads are simulated with the implicit time integration first, the explicit one fails on some sample files.
+    """
+    time_integration = simulator.TIME_INTEGRATION
+    print("%-55s %8s %14s %14s %14s" % ("file", "channels", "time (ms)", "lines/s", "MB/s written"))
+    try:
+        simulator.TIME_INTEGRATION = "implicit"
+        for gcode_filename in gcode_filenames:
+            roads = prepare_roads(gcode_filename)
+            with contextlib.redirect_stdout(io.StringIO()):
+                simulator.simulate_deposition(roads, len(roads))
+            results = simulator.road_results(roads)
+            with tempfile.TemporaryDirectory() as output_directory:
+                for count_channels in (2, 6):
+                    channels = {os.path.join(output_directory, "channel_%d.gcode" % channel):
+                                (simulator.contact_temperature_feedrates, simulator.time_over_hdt_feedrates)[channel % 2]
+                                for channel in range(count_channels)}
+                    runtime = min(timeit.repeat(lambda: simulator.export_gcode_channels(gcode_filename, results, channels),
+                                                number=1, repeat=repetitions))
+                    with open(next(iter(channels)), "rb") as exported_file:
+                        line_count = sum(1 for _ in exported_file)
+                    size = sum(os.path.getsize(filename) for filename in channels)
+                    print("%-55s %8d %14.1f %14d %14.1f" % (gcode_filename, count_channels, runtime * 1000,
+                                                            line_count * count_channels / runtime, size / runtime / 1e6))
+    finally:
+        simulator.TIME_INTEGRATION = time_integration
+
+
+def run_memory(gcode_filename, settings):
+    """
+    Runs simulator.main with the implicit time integration, in a new process for every run.
+    :param settings: module constants of the simulator to change
+    :return: the number of roads and the increase of the maximum resident set size in bytes
+    """
+    simulator.TIME_INTEGRATION = "implicit"
+    simulator.set_constants(settings)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with tempfile.TemporaryDirectory() as output_directory, contextlib.redirect_stdout(io.StringIO()):
+        result_filename = os.path.join(output_directory, "results.roads")
+        simulator.main(gcode_filename, os.path.join(output_directory, "export_contact_temps.gcode"),
+                       os.path.join(output_directory, "export_time_over_tgt.gcode"), result_filename)
+        road_count = len(simulator.read_road_results(result_filename)[0]["gcode_line_number"])
+    return road_count, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) * 1024
+
+
+def compare_memory(gcode_filenames):
+    """
+    Prints the peak memory per road of simulator.main without and with LEAN_ROADS and with STREAMING, and the peak
+    memory this means for a print of a million roads (the streaming peak depends on the roads kept at once instead).
+    """
+    variants = {"objects": {}, "lean": {"LEAN_ROADS": True}, "streaming": {"STREAMING": True}}
+    print("%-55s %8s %s" % ("file", "roads", " ".join("%14s %12s" % (name + " B/road", "GiB/1M roads")
+                                                     for name in variants)))
+    context = multiprocessing.get_context("spawn")
+    for gcode_filename in gcode_filenames:
+        road_bytes = []
+        for settings in variants.values():
+            with context.Pool(1) as pool:
+                road_count, peak_memory = pool.apply(run_memory, (gcode_filename, settings))
+            road_bytes.append(peak_memory / road_count)
+        print("%-55s %8d %s" % (gcode_filename, road_count, " ".join(
+            "%14.0f %12.2f" % (bytes_per_road, bytes_per_road * 1e6 / 2 ** 30) for bytes_per_road in road_bytes)))
+
+
+def run_contact_engine(gcode_filename, contact_engine):
+    """
+    :return: runtime of calculate_contacts and the contact areas by pair of gcode line numbers
+    """
+    simulator.CONTACT_ENGINE = contact_engine
+    with contextlib.redirect_stdout(io.StringIO()):
+        roads_by_geomid, roads_by_layer_number, number_of_layers = simulator.read_roads(gcode_filename)
+        start = time.perf_counter()
+        simulator.calculate_contacts(roads_by_geomid, roads_by_layer_number, number_of_layers)
+        runtime = time.perf_counter() - start
+    return runtime, {(road.gcode_line_number, contact_road.gcode_line_number): contact_area
+                     for road in roads_by_geomid.values() for contact_road, contact_area in road.contacts.items()}
+
+
+def compare_contact_engines(gcode_filenames):
+    """Prints runtime of both contact engines, the contacts found by only one of them and the largest area deviation."""
+    contact_engine = simulator.CONTACT_ENGINE
+    print("%-55s %10s %10s %8s %10s %8s %8s %14s" % ("file", "shapely", "analytic", "speedup", "contacts", "missing",
+                                                     "extra", "max dA (mm^2)"))
+    try:
+        for gcode_filename in gcode_filenames:
+            shapely_runtime, shapely_contacts = run_contact_engine(gcode_filename, "shapely")
+            analytic_runtime, analytic_contacts = run_contact_engine(gcode_filename, "analytic")
+            common = shapely_contacts.keys() & analytic_contacts.keys()
+            print("%-55s %10.2f %10.2f %8.1f %10d %8d %8d %14.2g" % (
+                gcode_filename, shapely_runtime, analytic_runtime, shapely_runtime / analytic_runtime,
+                len(shapely_contacts), len(shapely_contacts.keys() - common), len(analytic_contacts.keys() - common),
+                max((abs(shapely_contacts[pair] - analytic_contacts[pair]) for pair in common), default=0)))
+    finally:
+        simulator.CONTACT_ENGINE = contact_engine
+
+
+def layer_candidates(roads_by_layer_number, number_of_layers):
+    """
+    :return: runtime and number of the candidate pairs of the STRtree queries of calculate_contacts, of the sweep and
+    of the grid (the pairs sharing a cell, before the envelope test) for the analytic engine, the number of
+    overlapping envelope pairs of the sweep and of the grid
+    """
+    roads_in_layers = [[road for road in roads_by_layer_number[layer] if not road.geometry.is_empty]
+                       for layer in range(1, number_of_layers + 1)]
+    strtree_runtime = 0
+    strtree_candidates = 0
+    previous_layer_tree = None
+    for roads_in_layer in roads_in_layers:
+        start = time.perf_counter()
+        tree = shapely.strtree.STRtree([road.geometry for road in roads_in_layer])
+        for road in roads_in_layer:
+            strtree_candidates += len(tree.query(road.geometry.buffer(simulator.XY_PRINTER_RESOLUTION, 1,
+                                                                      cap_style=3))) - 1
+            if previous_layer_tree is not None:
+                strtree_candidates += len(previous_layer_tree.query(road.geometry))
+        strtree_runtime += time.perf_counter() - start
+        previous_layer_tree = tree
+
+    layer_envelopes = []
+    for roads_in_layer in roads_in_layers:
+        _, road_values = simulator._road_arrays(roads_in_layer)
+        rectangles = simulator._road_rectangles(road_values[:, 0:2], road_values[:, 2:4], road_values[:, 4] / 2)
+        layer_envelopes.append(np.concatenate((rectangles.min(axis=1), rectangles.max(axis=1)), axis=1))
+    start = time.perf_counter()
+    sweep_pairs = 0
+    previous_envelopes = np.zeros((0, 4))
+    for envelopes in layer_envelopes:
+        sweep_pairs += len(simulator._overlapping_envelopes(envelopes, envelopes, simulator.XY_PRINTER_RESOLUTION)[0])
+        sweep_pairs += len(simulator._overlapping_envelopes(envelopes, previous_envelopes, 0)[0])
+        previous_envelopes = envelopes
+    sweep_runtime = time.perf_counter() - start
+
+    instrumentation.enable()
+    start = time.perf_counter()
+    grid_pairs = 0
+    previous_envelopes = np.zeros((0, 4))
+    for envelopes in layer_envelopes:
+        rows, _, previous_rows, _ = simulator._grid_overlapping_envelopes(
+            envelopes, previous_envelopes, simulator.XY_PRINTER_RESOLUTION, simulator.CONTACT_GRID_CELL_SIZE)
+        grid_pairs += len(rows) + len(previous_rows)
+        previous_envelopes = envelopes
+    grid_runtime = time.perf_counter() - start
+    instrumentation.disable()
+    grid_candidates = instrumentation.summary()["counters"].get("grid_candidates", 0)
+    return {"strtree": (strtree_runtime, strtree_candidates), "sweep": (sweep_runtime, sweep_pairs),
+            "grid": (grid_runtime, grid_candidates), "pairs": (sweep_pairs, grid_pairs)}
+
+
+def compare_candidate_indexes(gcode_filenames):
+    """
+    Prints runtime and number of candidate pairs of the STRtree (shapely engine), the sweep and the grid
+    (CONTACT_CANDIDATE_INDEX of the analytic engine), and the runtime of the analytic calculate_contacts with the
+    sweep and with the grid and whether both find the same contacts.
+    """
+    contact_engine = simulator.CONTACT_ENGINE
+    candidate_index = simulator.CONTACT_CANDIDATE_INDEX
+    print("%-55s %9s %10s %9s %10s %9s %10s %9s %9s %6s" % (
+        "file", "STRtree", "candidates", "sweep", "pairs", "grid", "candidates", "sweep", "grid", "same"))
+    print("%-55s %9s %10s %9s %10s %9s %10s %9s %9s" % ("", "(s)", "", "(s)", "", "(s)", "", "total(s)", "total(s)"))
+    try:
+        for gcode_filename in gcode_filenames:
+            with contextlib.redirect_stdout(io.StringIO()):
+                _, roads_by_layer_number, number_of_layers = simulator.read_roads(gcode_filename)
+            candidates = layer_candidates(roads_by_layer_number, number_of_layers)
+            assert candidates["pairs"][0] == candidates["pairs"][1]
+            totals = []
+            for index in ("sweep", "grid"):
+                simulator.CONTACT_CANDIDATE_INDEX = index
+                totals.append(run_contact_engine(gcode_filename, "analytic"))
+            print("%-55s %9.2f %10d %9.2f %10d %9.2f %10d %9.2f %9.2f %6s" % (
+                gcode_filename, *candidates["strtree"], *candidates["sweep"], *candidates["grid"], totals[0][0],
+                totals[1][0], totals[0][1] == totals[1][1]))
+    finally:
+        simulator.CONTACT_ENGINE = contact_engine
+        simulator.CONTACT_CANDIDATE_INDEX = candidate_index
+
+
+def run_phases(gcode_filename, settings, trace_memory):
+    """
+    Runs the pipeline of simulator.main phase by phase, the exported files are written to a temporary directory.
+    :param gcode_filename:
+    :param settings: module constants of the simulator to change
+    :param trace_memory: measure the peak memory of every phase with tracemalloc (slows down the phases)
+    :return: per phase the wall time in seconds and the peak memory in MiB, the number of roads and the maximum
+    resident set size of the process in MiB. The phases after a failed phase are missing.
+    """
+    simulator.set_constants(settings)
+    results = {"phases": {}}
+    data = {}
+
+    def parsing():
+        data["roads"], data["number_of_layers"] = simulator.parse_roads(gcode_filename)
+
+    def geometry():
+        data["roads_by_geomid"], data["roads_by_layer_number"] = simulator.build_geometries(data.pop("roads"))
+        results["roads"] = len(data["roads_by_geomid"])
+
+    def contacts():
+        simulator.calculate_contacts(data["roads_by_geomid"], data["roads_by_layer_number"], data["number_of_layers"])
+
+    def free_areas():
+        simulator.calculate_free_areas(data["roads_by_geomid"])
+
+    def time_stepping():
+        simulator.simulate_deposition(data["roads_by_geomid"].values(), len(data["roads_by_geomid"]))
+
+    def export():
+        with tempfile.TemporaryDirectory() as output_directory:
+            simulator.export_for_gcode(gcode_filename, simulator.road_results(data["roads_by_geomid"].values()),
+                                       os.path.join(output_directory, "export_contact_temps.gcode"),
+                                       os.path.join(output_directory, "export_time_over_tgt.gcode"))
+
+    if trace_memory:
+        tracemalloc.start()
+    for name, phase in zip(PHASES, (parsing, geometry, contacts, free_areas, time_stepping, export)):
+        if trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                phase()
+        except AssertionError:
+            results["phases"][name] = {"failed": True}
+            break
+        results["phases"][name] = {"wall_time": time.perf_counter() - start}
+        if trace_memory:
+            results["phases"][name]["peak_memory"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    if trace_memory:
+        tracemalloc.stop()
+    results["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+    return results
+
+
+def run_suite(gcode_filenames, settings, repetitions=1, trace_memory=True):
+    """
+    Runs every file in a new process (the simulator keeps module level caches). The wall times are the minimum of
+    the repetitions, the peak memory is measured in a separate run.
+    :return: the machine-readable results
+    """
+    results = {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(),
+               "machine": platform.machine(),
+               "cpu_count": os.cpu_count(),
+               "settings": {name: value for name, value in vars(simulator).items() if name.isupper() and
+                            isinstance(value, (int, float, str, bool, type(None)))},
+               "files": {}}
+    results["settings"].update(settings)
+    context = multiprocessing.get_context("spawn")
+    for gcode_filename in gcode_filenames:
+        runs = []
+        for _ in range(repetitions):
+            with context.Pool(1) as pool:
+                runs.append(pool.apply(run_phases, (gcode_filename, settings, False)))
+        # a failed run stops early, it is only taken when all repetitions failed
+        completed_runs = [run for run in runs if not any(phase.get("failed") for phase in run["phases"].values())]
+        file_results = min(completed_runs or runs,
+                           key=lambda run: sum(phase.get("wall_time", 0) for phase in run["phases"].values()))
+        if trace_memory:
+            with context.Pool(1) as pool:
+                memory_run = pool.apply(run_phases, (gcode_filename, settings, True))
+            for name, phase in memory_run["phases"].items():
+                if "peak_memory" in phase and name in file_results["phases"]:
+                    file_results["phases"][name]["peak_memory"] = phase["peak_memory"]
+        results["files"][gcode_filename] = file_results
+    return results
+
+
+def print_suite(results, baseline=None, threshold=0.1):
+    """
+    Prints the results, compared to the baseline if given.
+    :param results: see run_suite
+    :param baseline: results of an earlier run
+    :param threshold: relative increase of wall time or peak memory which is flagged as regression, a phase which
+    failed but not in the baseline is flagged as well
+    :return: number of regressions
+    """
+    regressions = 0
+    print("%-55s %-14s %12s %12s %12s %12s" % ("file", "phase", "time (s)", "baseline", "memory (MiB)", "baseline"))
+    for gcode_filename, file_results in results["files"].items():
+        baseline_phases = baseline["files"].get(gcode_filename, {}).get("phases", {}) if baseline else {}
+        for name, phase in file_results["phases"].items():
+            baseline_phase = baseline_phases.get(name, {})
+            if phase.get("failed"):
+                # a phase which passed in the baseline and fails now is a regression
+                newly_failed = "wall_time" in baseline_phase
+                regressions += newly_failed
+                print(("%-55s %-14s %12s %s" % (gcode_filename, name, "failed",
+                                                "REGRESSION failed" if newly_failed else "")).rstrip())
+                continue
+            flags = []
+            columns = []
+            for key in ("wall_time", "peak_memory"):
+                columns += [phase.get(key), baseline_phase.get(key)]
+                if None not in columns[-2:] and columns[-2] > columns[-1] * (1 + threshold):
+                    flags.append("%s +%.0f%%" % (key, (columns[-2] / columns[-1] - 1) * 100))
+            regressions += len(flags)
+            print(("%-55s %-14s %12s %12s %12s %12s %s" % ((gcode_filename, name) + tuple(
+                "-" if value is None else "%.3f" % value for value in columns) + (
+                "REGRESSION " + ", ".join(flags) if flags else "",))).rstrip())
+        print("%-55s %-14s %12s %12s %12.1f" % (gcode_filename, "max rss", "", "", file_results["max_rss"]))
+    return regressions
+
+
+def suite(arguments):
+    parser = argparse.ArgumentParser(prog="benchmark.py suite",
+                                     description="Per phase wall time and peak memory of the simulation pipeline.")
+    parser.add_argument("gcode_files", nargs="*", default=SAMPLE_FILES)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run, increases are flagged as regressions")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative increase flagged as regression")
+    parser.add_argument("--repetitions", type=int, default=1, help="the wall times are the minimum of the runs")
+    parser.add_argument("--no-memory", action="store_true", help="skip the (slow) memory measurement")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="change a module constant of the simulator, e.g. TIME_INTEGRATION=implicit")
+    arguments = parser.parse_args(arguments)
+
+    try:
+        settings = simulator.parse_constants(arguments.set)
+    except ValueError as error:
+        parser.error(str(error))
+    results = run_suite(arguments.gcode_files or SAMPLE_FILES, settings, arguments.repetitions,
+                        not arguments.no_memory)
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(results, output, indent=2)
+    baseline = None
+    if arguments.compare:
+        with open(arguments.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    regressions = print_suite(results, baseline, arguments.threshold)
+    if regressions:
+        print("%d regressions" % regressions)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    benchmarks = {"time-integration": compare_time_integration,
+                  "time-stepping": compare_time_stepping,
+                  "fast-forward": compare_cooling_fast_forward,
+                  "meshing": compare_meshing,
+                  "gcode-parser": compare_gcode_parsers,
+                  "gcode-parser-check": check_gcode_parsers,
+                  "jit": compare_jit,
+                  "threads": compare_stepping_threads,
+                  "checkpoint": compare_checkpoints,
+                  "contact-engine": compare_contact_engines,
+                  "candidate-index": compare_candidate_indexes,
+                  "active-body": compare_active_body,
+                  "travel-moves": compare_travel_coalescing,
+                  "export": measure_export,
+                  "memory": compare_memory}
+    if len(sys.argv) > 1 and sys.argv[1] == "suite":
+        suite(sys.argv[2:])
+    else:
+        benchmark = benchmarks[sys.argv[1]] if len(sys.argv) > 1 else compare_time_integration
+        benchmark(sys.argv[2:] or SAMPLE_FILES)
@@ -0,0 +1,137 @@
+"""
+Phase timers, counters and a timeline for simulator.py.
+
+The timeline is written in the Chrome trace event format (open it in chrome://tracing or https://ui.perfetto.dev),
+the totals of the phases and counters are included as "otherData". Everything is disabled by default: phase() then
+returns a shared no-op context manager and count()/sample() return immediately, so the calls can stay in the code.
+
+    instrumentation.enable(profile=True)
+    with instrumentation.phase("contacts"):
+        ...
+    instrumentation.count("time_steps")
+    instrumentation.sample("active_roads", len(active_roads))
+    instrumentation.write_trace("trace.json")
+    instrumentation.write_profile("simulator.prof")
+"""
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+
+enabled = False
+
+_NO_PHASE = contextlib.nullcontext()
+
+_events: list[dict] = []
+_phase_durations: dict[str, float] = collections.defaultdict(float)
+_phase_counts: dict[str, int] = collections.defaultdict(int)
+_counters: dict[str, int] = collections.defaultdict(int)
+_profile: cProfile.Profile = None
+_start_ns = 0
+
+
+def enable(profile=False):
+    """
+    Starts recording, previous recordings are discarded.
+    :param profile: additionally run cProfile until disable(), see write_profile
+    """
+    global enabled, _profile, _start_ns
+    reset()
+    enabled = True
+    _start_ns = time.perf_counter_ns()
+    if profile:
+        _profile = cProfile.Profile()
+        _profile.enable()
+
+
+def disable():
+    """Stops recording, the recorded data is kept until the next enable()."""
+    global enabled
+    enabled = False
+    if _profile is not None:
+        _profile.disable()
+
+
+def reset():
+    global _profile
+    _events.clear()
+    _phase_durations.clear()
+    _phase_counts.clear()
+    _counters.clear()
+    _profile = None
+
+
+def phase(name: str):
+    """
+    :param name:
+    :return: context manager timing the enclosed code as phase
+    """
+    if not enabled:
+        return _NO_PHASE
+    return _Phase(name)
+
+
+class _Phase(object):
+    __slots__ = 'name', 'start_ns'
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration_ns = time.perf_counter_ns() - self.start_ns
+        _phase_durations[self.name] += duration_ns * 1e-9
+        _phase_counts[self.name] += 1
+        _events.append({"name": self.name, "ph": "X", "ts": (self.start_ns - _start_ns) / 1000,
+                        "dur": duration_ns / 1000, "pid": os.getpid(), "tid": threading.get_ident()})
+        return False
+
+
+def count(name: str, value: int = 1):
+    """Adds the value to the counter with the given name."""
+    if not enabled:
+        return
+    _counters[name] += value
+
+
+def sample(name: str, value: float):
+    """Records the current value of a quantity (e.g. the number of simulated roads) in the timeline."""
+    if not enabled:
+        return
+    _events.append({"name": name, "ph": "C", "ts": (time.perf_counter_ns() - _start_ns) / 1000,
+                    "pid": os.getpid(), "args": {name: value}})
+
+
+def summary() -> dict:
+    """
+    :return: total duration in seconds and number of calls per phase, the counters
+    """
+    return {"phases": {name: {"duration": duration, "count": _phase_counts[name]}
+                       for name, duration in _phase_durations.items()},
+            "counters": dict(_counters)}
+
+
+def print_summary():
+    recorded = summary()
+    for name, phase_summary in recorded["phases"].items():
+        print("%-30s %10.3f s %8d calls" % (name, phase_summary["duration"], phase_summary["count"]))
+    for name, value in recorded["counters"].items():
+        print("%-30s %10d" % (name, value))
+
+
+def write_trace(filename: str):
+    """Writes the timeline in the Chrome trace event format, with the summary as otherData."""
+    with open(filename, "w") as trace_file:
+        json.dump({"traceEvents": _events, "displayTimeUnit": "ms", "otherData": summary()}, trace_file)
+
+
+def write_profile(filename: str):
+    """Writes the cProfile statistics (readable with pstats or snakeviz), only if enabled with profile=True."""
+    if _profile is not None:
+        _profile.dump_stats(filename)
@@ -1,15 +1,30 @@
+import ast
 import collections
+import concurrent.futures
+import contextlib
 from collections import OrderedDict
 
+import functools
+import hashlib
 import math
 import itertools
-import re
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from typing import Callable, Iterable, Iterator
 
+import numpy as np
 import shapely.geometry
 import shapely.strtree
 import shapely.speedups
 from shapely.geometry.point import Point
 
+import instrumentation
+
 assert shapely.speedups.enabled
 
 MINIMUM_CONTACT_AREA = 0.02
@@ -26,6 +41,31 @@ MINIMUM_SEGMENT_LENGTH = XY_PRINTER_RESOLUTION
 # the maximum resolution of the thermal simulation
 MAXIMUM_SEGMENT_LENGTH = 2  # mm
 
+# Meshing of the moves into the roads of the simulation (see mesh_road_arrays), so the number of roads (and with it the
+# simulation cost) no longer depends on the slicer: successive extrusions in the same direction (within
+# MESH_ANGLE_TOLERANCE radians) and short successive extrusions are merged into roads of about MINIMUM_ELEMENT_LENGTH,
+# roads longer than MAXIMUM_SEGMENT_LENGTH are split into equal parts. The roads are numbered like the gcode lines
+# (gcode_line_number) shifted by the number of added and removed roads, so successive roads still differ by 1. Their
+# gcode lines are first_line_number to last_line_number, main maps the results back to the gcode lines (see
+# line_results). Not supported by STREAMING and the parameter sweep.
+MESH_ROADS = False
+MINIMUM_ELEMENT_LENGTH = 0.5  # mm
+MESH_ANGLE_TOLERANCE = 0.001  # radians
+
+# "lines" parses line by line with gcode_moves, "chunks" tokenizes large binary chunks with gcode_move_batches
+GCODE_PARSER = "chunks"
+
+# processes used by calculate_contacts, 1 calculates in this process, None uses all cores
+CONTACT_DETECTION_PROCESSES = 1
+# "shapely" intersects the buffered geometries, "analytic" calculates the same areas of the road rectangles with numpy
+CONTACT_ENGINE = "shapely"
+# candidate pairs of the "analytic" engine: "sweep" sorts the envelopes of the roads by x (_overlapping_envelopes),
+# "grid" bins them into a uniform grid like reference/thermaljs/Bins.js (_grid_overlapping_envelopes). Both find the
+# same pairs, the grid needs less memory for long roads spanning the part in x.
+CONTACT_CANDIDATE_INDEX = "sweep"
+# edge length of the grid cells, None uses the mean envelope size of the layer
+CONTACT_GRID_CELL_SIZE = None  # mm
+
 NOZZLE_AREA = 0.25 * math.pi * (FILAMENT_DIAMETER ** 2)  # mm^2
 
 # material constants
@@ -44,6 +84,9 @@ EMISSIVITY = 0.92
 # "gap conductance between roads" = 100 (Yaqi Zhang)
 # https://doi.org/10.1122/1.5093033 uses a value between 1000 und 10000 (3000)
 HC_ROAD = 3000
+# "conduction" through the thickness of both roads (calculate_contact_conduction), "gap_conductance" uses HC_ROAD per
+# contact area (calculate_contact_convection)
+CONTACT_HEAT_TRANSFER = "conduction"
 
 # Heat transfer coefficient (Wärmeübergangskoeffizient) in W/(m²*K)
 # ~100 when using strong cooling (impingment cooling directly after plastic sheet extrusion, from literature)
@@ -57,6 +100,115 @@ BOLTZMAN_CONSTANT = 5.6703e-8
 abs_zero_temp = -273.15
 ENVIRONMENT_TEMPERATURE_IN_KELVIN = environment_temperature - abs_zero_temp
 
+# "python" steps every road with calculate_temperature, "numpy" uses the vectorized RoadStore kernel.
+# Both give bitwise identical temperatures (checked on cube_test, cylinder_fast and uberhangtest_6s).
+# "numba" is the "numpy" engine with the explicit time step and the product of the implicit solver compiled by numba
+# (see _numba_kernels), bitwise identical as well. numba is optional, without it the "numpy" kernel is used. The compiled code is cached in
+# __pycache__ (or NUMBA_CACHE_DIR), only the first run compiles (some seconds).
+SIMULATION_ENGINE = "numpy"
+# Threads of the "numba" engine for a time step: the simulated roads are split into blocks of consecutive roads
+# (successive roads touch, so most contacts stay within a block) with a similar number of contacts, each block is
+# updated by a compiled kernel without the GIL. Every block reads the temperatures of the previous step (the previous
+# solver iterate for the implicit integration) and writes its own rows, so the results do not depend on the number of
+# threads. Blocks have at least STEPPING_MINIMUM_BLOCK_ROADS roads, smaller steps run in the calling thread. Dispatching
+# a block costs some 10 µs, the kernels some 20-100 ns per road, so a block of 256 roads already does a few times the
+# work of its dispatch (e.g. the about 1100 simulated roads of CFFFP_bridge-torture-test_50mm are split into 4 blocks).
+STEPPING_THREADS = 1
+STEPPING_MINIMUM_BLOCK_ROADS = 256
+
+# "explicit" is the forward Euler step of calculate_temperature, "implicit" solves the sparse conduction system
+# (only with the "numpy" engine). IMPLICIT_THETA = 1 is backward Euler, 0.5 is Crank-Nicolson.
+TIME_INTEGRATION = "explicit"
+IMPLICIT_THETA = 1.0
+IMPLICIT_SOLVER_TOLERANCE = 0.001  # K
+
+# 0.5s lead to problems with temperatures being too high (>extrusion temp) or too low (<environment)
+MAX_SIMULATION_TIME_STEP = 0.2  # seconds
+MIN_SIMULATION_TIME_STEP = 0.1  # seconds
+# the implicit integration is unconditionally stable, the step size is limited by the accuracy only
+IMPLICIT_MAX_SIMULATION_TIME_STEP = 5.0  # seconds
+IMPLICIT_MIN_SIMULATION_TIME_STEP = 0.5  # seconds
+# "fixed" splits the time between two roads into steps of the maximum time step above, "adaptive" chooses every step
+# from the current temperatures (see RoadStore.adaptive_time_step): short steps right after a deposition, long ones in
+# the pauses. No road may change by more than ADAPTIVE_TEMPERATURE_CHANGE per step at its current rate, the explicit
+# integration is additionally limited to ADAPTIVE_STABILITY_FACTOR times its stability limit. A remainder shorter than
+# ADAPTIVE_MIN_TIME_STEP is simulated with the next road. Only with the "numpy" engine, not used by the parameter sweep.
+TIME_STEPPING = "fixed"
+ADAPTIVE_TEMPERATURE_CHANGE = 10.0  # K
+ADAPTIVE_MIN_TIME_STEP = 0.1  # seconds
+ADAPTIVE_MAX_TIME_STEP = 10.0  # seconds
+ADAPTIVE_STABILITY_FACTOR = 0.9
+# Cooling fast-forward (only with the "numpy" engine, not used by the parameter sweep): at the start of every gap of at
+# least FAST_FORWARD_MIN_DURATION between two moves (layer pauses, long travel moves) the weakly coupled roads are taken
+# out of the time steps of the gap and advanced over the whole gap at once (see RoadStore.fast_forward). A road is
+# weakly coupled when none of its contacts is hotter and the conduction to its contacts is at most
+# FAST_FORWARD_COUPLING times its convection and radiation. It cools by convection and radiation only, along the
+# tabulated exact solution (see cooling_curve), and its time above the HDT ends at the crossing time. For the other
+# roads it keeps the temperature of the start of the gap until the end of the gap, like the roads outside the active
+# body.
+COOLING_FAST_FORWARD = False
+FAST_FORWARD_MIN_DURATION = 1.0  # seconds
+FAST_FORWARD_COUPLING = 0.05
+
+# Active body, see reference/thermaljs/ActiveBody.js (only with the "numpy" engine). When enabled only the roads deposited
+# within ACTIVE_TIME, the last N_CORE_ELEMENTS roads and their contacts up to NEIGHBOR_DEPTH contacts away are simulated.
+# Roads above ACTIVE_BODY_RETIREMENT_TEMPERATURE stay in the active body (None disables it), this bounds the active body
+# by the hot roads instead of the size of the part. The other roads keep their temperature and act as boundary, cold
+# roads are still removed as without the active body.
+ACTIVE_BODY = False
+ACTIVE_TIME = 8.0  # seconds
+N_CORE_ELEMENTS = 200
+NEIGHBOR_DEPTH = 3
+ACTIVE_BODY_RETIREMENT_TEMPERATURE = 50.0  # above the HDT (80) roads freeze while still deforming
+
+# phase timers and counters of instrumentation.py, main writes them as Chrome trace to TRACE_FILENAME
+INSTRUMENTATION = False
+TRACE_FILENAME = "trace.json"
+PROFILE_FILENAME = None  # writes the cProfile statistics of main when set
+
+# Temperature history of the roads, see reference/thermaljs/TempHistory.js (only with the "numpy" engine). A sample is
+# only kept when the time or temperature differs by more than TIME_SAMPLE_RATE or TEMPERATURE_SAMPLE_RATE from the last
+# kept sample of the road. The samples are collected in arrays of TEMPERATURE_HISTORY_MEMORY_BUDGET bytes and appended
+# to TEMPERATURE_HISTORY_FILENAME whenever they are full, see TemperatureHistory and read_temperature_history.
+TEMPERATURE_HISTORY = False
+TEMPERATURE_HISTORY_FILENAME = "temperature_history.bin"
+TEMPERATURE_HISTORY_ROADS = None  # gcode line numbers of the recorded roads, None records all roads
+TEMPERATURE_HISTORY_MEMORY_BUDGET = 64 * 1024 ** 2  # bytes
+TIME_SAMPLE_RATE = 0.3  # seconds
+TEMPERATURE_SAMPLE_RATE = 8.0  # K
+
+# Lean roads for large prints: no Road objects and no geometries are kept (see prepare_road_arrays and LeanRoadStore),
+# the roads are addressed by their index and the contacts are index/area arrays. Same results, only with the "numpy"
+# engine. Not used by the parameter sweep.
+LEAN_ROADS = False
+
+# Streaming for prints which do not fit into the memory: the gcode is read, the contacts are calculated and the roads
+# are simulated layer by layer (see simulate_streaming) and the results of the retired roads are written to the result
+# file right away, only the layers which can still change are kept. Apart from them the memory is bounded by
+# GCODE_CHUNK_SIZE (reading and exporting the gcode), lower it for very large files. Same results as LEAN_ROADS, only
+# with the "numpy" engine. The road cache, CONTACT_DETECTION_PROCESSES and the temperature history are not supported.
+STREAMING = False
+
+# Travel moves (no extrusion, e.g. retractions and zero length moves) after a road are no Road objects: their durations
+# are added up in road.travel_duration and simulated as one time advance after the road, with the layer number of the
+# last of them (road.travel_layer_number). The layer changes are still read from every move. The results differ from
+# the simulation of every travel move by the different time steps only, the travel moves are not in the results
+# (except the ones before the first road). Not supported by STREAMING.
+COALESCE_TRAVEL_MOVES = False
+
+# Cache of the roads with their contacts and free areas (the result of everything before the simulation), keyed by the
+# gcode content and the constants changing the geometry. None disables the cache. The least recently used files are
+# removed when the directory gets larger than ROAD_CACHE_MAXIMUM_SIZE.
+ROAD_CACHE_DIRECTORY = None
+ROAD_CACHE_MAXIMUM_SIZE = 1024 ** 3  # bytes
+
+# Checkpoints of long simulations (see LeanRoadStore.checkpoint): the state of the simulation is written to
+# CHECKPOINT_FILENAME at the first layer change after every CHECKPOINT_INTERVAL seconds of wall time. A simulation of
+# the same roads with the same constants resumes from the checkpoint with the same results, the file is removed at the
+# end of the simulation. None disables the checkpoints. Only with LEAN_ROADS and without the temperature history.
+CHECKPOINT_FILENAME = None
+CHECKPOINT_INTERVAL = 300.0  # seconds
+
 
 class Road(object):
     """
@@ -78,13 +230,33 @@ class Road(object):
                 'temperature', \
                 'heat_capacity', \
                 'duration_temp_above_hdt', \
-                'avg_contact_temperatures_at_deposition'
+                'avg_contact_temperatures_at_deposition', \
+                'index', \
+                'contact_area_bottom', \
+                'contact_area_top', \
+                'contact_area_sides', \
+                'contact_area_total', \
+                'travel_duration', \
+                'travel_layer_number', \
+                'first_line_number', \
+                'last_line_number'
 
     def __init__(self):
         # road: contact_area
         self.contacts: dict[Road, float] = dict()
+        # sums of the contact areas in insertion order, kept up to date by calculate_road_free_area/add_road_contact
+        self.contact_area_bottom = 0.0
+        self.contact_area_top = 0.0
+        self.contact_area_sides = 0.0
+        self.contact_area_total = 0.0
         self.duration_temp_above_hdt = 0
         self.avg_contact_temperatures_at_deposition = 0
+        # the joined travel moves after the road, see COALESCE_TRAVEL_MOVES
+        self.travel_duration = 0.0
+        self.travel_layer_number = 0
+        # the gcode lines of the road, see MESH_ROADS
+        self.first_line_number = 0
+        self.last_line_number = 0
 
     def __str__(self) -> str:
         return "Road (gcode_line_number=%s, layer_number=%s)" % (self.gcode_line_number, self.layer_number)
@@ -174,20 +346,337 @@ def convert_move_to_road(move, position_and_state):
     return road, position_and_state
 
 
-def split_road(road, maximum_segment_length):
+# fields of the move batches of gcode_move_batches, missing fields are nan
+GCODE_MOVE_DTYPE = np.dtype([("gcode_line_number", np.int64), ("X", float), ("Y", float), ("Z", float), ("E", float),
+                             ("F", float)])
+GCODE_CHUNK_SIZE = 16 * 1024 * 1024  # bytes
+# longest number in a X/Y/Z/E/F field
+_GCODE_MAXIMUM_FIELD_LENGTH = 24
+_GCODE_FIELDS = ("X", "Y", "Z", "E", "F")
+# lookup tables by character code
+_GCODE_WHITESPACE = np.zeros(256, dtype=bool)
+_GCODE_WHITESPACE[[ord(" "), ord("\t"), ord("\r"), ord("\n")]] = True
+_GCODE_FIELD_INDEXES = np.full(256, -1, dtype=np.int8)
+_GCODE_FIELD_INDEXES[[ord(field) for field in _GCODE_FIELDS]] = np.arange(len(_GCODE_FIELDS))
+_POWERS_OF_TEN = 10.0 ** np.arange(_GCODE_MAXIMUM_FIELD_LENGTH)
+_INTEGER_POWERS_OF_TEN = 10 ** np.arange(19, dtype=np.int64)
+
+
+def gcode_move_batches(file_path, chunk_size: int = None):
     """
-    Split a road into multiple ones, each shorter than the given length. This increases the simulation resolution.
-    :param road:
-    :param maximum_segment_length: float
-    :return:
+    Fast alternative to gcode_moves for large files. The file is read in binary chunks and every chunk is tokenized
+    with numpy at once, no dict or string is created per line.
+    :param file_path:
+    :param chunk_size: bytes read at once, None uses GCODE_CHUNK_SIZE
+    :return: generator of arrays with GCODE_MOVE_DTYPE, one array per chunk
+    """
+    if chunk_size is None:
+        chunk_size = GCODE_CHUNK_SIZE
+    first_line_number = 1
+    remainder = b""
+    with open(file_path, "rb") as gcode_file:
+        while True:
+            data = gcode_file.read(chunk_size)
+            if not data:
+                if remainder:
+                    yield _tokenize_gcode_chunk(remainder + b"\n", first_line_number)
+                return
+            data = remainder + data
+            last_line_end = data.rfind(b"\n") + 1
+            remainder = data[last_line_end:]
+            if last_line_end:
+                yield _tokenize_gcode_chunk(data[:last_line_end], first_line_number)
+                first_line_number += data.count(b"\n", 0, last_line_end)
+
+
+def _tokenize_gcode_chunk(chunk: bytes, first_line_number: int) -> np.ndarray:
+    """
+    Returns the G0/G1 moves of the chunk, which has to consist of complete lines.
+    Like gcode_moves every line starting with G0 or G1 is a move and the fields are separated by whitespace.
+    Comments (after ";") are ignored.
+    """
+    characters = np.frombuffer(chunk, dtype=np.uint8)
+    line_ends = np.flatnonzero(characters == ord("\n"))
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+    # an empty last line starts at the last character (a line end), its second character is outside of the chunk
+    second_characters = characters[np.minimum(line_starts + 1, len(characters) - 1)]
+    is_move = (characters[line_starts] == ord("G")) & \
+              ((second_characters == ord("0")) | (second_characters == ord("1")))
+    move_positions = np.cumsum(is_move) - 1
+    moves = np.empty(np.count_nonzero(is_move), dtype=GCODE_MOVE_DTYPE)
+    moves["gcode_line_number"] = first_line_number + np.flatnonzero(is_move)
+    for field in _GCODE_FIELDS:
+        moves[field] = np.nan
+
+    # a comment starts at the first ";" of a line
+    comments = np.flatnonzero(characters == ord(";"))
+    comment_lines, first_comments = np.unique(np.searchsorted(line_ends, comments), return_index=True)
+    line_content_ends = line_ends.copy()
+    line_content_ends[comment_lines] = comments[first_comments]
+
+    # a field is a token starting with one of the field letters
+    is_whitespace = _GCODE_WHITESPACE[characters]
+    token_starts = np.flatnonzero(is_whitespace[:-1] & ~is_whitespace[1:]) + 1
+    fields = _GCODE_FIELD_INDEXES[characters[token_starts]]
+    token_starts, fields = token_starts[fields >= 0], fields[fields >= 0]
+    lines = np.searchsorted(line_ends, token_starts)
+    in_move = is_move[lines] & (token_starts < line_content_ends[lines])
+    token_starts, fields, lines = token_starts[in_move], fields[in_move], lines[in_move]
+    if len(token_starts) == 0:
+        return moves
+
+    number_starts = token_starts + 1
+    delimiters = np.flatnonzero(is_whitespace | (characters == ord(";")))
+    number_lengths = delimiters[np.searchsorted(delimiters, number_starts)] - number_starts
+    numbers = np.empty(len(number_starts))
+    # the rare numbers longer than _GCODE_MAXIMUM_FIELD_LENGTH (e.g. with many decimals) are parsed one by one
+    is_long = number_lengths > _GCODE_MAXIMUM_FIELD_LENGTH
+    for position in np.flatnonzero(is_long):
+        numbers[position] = float(chunk[number_starts[position]:number_starts[position] + number_lengths[position]])
+    if not is_long.all():
+        short_starts, short_lengths = number_starts[~is_long], number_lengths[~is_long]
+        # fixed width copies of the numbers, padded with zero bytes (the last line end stops the longest one)
+        offsets = np.arange(short_lengths.max())
+        number_characters = characters[np.minimum(short_starts[:, None] + offsets, len(characters) - 1)]
+        number_characters[offsets >= short_lengths[:, None]] = 0
+        numbers[~is_long] = _parse_numbers(number_characters, short_lengths)
+    for field_index, field in enumerate(_GCODE_FIELDS):
+        of_field = fields == field_index
+        moves[field][move_positions[lines[of_field]]] = numbers[of_field]
+    return moves
+
+
+def _parse_numbers(number_characters: np.ndarray, number_lengths: np.ndarray) -> np.ndarray:
+    """
+    Parses fixed width rows of ASCII numbers (padded with zero bytes). Plain decimals are computed as integer mantissa
+    divided by a power of ten, both are exact so the result is rounded like float(). Everything else (e.g. exponents)
+    is left to numpy.
+    """
+    digits = number_characters - np.uint8(ord("0"))  # wraps around for all other characters
+    is_digit = digits <= 9
+    is_point = number_characters == ord(".")
+    signs = (number_characters[:, 0] == ord("-")) | (number_characters[:, 0] == ord("+"))
+    if number_characters.shape[1] > 15 or \
+            np.count_nonzero(is_digit) + np.count_nonzero(is_point) + np.count_nonzero(signs) != number_lengths.sum():
+        return number_characters.view("S%s" % number_characters.shape[1]).ravel().astype(float)
+    mantissas = np.zeros(len(number_characters), dtype=np.int64)
+    for column in range(number_characters.shape[1]):
+        mantissas = np.where(is_digit[:, column], mantissas * 10 + digits[:, column], mantissas)
+    point_columns = is_point.argmax(axis=1)
+    decimals = np.where(is_point[np.arange(len(point_columns)), point_columns], number_lengths - point_columns - 1, 0)
+    numbers = mantissas / _POWERS_OF_TEN[decimals]
+    return np.where(number_characters[:, 0] == ord("-"), -numbers, numbers)
+
+
+# attributes of the roads set by convert_move_batch_to_arrays
+_ROAD_MOVE_FIELDS = ("gcode_line_number", "layer_number", "layer_height", "start_x", "start_y", "end_x", "end_y",
+                     "length", "duration", "width")
+
+
+def convert_move_batch_to_roads(moves: np.ndarray, position_and_state) -> tuple[list[Road], dict]:
+    """
+    Same as convert_move_to_road for a whole batch of gcode_move_batches, see convert_move_batch_to_arrays.
+    :param moves: array with GCODE_MOVE_DTYPE
+    :param position_and_state: the state before the first move, see convert_move_to_road
+    :return: roads and the state after the last move
+    """
+    arrays, position_and_state = convert_move_batch_to_arrays(moves, position_and_state)
+    return _roads_from_move_arrays(arrays), position_and_state
+
+
+def _roads_from_move_arrays(arrays: dict[str, np.ndarray]) -> list[Road]:
+    roads = []
+    for (gcode_line_number, layer_number, layer_height, road_start_x, road_start_y, road_end_x, road_end_y,
+         length, duration, width) in zip(*(arrays[field].tolist() for field in _ROAD_MOVE_FIELDS)):
+        road = Road()
+        road.gcode_line_number = gcode_line_number
+        road.layer_number = layer_number
+        road.layer_height = layer_height
+        road.start_x = road_start_x
+        road.start_y = road_start_y
+        road.end_x = road_end_x
+        road.end_y = road_end_y
+        road.length = length
+        road.duration = duration
+        road.width = width
+        roads.append(road)
+    return roads
+
+
+def convert_move_batch_to_arrays(moves: np.ndarray, position_and_state) -> tuple[dict[str, np.ndarray], dict]:
+    """
+    The roads of a batch of gcode_move_batches as one array per attribute (_ROAD_MOVE_FIELDS). The positions, feed
+    rates and layers are carried forward with numpy, only the (few) moves with a Z field are looked at one by one.
+    :param moves: array with GCODE_MOVE_DTYPE
+    :param position_and_state: the state before the first move, see convert_move_to_road
+    :return: the arrays and the state after the last move
+    """
+    count = len(moves)
+    if count == 0:
+        return {field: np.zeros(0, dtype=np.int64 if field in ("gcode_line_number", "layer_number") else float)
+                for field in _ROAD_MOVE_FIELDS}, position_and_state
+
+    def carry_forward(field):
+        # the value of the last move having this field, the value of the state before the first one
+        last_given = np.maximum.accumulate(np.where(np.isnan(moves[field]), 0, np.arange(1, count + 1)))
+        return np.concatenate(([position_and_state[field]], moves[field]))[last_given]
+
+    # layer changes, see convert_move_to_road
+    initial_layer_height = position_and_state["layer_height"]
+    layer_changes = np.zeros(count, dtype=bool)
+    changed_layer_heights = np.zeros(count)
+    for position in np.flatnonzero(~np.isnan(moves["Z"])).tolist():
+        new_z_position = moves["Z"][position].item()
+        layer_height = new_z_position - position_and_state["Z"]
+        if layer_height < 0:
+            # illegal move (positioning at the beginning)
+            layer_height = new_z_position
+        if layer_height < 1:
+            # when layer height is too high for extrusion, skip this
+            position_and_state["Z"] = new_z_position
+            position_and_state["layer_height"] = layer_height
+            layer_changes[position] = True
+            changed_layer_heights[position] = layer_height
+    layer_numbers = position_and_state["layer_number"] + np.cumsum(layer_changes)
+    last_change = np.maximum.accumulate(np.where(layer_changes, np.arange(1, count + 1), 0))
+    layer_heights = np.concatenate(([initial_layer_height], changed_layer_heights))[last_change]
+
+    end_x = carry_forward("X")
+    start_x = np.concatenate(([position_and_state["X"]], end_x[:-1]))
+    end_y = carry_forward("Y")
+    start_y = np.concatenate(([position_and_state["Y"]], end_y[:-1]))
+    feed_rates = carry_forward("F")
+    extruder_positions = carry_forward("E")
+    extruder_moves = extruder_positions - np.concatenate(([position_and_state["E"]], extruder_positions[:-1]))
+
+    # math.hypot gives bitwise the same lengths as the math.dist of convert_move_to_road
+    lengths = np.array(list(map(math.hypot, (end_x - start_x).tolist(), (end_y - start_y).tolist())))
+    durations = lengths / (feed_rates / 60)
+    extrusions = ~np.isnan(moves["E"]) & (lengths > 0)
+    widths = np.zeros(count)
+    widths[extrusions] = extruder_moves[extrusions] * NOZZLE_AREA / \
+        (lengths[extrusions] * layer_heights[extrusions])
+
+    position_and_state["X"] = end_x[-1].item()
+    position_and_state["Y"] = end_y[-1].item()
+    position_and_state["E"] = extruder_positions[-1].item()
+    position_and_state["F"] = feed_rates[-1].item()
+    position_and_state["layer_number"] = layer_numbers[-1].item()
+    return {"gcode_line_number": moves["gcode_line_number"].astype(np.int64), "layer_number": layer_numbers,
+            "layer_height": layer_heights, "start_x": start_x, "start_y": start_y, "end_x": end_x, "end_y": end_y,
+            "length": lengths, "duration": durations, "width": widths}, position_and_state
+
+
+def mesh_road_arrays(arrays: dict[str, np.ndarray], minimum_element_length: float, maximum_element_length: float,
+                     angle_tolerance: float) -> dict[str, np.ndarray]:
     """
-    # todo: implement when the simulation is running actually
-    return road,
+    Meshes the moves (see MESH_ROADS) like Simulation.mesh/addRoad of reference/thermaljs, vectorized: successive
+    extrusions (on successive gcode lines in the same layer) are merged when they are collinear or start within the
+    same minimum_element_length along their run of successive extrusions, then every road longer than
+    maximum_element_length is split into equal parts. A merged road has the summed length and duration and the length
+    weighted mean width (the extruded volume is kept). Travel moves are kept.
+    :param arrays: the moves (_ROAD_MOVE_FIELDS), e.g. of parse_road_arrays
+    :param minimum_element_length: mm, 0 merges the collinear extrusions only
+    :param maximum_element_length: mm
+    :param angle_tolerance: radians between collinear extrusions
+    :return: the roads (_ROAD_MOVE_FIELDS, first_line_number and last_line_number), a move which is neither merged
+    nor split keeps its values and gcode_line_number
+    """
+    line_numbers = arrays["gcode_line_number"]
+    count = len(line_numbers)
+    if count == 0:
+        return dict(arrays, first_line_number=line_numbers.copy(), last_line_number=line_numbers.copy())
+    extrusion = arrays["width"] > 0
+    length = arrays["length"]
+    delta_x = arrays["end_x"] - arrays["start_x"]
+    delta_y = arrays["end_y"] - arrays["start_y"]
+    # the move continues the previous extrusion
+    connected = np.zeros(count, dtype=bool)
+    connected[1:] = extrusion[1:] & extrusion[:-1] & (line_numbers[1:] == line_numbers[:-1] + 1) & \
+        (arrays["layer_number"][1:] == arrays["layer_number"][:-1]) & \
+        (arrays["layer_height"][1:] == arrays["layer_height"][:-1])
+    collinear = connected.copy()
+    collinear[1:] &= (delta_x[1:] * delta_x[:-1] + delta_y[1:] * delta_y[:-1] > 0) & \
+        (np.abs(delta_x[:-1] * delta_y[1:] - delta_y[:-1] * delta_x[1:]) <= angle_tolerance * length[1:] * length[:-1])
+
+    # the short groups of collinear moves are merged with the following ones starting in the same
+    # minimum_element_length of the run
+    group_starts = np.flatnonzero(~collinear)
+    group_lengths = np.add.reduceat(length, group_starts)
+    run_starts = ~connected[group_starts]
+    new_road = run_starts.copy()
+    if minimum_element_length > 0:
+        group_positions = np.cumsum(group_lengths) - group_lengths
+        group_positions -= group_positions[run_starts][np.cumsum(run_starts) - 1]  # along the run
+        bins = np.floor(group_positions / minimum_element_length)
+        new_road[1:] |= bins[1:] != bins[:-1]
+    else:
+        new_road[:] = True
+    road_starts = group_starts[new_road]
+    road_ends = np.append(road_starts[1:], count) - 1
+    merged = road_ends > road_starts
+    roads = {field: arrays[field][road_starts] for field in _ROAD_MOVE_FIELDS}
+    roads["end_x"] = arrays["end_x"][road_ends]
+    roads["end_y"] = arrays["end_y"][road_ends]
+    merged_length = np.add.reduceat(length, road_starts)
+    roads["width"] = np.where(merged, np.add.reduceat(arrays["width"] * length, road_starts) /
+                              np.where(merged, merged_length, 1), roads["width"])
+    roads["length"] = np.where(merged, merged_length, roads["length"])
+    roads["duration"] = np.where(merged, np.add.reduceat(arrays["duration"], road_starts), roads["duration"])
+    first_line_numbers = line_numbers[road_starts]
+    last_line_numbers = line_numbers[road_ends]
+
+    # split into parts of at most maximum_element_length
+    parts = np.where(roads["width"] > 0, np.maximum(np.ceil(roads["length"] / maximum_element_length), 1), 1) \
+        .astype(np.int64)
+    road_indexes = np.repeat(np.arange(len(parts)), parts)
+    part = np.arange(len(road_indexes)) - np.repeat(np.cumsum(parts) - parts, parts)
+    part_count = parts[road_indexes]
+    meshed = {field: values[road_indexes] for field, values in roads.items()}
+    for axis in ("x", "y"):
+        start = meshed["start_" + axis]
+        end = meshed["end_" + axis]
+        meshed["start_" + axis] = np.where(part == 0, start, start + (end - start) * part / part_count)
+        meshed["end_" + axis] = np.where(part + 1 == part_count, end, start + (end - start) * (part + 1) / part_count)
+    meshed["length"] = meshed["length"] / part_count
+    meshed["duration"] = meshed["duration"] / part_count
+    # the gcode line numbers shifted by the roads added before and removed before
+    shifts = parts - 1 - (last_line_numbers - first_line_numbers)
+    meshed["gcode_line_number"] = (first_line_numbers + np.cumsum(shifts) - shifts)[road_indexes] + part
+    # the gcode lines of a part are the ones of the moves it overlaps along the merged road
+    move_ends = np.cumsum(length)
+    move_starts = move_ends - length
+    part_ends = move_starts[road_starts][road_indexes] + roads["length"][road_indexes] * (part + 1) / part_count
+    last_moves = np.where(part + 1 == part_count, road_ends[road_indexes],
+                          np.clip(np.searchsorted(move_starts, part_ends) - 1, road_starts[road_indexes],
+                                  road_ends[road_indexes]))
+    first_moves = road_starts[road_indexes]
+    first_moves[1:] = np.where(part[1:] == 0, first_moves[1:],
+                               last_moves[:-1] + (move_ends[last_moves[:-1]] <= part_ends[:-1]))
+    meshed["first_line_number"] = line_numbers[np.minimum(first_moves, last_moves)]
+    meshed["last_line_number"] = line_numbers[last_moves]
+    return meshed
+
+
+def mesh_roads(roads: Iterable[Road]) -> list[Road]:
+    """mesh_road_arrays with the MESH_ROADS constants for Road objects"""
+    roads = list(roads)
+    meshed = mesh_road_arrays({field: np.array([getattr(road, field) for road in roads],
+                                               dtype=np.int64 if field in ("gcode_line_number", "layer_number")
+                                               else float) for field in _ROAD_MOVE_FIELDS},
+                              MINIMUM_ELEMENT_LENGTH, MAXIMUM_SEGMENT_LENGTH, MESH_ANGLE_TOLERANCE)
+    meshed_roads = _roads_from_move_arrays(meshed)
+    for road, first_line_number, last_line_number in zip(meshed_roads, meshed["first_line_number"].tolist(),
+                                                         meshed["last_line_number"].tolist()):
+        road.first_line_number = first_line_number
+        road.last_line_number = last_line_number
+    return meshed_roads
 
 
 def calculate_road_free_area(road: Road) -> float:
     """
     Calculates the free area of a road.
+    Also sets the contact area sums of the road which are used by add_road_contact.
     :param road:
     :return:
     """
@@ -195,56 +684,102 @@ def calculate_road_free_area(road: Road) -> float:
     surface_topbottom = road.length * road.width
     surface_sides = 2 * (road.layer_height * road.length) + 2 * (road.layer_height * road.width)
 
-    contact_bottom = sum([contact_area for contact_road, contact_area in road.contacts.items() if
-                          contact_road.layer_number == road.layer_number - 1])
+    contact_bottom = contact_top = contact_sides = total_contact_area = 0.0
+    for contact_road, contact_area in road.contacts.items():
+        if contact_road.layer_number == road.layer_number - 1:
+            contact_bottom += contact_area
+        elif contact_road.layer_number == road.layer_number + 1:
+            contact_top += contact_area
+        elif contact_road.layer_number == road.layer_number:
+            contact_sides += contact_area
+        total_contact_area += contact_area
+
     # if this is too much then reduce all contact areas by the ratio
+    reduced = False
     if contact_bottom > surface_topbottom * 1.0001:
-        area_reduction_factor = surface_topbottom/contact_bottom
-        assert(area_reduction_factor < 1)
-        for contact_road, contact_area in road.contacts.items():
-            if contact_road.layer_number == road.layer_number - 1:
-                road.contacts[contact_road] = contact_area * area_reduction_factor
-    contact_bottom = sum([contact_area for contact_road, contact_area in road.contacts.items() if
-                          contact_road.layer_number == road.layer_number - 1])
+        contact_bottom = _reduce_contact_areas(road, road.layer_number - 1, surface_topbottom / contact_bottom)
+        reduced = True
     assert (contact_bottom < surface_topbottom * 1.0001)
 
-    contact_top = sum([contact_area for contact_road, contact_area in road.contacts.items() if
-                       contact_road.layer_number == road.layer_number + 1])
-    # if this is too much then reduce all contact areas by the ratio
     if contact_top > surface_topbottom * 1.0001:
-        area_reduction_factor = surface_topbottom/contact_top
-        assert(area_reduction_factor < 1)
-        for contact_road, contact_area in road.contacts.items():
-            if contact_road.layer_number == road.layer_number + 1:
-                road.contacts[contact_road] = contact_area * area_reduction_factor
-    contact_top = sum([contact_area for contact_road, contact_area in road.contacts.items() if
-                       contact_road.layer_number == road.layer_number + 1])
+        contact_top = _reduce_contact_areas(road, road.layer_number + 1, surface_topbottom / contact_top)
+        reduced = True
     assert (contact_top < surface_topbottom * 1.0001)
 
-    contact_sides = sum([contact_area for contact_road, contact_area in road.contacts.items() if
-                         contact_road.layer_number == road.layer_number])
     if contact_sides > surface_sides * 1.0001:
-        area_reduction_factor = surface_sides/contact_sides
-        assert(area_reduction_factor < 1)
-        for contact_road, contact_area in road.contacts.items():
-            if contact_road.layer_number == road.layer_number:
-                road.contacts[contact_road] = contact_area * area_reduction_factor
-    contact_sides = sum([contact_area for contact_road, contact_area in road.contacts.items() if
-                         contact_road.layer_number == road.layer_number])
+        contact_sides = _reduce_contact_areas(road, road.layer_number, surface_sides / contact_sides)
+        reduced = True
     assert (contact_sides < surface_sides * 1.0001)
 
-    total_contact_area = sum((road.contacts.values()))
-    total_surface = 2 * (road.length * road.width) + \
-                    2 * (road.layer_height * road.length) + \
-                    2 * (road.layer_height * road.width)
+    if reduced:
+        total_contact_area = 0.0
+        for contact_area in road.contacts.values():
+            total_contact_area += contact_area
+    road.contact_area_bottom = contact_bottom
+    road.contact_area_top = contact_top
+    road.contact_area_sides = contact_sides
+    road.contact_area_total = total_contact_area
+    return _road_free_area(road)
+
+
+def _reduce_contact_areas(road: Road, layer_number: int, area_reduction_factor: float) -> float:
+    """
+    Scales the contact areas of a road to the roads in the given layer.
+    :return: the new sum of these contact areas
+    """
+    assert (area_reduction_factor < 1)
+    contact_area_sum = 0.0
+    for contact_road, contact_area in road.contacts.items():
+        if contact_road.layer_number == layer_number:
+            road.contacts[contact_road] = contact_area * area_reduction_factor
+            contact_area_sum += contact_area * area_reduction_factor
+    return contact_area_sum
+
+
+def _road_free_area(road: Road) -> float:
+    return _free_area(road.length, road.width, road.layer_height, road.contact_area_total)
 
-    free_area = total_surface - total_contact_area
+
+def _free_area(length: float, width: float, layer_height: float, contact_area_total: float) -> float:
+    total_surface = 2 * (length * width) + \
+                    2 * (layer_height * length) + \
+                    2 * (layer_height * width)
+
+    free_area = total_surface - contact_area_total
     if 0 > free_area > -0.02:
         free_area = 0  # rounding error
     assert (free_area >= 0)
     return free_area
 
 
+def add_road_contact(road: Road, contact_road: Road, contact_area: float) -> float:
+    """
+    Adds a new contact to a road whose free area was calculated already.
+    Only the contact area sums are updated, the contacts are iterated only if the areas of a side have to be reduced.
+    :param road:
+    :param contact_road: must not be in the contacts of the road yet
+    :param contact_area:
+    :return: the new free area, same as calculate_road_free_area(road)
+    """
+    road.contacts[contact_road] = contact_area
+    if contact_road.layer_number == road.layer_number - 1:
+        road.contact_area_bottom += contact_area
+        reduce = road.contact_area_bottom > road.length * road.width * 1.0001
+    elif contact_road.layer_number == road.layer_number + 1:
+        road.contact_area_top += contact_area
+        reduce = road.contact_area_top > road.length * road.width * 1.0001
+    elif contact_road.layer_number == road.layer_number:
+        road.contact_area_sides += contact_area
+        reduce = road.contact_area_sides > \
+            (2 * (road.layer_height * road.length) + 2 * (road.layer_height * road.width)) * 1.0001
+    else:
+        reduce = False
+    if reduce:
+        return calculate_road_free_area(road)
+    road.contact_area_total += contact_area
+    return _road_free_area(road)
+
+
 def calculate_road_heat_capacity(road: Road) -> float:
     # it's okay to calculate the extrusion as cube, no need to make rounded edges,
     # see e.g. https://doi.org/10.1122/1.5093033
@@ -270,8 +805,8 @@ def update_contacts_after_deposition(road: Road):
 
             if contact_area > MINIMUM_CONTACT_AREA:
                 # filter too small contact areas
-                contact_road.contacts[road] = contact_area  # contact area is mostly the same in both directions
-                contact_road.free_area = calculate_road_free_area(contact_road)
+                # contact area is mostly the same in both directions
+                contact_road.free_area = add_road_contact(contact_road, road, contact_area)
 
 
 def calculate_temperature(road: Road, simulation_step_duration: float) -> tuple[Road, float]:
@@ -282,8 +817,10 @@ def calculate_temperature(road: Road, simulation_step_duration: float) -> tuple[
     :return:
     """
     # 1. temperature change from contacts
-    # contact_energy = calculate_contact_convection(road, simulation_step_duration)
-    contact_energy = calculate_contact_conduction(road, simulation_step_duration)
+    if CONTACT_HEAT_TRANSFER == "gap_conductance":
+        contact_energy = calculate_contact_convection(road, simulation_step_duration)
+    else:
+        contact_energy = calculate_contact_conduction(road, simulation_step_duration)
 
     # if conduction_contact_energy > 0:
     #     assert(convection_contact_energy/conduction_contact_energy > 10)
@@ -295,8 +832,10 @@ def calculate_temperature(road: Road, simulation_step_duration: float) -> tuple[
 
     # https://pawn.physik.uni-wuerzburg.de/video/thermodynamik/t/st12.html
     road_temperature_in_kelvin = road.temperature - abs_zero_temp
+    # T^4 as multiplications: ** uses a different pow() in numpy, this keeps both engines bitwise identical
     radiation_energy = simulation_step_duration * free_area_in_m * EMISSIVITY * BOLTZMAN_CONSTANT * \
-                       (road_temperature_in_kelvin ** 4 - ENVIRONMENT_TEMPERATURE_IN_KELVIN ** 4)
+                       (road_temperature_in_kelvin * road_temperature_in_kelvin * road_temperature_in_kelvin *
+                        road_temperature_in_kelvin - ENVIRONMENT_TEMPERATURE_IN_KELVIN ** 4)
 
     total_energy_change = contact_energy + convection_energy + radiation_energy
     temperature_change = total_energy_change / road.heat_capacity
@@ -356,6 +895,7 @@ def calculate_contact_conduction(road, simulation_step_duration):
 
 def calculate_contacts_in_layer(tree: shapely.strtree.STRtree, roads_in_layer: list[Road],
                                 all_roads: OrderedDict[int, Road]):
+    intersections = 0
     for road in roads_in_layer:
         current_geometry = road.geometry
         inflated_geometry = current_geometry.buffer(XY_PRINTER_RESOLUTION, 1, cap_style=3)
@@ -380,6 +920,7 @@ def calculate_contacts_in_layer(tree: shapely.strtree.STRtree, roads_in_layer: l
                                 min_edge_length = min(edge_length)  # width, should be ca. 0.05
 
                         # Idea 2: with buffer, simple area calculation
+                        intersections += 1
                         intersecting_area = overlapping_geometry.boundary\
                             .buffer(XY_PRINTER_RESOLUTION, 1, cap_style=3)\
                             .intersection(current_geometry).area
@@ -415,213 +956,3223 @@ def calculate_contacts_in_layer(tree: shapely.strtree.STRtree, roads_in_layer: l
                     # todo: with previous value, short segments (e.g. in round areas) were ignored
                     if contact_area > MINIMUM_CONTACT_AREA:  # 0.001:  # 0.015:  # ignore tiny contact areas
                         road.contacts[overlapping_road] = contact_area
+    instrumentation.count("shapely_queries", len(roads_in_layer))
+    instrumentation.count("shapely_intersections", intersections)
 
 
 def calculate_contacts_to_previous_layer(previous_layer_tree: shapely.strtree.STRtree, roads_in_layer: list[Road],
                                          all_roads: OrderedDict[int, Road]):
+    intersections = 0
     for road in roads_in_layer:
         current_geometry = road.geometry
         for overlapping_geometry in previous_layer_tree.query(current_geometry):
+            intersections += 1
             contact_intersection = overlapping_geometry.intersection(current_geometry)
             contact_area = contact_intersection.area
             overlapping_road = all_roads[id(overlapping_geometry)]
             if contact_area > MINIMUM_CONTACT_AREA:  # XY_PRINTER_RESOLUTION ** 2:
                 overlapping_road = all_roads[id(overlapping_geometry)]
                 road.contacts[overlapping_road] = contact_area
+    instrumentation.count("shapely_queries", len(roads_in_layer))
+    instrumentation.count("shapely_intersections", intersections)
 
 
-def main():
-    roads_by_geomid: OrderedDict[int, Road] = OrderedDict()
-    roads_by_layer_number: dict[int, list[Road]] = collections.defaultdict(list)
+def gcode_roads(gcode_filename: str, position_and_state) -> Iterable[Road]:
+    """
+    Generator of the roads of all G0/G1 moves using the GCODE_PARSER.
+    :param gcode_filename:
+    :param position_and_state: updated while the moves are read
+    :return:
+    """
+    if GCODE_PARSER == "chunks":
+        for moves in gcode_move_batches(gcode_filename):
+            roads, position_and_state = convert_move_batch_to_roads(moves, position_and_state)
+            yield from roads
+    else:
+        for move in gcode_moves(gcode_filename):
+            road, position_and_state = convert_move_to_road(move, position_and_state)
+            yield road
+
 
+def read_roads(gcode_filename: str) -> tuple[OrderedDict[int, Road], dict[int, list[Road]], int]:
+    """
+    Parses the gcode and creates the geometry of every road.
+    :param gcode_filename:
+    :return: roads_by_geomid, roads_by_layer_number and the number of layers
+    """
+    with instrumentation.phase("parse_roads"):
+        roads, number_of_layers = parse_roads(gcode_filename)
+    with instrumentation.phase("build_geometries"):
+        roads_by_geomid, roads_by_layer_number = build_geometries(roads)
+    instrumentation.count("roads_created", len(roads_by_geomid))
+    return roads_by_geomid, roads_by_layer_number, number_of_layers
+
+
+def parse_roads(gcode_filename: str) -> tuple[list[Road], int]:
+    """
+    Parses the gcode, one road per G0/G1 move (meshed with MESH_ROADS, the travel moves are joined with
+    COALESCE_TRAVEL_MOVES).
+    :param gcode_filename:
+    :return: the roads and the number of layers
+    """
     # implicit defaults at the beginning of the gcode. speed shouldn't matter at the start.
     position_and_state = {"X": 0, "Y": 0, "Z": 0, "E": 0, "F": 3000, "layer_number": 0, "layer_height": 0}
+    roads = gcode_roads(gcode_filename, position_and_state)
+    if MESH_ROADS:
+        roads = mesh_roads(roads)
+    if COALESCE_TRAVEL_MOVES:
+        roads = coalesce_travel_moves(roads)
+    roads = list(roads)
+    return roads, position_and_state["layer_number"]
+
+
+def coalesce_travel_moves(roads: Iterable[Road]) -> Iterator[Road]:
+    """
+    COALESCE_TRAVEL_MOVES: the travel moves after a road are not returned, they are joined into road.travel_duration
+    and road.travel_layer_number. The travel moves before the first road are returned (nothing to join them to).
+    :param roads: all roads in the order of the gcode file
+    :return: generator of the roads
+    """
+    previous_road = None
+    for road in roads:
+        if road.is_travel() and previous_road is not None:
+            previous_road.travel_duration += road.duration
+            previous_road.travel_layer_number = road.layer_number
+        else:
+            if not road.is_travel():
+                previous_road = road
+            yield road
+
+
+def coalesce_travel_move_arrays(arrays: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """
+    Same as coalesce_travel_moves for the arrays of parse_road_arrays.
+    :param arrays: arrays of _ROAD_MOVE_FIELDS
+    :return: the arrays without the joined travel moves, with travel_duration and travel_layer_number
+    """
+    travel = arrays["width"] == 0
+    joined = travel & (np.cumsum(~travel) > 0)
+    kept = ~joined
+    coalesced = {field: values[kept] for field, values in arrays.items()}
+    # the position of the previous road among the kept roads, the durations are added up in the order of the file
+    previous_roads = (np.cumsum(kept) - 1)[joined]
+    coalesced["travel_duration"] = np.bincount(previous_roads, weights=arrays["duration"][joined],
+                                               minlength=len(coalesced["gcode_line_number"]))
+    # the layer numbers never decrease, the last travel move has the highest one
+    coalesced["travel_layer_number"] = np.zeros(len(coalesced["gcode_line_number"]), dtype=np.int64)
+    np.maximum.at(coalesced["travel_layer_number"], previous_roads, arrays["layer_number"][joined])
+    return coalesced
+
 
-    gcode_filename = "sample-input-output/uberhangtest_6s.gcode"
-    for move in gcode_moves(gcode_filename):  # cube_test.gcode
-        road, position_and_state = convert_move_to_road(move, position_and_state)
+def build_geometries(roads: list[Road]) -> tuple[OrderedDict[int, Road], dict[int, list[Road]]]:
+    """
+    Creates the geometry of every road.
+    :param roads: the parsed roads
+    :return: roads_by_geomid and roads_by_layer_number
+    """
+    roads_by_geomid: OrderedDict[int, Road] = OrderedDict()
+    roads_by_layer_number: dict[int, list[Road]] = collections.defaultdict(list)
+
+    for road in roads:
         # if road.length <= MINIMUM_SEGMENT_LENGTH:
         #    # if road.length > 0:
         #    #     print("WARNING: Filtered very short segment with length %s" % road.length)
         #    continue
 
         if not road.is_travel():
-            roads = split_road(road, MAXIMUM_SEGMENT_LENGTH)
-            for road in roads:
-                road_geometry: shapely.geometry.LineString = shapely.geometry.LineString((
-                    (road.start_x, road.start_y), (road.end_x, road.end_y))) \
-                    .buffer(road.width / 2, 1, cap_style=2)
-                road.geometry = road_geometry
-                roads_by_geomid[id(road.geometry)] = road
-                roads_by_layer_number[road.layer_number].append(road)
+            road_geometry: shapely.geometry.LineString = shapely.geometry.LineString((
+                (road.start_x, road.start_y), (road.end_x, road.end_y))) \
+                .buffer(road.width / 2, 1, cap_style=2)
+            road.geometry = road_geometry
+            roads_by_geomid[id(road.geometry)] = road
+            roads_by_layer_number[road.layer_number].append(road)
         else:
             road.geometry = shapely.geometry.Point()  # empty geometry
             roads_by_geomid[id(road.geometry)] = road
             roads_by_layer_number[road.layer_number].append(road)
+    return roads_by_geomid, roads_by_layer_number
 
-    previous_layer_tree = None
-    for layer in range(1, position_and_state["layer_number"]+1):
+
+def calculate_contacts(roads_by_geomid: OrderedDict[int, Road], roads_by_layer_number: dict[int, list[Road]],
+                       number_of_layers: int):
+    if CONTACT_ENGINE == "analytic":
+        calculate_contacts_analytic(roads_by_layer_number, number_of_layers)
+    elif CONTACT_DETECTION_PROCESSES != 1:
+        calculate_contacts_parallel(roads_by_layer_number, number_of_layers, CONTACT_DETECTION_PROCESSES)
+    else:
+        previous_layer_tree = None
+        for layer in range(1, number_of_layers + 1):
+            print(layer)
+            roads_in_layer = [road for road in roads_by_layer_number[layer] if not road.geometry.is_empty]
+            geometries_in_layer = [road.geometry for road in roads_in_layer]
+            tree = shapely.strtree.STRtree(geometries_in_layer)
+
+            calculate_contacts_in_layer(tree, roads_in_layer, roads_by_geomid)
+            if previous_layer_tree:
+                calculate_contacts_to_previous_layer(previous_layer_tree, roads_in_layer, roads_by_geomid)
+
+            previous_layer_tree = tree
+    if instrumentation.enabled:
+        instrumentation.count("contacts_found", sum(len(road.contacts) for road in roads_by_geomid.values()))
+
+
+def calculate_contacts_parallel(roads_by_layer_number: dict[int, list[Road]], number_of_layers: int,
+                                processes: int = None):
+    """
+    Same contacts as the serial loop of calculate_contacts, but calculated in a process pool (see
+    parallel_layer_contacts). The contacts are added to the roads in the order of the serial loop, so the contacts
+    dicts are identical (including their order).
+    :param roads_by_layer_number:
+    :param number_of_layers:
+    :param processes: None uses all cores
+    """
+    roads_in_layers = [[]] + [[road for road in roads_by_layer_number[layer] if not road.geometry.is_empty]
+                              for layer in range(1, number_of_layers + 1)]
+    layer_contacts = parallel_layer_contacts([_road_arrays(roads) for roads in roads_in_layers[1:]], processes)
+    for layer, contacts in enumerate(layer_contacts, 1):
         print(layer)
-        roads_in_layer = [road for road in roads_by_layer_number[layer] if not road.geometry.is_empty]
-        geometries_in_layer = [road.geometry for road in roads_in_layer]
-        tree = shapely.strtree.STRtree(geometries_in_layer)
+        _add_layer_contacts(roads_in_layers[layer], roads_in_layers[layer - 1], *contacts)
+
+
+def _add_layer_contacts(roads_in_layer: list[Road], roads_in_previous_layer: list[Road], rows: np.ndarray,
+                        in_previous_layer: np.ndarray, columns: np.ndarray, contact_areas: np.ndarray):
+    """Adds the contacts of one layer of shapely_layer_contacts/analytic_layer_contacts to the roads."""
+    for row, previous, column, contact_area in zip(rows.tolist(), in_previous_layer.tolist(), columns.tolist(),
+                                                   contact_areas.tolist()):
+        contact_road = roads_in_previous_layer[column] if previous else roads_in_layer[column]
+        roads_in_layer[row].contacts[contact_road] = contact_area
+
+
+def _road_arrays(roads: list[Road]) -> tuple[np.ndarray, np.ndarray]:
+    """:return: gcode line numbers and start_x, start_y, end_x, end_y, width, length and layer_height per road"""
+    return (np.array([road.gcode_line_number for road in roads], dtype=np.int64),
+            np.array([(road.start_x, road.start_y, road.end_x, road.end_y, road.width, road.length, road.layer_height)
+                      for road in roads], dtype=float).reshape(-1, 7))
+
+
+def parallel_layer_contacts(layers: list[tuple[np.ndarray, np.ndarray]], processes: int = None) \
+        -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    shapely_layer_contacts in a process pool. Blocks of consecutive layers are calculated by one task, a block also
+    gets the layer below its first layer to calculate the contacts to the previous layer.
+    :param layers: _road_arrays of the roads with geometry per layer
+    :param processes: None uses all cores
+    :return: see shapely_layer_contacts
+    """
+    processes = processes or os.cpu_count()
+
+    # several blocks per process with a similar number of roads, the road count per layer varies a lot
+    block_size = max(1, sum(len(gcode_line_numbers) for gcode_line_numbers, _ in layers) // (4 * processes))
+    blocks: list[list[int]] = [[]]
+    road_count = 0
+    for position, (gcode_line_numbers, _) in enumerate(layers):
+        if road_count >= block_size:
+            blocks.append([])
+            road_count = 0
+        blocks[-1].append(position)
+        road_count += len(gcode_line_numbers)
+
+    tasks = [(block[0] > 0, layers[max(0, block[0] - 1):block[-1] + 1]) for block in blocks if block]
+    with multiprocessing.Pool(processes) as pool:
+        for block_contacts in pool.imap(_calculate_contacts_of_layers, tasks):
+            yield from block_contacts
+
+
+def _calculate_contacts_of_layers(task) -> list[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Worker of parallel_layer_contacts.
+    :param task: whether the first layer is the layer below the block (no contacts calculated), _road_arrays per layer
+    :return: see shapely_layer_contacts
+    """
+    has_previous_layer, layers = task
+    return list(shapely_layer_contacts(layers, has_previous_layer))
 
-        calculate_contacts_in_layer(tree, roads_in_layer, roads_by_geomid)
-        if previous_layer_tree:
-            calculate_contacts_to_previous_layer(previous_layer_tree, roads_in_layer, roads_by_geomid)
+
+def shapely_layer_contacts(layers: Iterable[tuple[np.ndarray, np.ndarray]], skip_first_layer=False) \
+        -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    The contacts of calculate_contacts_in_layer and calculate_contacts_to_previous_layer for consecutive layers, the
+    roads are rebuilt like read_roads. Only the roads (and geometries) of the current and the previous layer are kept.
+    :param layers: _road_arrays of the roads with geometry per layer
+    :param skip_first_layer: the first layer is only used as previous layer, no contacts are calculated for it
+    :return: per layer the road indexes, whether the contact is in the previous layer, the indexes of the contacts and
+    the contact areas, in the order of the contacts dicts
+    """
+    previous_layer_tree = None
+    roads_in_previous_layer: list[Road] = []
+    for position, (gcode_line_numbers, road_values) in enumerate(layers):
+        roads_in_layer = []
+        for index, (gcode_line_number, values) in enumerate(zip(gcode_line_numbers.tolist(), road_values.tolist())):
+            road = Road()
+            road.gcode_line_number = gcode_line_number
+            road.start_x, road.start_y, road.end_x, road.end_y, road.width, road.length, road.layer_height = values
+            road.layer_number = position
+            road.index = index
+            road.geometry = shapely.geometry.LineString(((road.start_x, road.start_y), (road.end_x, road.end_y))) \
+                .buffer(road.width / 2, 1, cap_style=2)
+            roads_in_layer.append(road)
+        tree = shapely.strtree.STRtree([road.geometry for road in roads_in_layer])
+
+        if position > 0 or not skip_first_layer:
+            all_roads = {id(road.geometry): road for road in itertools.chain(roads_in_previous_layer, roads_in_layer)}
+            calculate_contacts_in_layer(tree, roads_in_layer, all_roads)
+            if previous_layer_tree:
+                calculate_contacts_to_previous_layer(previous_layer_tree, roads_in_layer, all_roads)
+
+            contacts = [(road.index, contact_road.layer_number != position, contact_road.index, contact_area)
+                        for road in roads_in_layer for contact_road, contact_area in road.contacts.items()]
+            rows, in_previous_layer, columns, contact_areas = zip(*contacts) if contacts else ((), (), (), ())
+            for road in roads_in_layer:
+                road.contacts = {}  # releases the roads of the previous layer with the next layer
+            yield (np.array(rows, dtype=np.int32), np.array(in_previous_layer, dtype=bool),
+                   np.array(columns, dtype=np.int32), np.array(contact_areas, dtype=float))
 
         previous_layer_tree = tree
+        roads_in_previous_layer = roads_in_layer
+
+
+def calculate_contacts_analytic(roads_by_layer_number: dict[int, list[Road]], number_of_layers: int):
+    """
+    Adds the contacts of analytic_layer_contacts to the roads.
+    :param roads_by_layer_number:
+    :param number_of_layers:
+    """
+    roads_in_layers = [[]] + [[road for road in roads_by_layer_number[layer] if not road.geometry.is_empty]
+                              for layer in range(1, number_of_layers + 1)]
+    layer_contacts = analytic_layer_contacts(_road_arrays(roads) for roads in roads_in_layers[1:])
+    for layer, contacts in enumerate(layer_contacts, 1):
+        print(layer)
+        _add_layer_contacts(roads_in_layers[layer], roads_in_layers[layer - 1], *contacts)
+
+
+def analytic_layer_contacts(layers: Iterable[tuple[np.ndarray, np.ndarray]]) \
+        -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Alternative to shapely_layer_contacts. Every road geometry is a rectangle (flat caps), so the areas are
+    calculated for all candidate pairs of a layer at once:
+    - previous layer: overlap area of the two rectangles
+    - same layer: overlap of the road with the boundary of the other road buffered by XY_PRINTER_RESOLUTION, which is
+      the overlap with the inflated rectangle (an octagon, the buffer uses one segment per quarter circle) minus the
+      overlap with the deflated rectangle
+    The contacts of a road are ordered by layer and deposition, the areas differ from shapely by rounding only.
+    :param layers: _road_arrays of the roads with geometry per layer
+    :return: see shapely_layer_contacts
+    """
+    previous_layer = None
+    for gcode_line_numbers, road_values in layers:
+        start = road_values[:, 0:2]
+        end = road_values[:, 2:4]
+        half_width = road_values[:, 4] / 2
+        rectangles = _road_rectangles(start, end, half_width)
+        envelopes = np.concatenate((rectangles.min(axis=1), rectangles.max(axis=1)), axis=1)
+
+        if CONTACT_CANDIDATE_INDEX == "grid":
+            rows, columns, previous_rows, previous_columns = _grid_overlapping_envelopes(
+                envelopes, np.zeros((0, 4)) if previous_layer is None else previous_layer[1], XY_PRINTER_RESOLUTION,
+                CONTACT_GRID_CELL_SIZE)
+        else:
+            rows, columns = _overlapping_envelopes(envelopes, envelopes, XY_PRINTER_RESOLUTION)
+        # ignore roads which are deposited after the current road
+        earlier = gcode_line_numbers[columns] < gcode_line_numbers[rows]
+        rows, columns = rows[earlier], columns[earlier]
+        order = np.lexsort((columns, rows))
+        rows, columns = rows[order], columns[order]
+
+        instrumentation.count("contact_candidates", len(rows))
+        intersecting_areas = _convex_overlap_areas(rectangles[rows], _inflated_rectangles(rectangles[columns]))
+        direction = end - start
+        length = np.hypot(direction[:, 0], direction[:, 1])
+        deflated = (half_width > XY_PRINTER_RESOLUTION) & (length > 2 * XY_PRINTER_RESOLUTION)
+        inner_pairs = deflated[columns]
+        offset = direction / length[:, None] * XY_PRINTER_RESOLUTION
+        inner_rectangles = _road_rectangles(start[deflated] + offset[deflated], end[deflated] - offset[deflated],
+                                            half_width[deflated] - XY_PRINTER_RESOLUTION)
+        inner_positions = np.cumsum(deflated) - 1
+        intersecting_areas[inner_pairs] -= _convex_overlap_areas(
+            rectangles[rows[inner_pairs]], inner_rectangles[inner_positions[columns[inner_pairs]]])
+
+        road_lengths = road_values[:, 5]
+        layer_heights = road_values[:, 6]
+        intersection_lengths = np.minimum(intersecting_areas / XY_PRINTER_RESOLUTION,
+                                          np.minimum(road_lengths[rows], road_lengths[columns]))
+        contact_areas = np.where(gcode_line_numbers[columns] == gcode_line_numbers[rows] - 1,
+                                 layer_heights[rows] * half_width[rows] * 2, intersection_lengths * layer_heights[rows])
+        contacts = [(rows, np.zeros(len(rows), dtype=bool), columns, contact_areas)]
+
+        if previous_layer is not None:
+            previous_rectangles, previous_envelopes = previous_layer
+            if CONTACT_CANDIDATE_INDEX == "grid":
+                rows, columns = previous_rows, previous_columns
+            else:
+                rows, columns = _overlapping_envelopes(envelopes, previous_envelopes, 0)
+            instrumentation.count("contact_candidates", len(rows))
+            order = np.lexsort((columns, rows))
+            rows, columns = rows[order], columns[order]
+            contact_areas = _convex_overlap_areas(rectangles[rows], previous_rectangles[columns])
+            contacts.append((rows, np.ones(len(rows), dtype=bool), columns, contact_areas))
+
+        # the contacts in the same layer first, like calculate_contacts_in_layer before
+        # calculate_contacts_to_previous_layer
+        rows, in_previous_layer, columns, contact_areas = (np.concatenate(values) for values in zip(*contacts))
+        order = np.argsort(rows, kind="stable")
+        order = order[contact_areas[order] > MINIMUM_CONTACT_AREA]
+        yield rows[order], in_previous_layer[order], columns[order], contact_areas[order]
+
+        previous_layer = rectangles, envelopes
+
 
+def _road_rectangles(start: np.ndarray, end: np.ndarray, half_width: np.ndarray) -> np.ndarray:
+    """:return: counterclockwise corners (n, 4, 2) of the segments buffered with flat caps"""
+    direction = end - start
+    normal = np.stack((-direction[:, 1], direction[:, 0]), axis=1)
+    normal *= (half_width / np.hypot(direction[:, 0], direction[:, 1]))[:, None]
+    return np.stack((start - normal, end - normal, end + normal, start + normal), axis=1)
+
+
+def _inflated_rectangles(rectangles: np.ndarray) -> np.ndarray:
+    """:return: counterclockwise corners (n, 8, 2) of the rectangles buffered by XY_PRINTER_RESOLUTION, beveled"""
+    edges = np.roll(rectangles, -1, axis=1) - rectangles
+    outward_normals = np.stack((edges[..., 1], -edges[..., 0]), axis=2)
+    outward_normals *= (XY_PRINTER_RESOLUTION / np.hypot(edges[..., 0], edges[..., 1]))[..., None]
+    return np.stack((rectangles + outward_normals, np.roll(rectangles, -1, axis=1) + outward_normals),
+                    axis=2).reshape(-1, 8, 2)
+
+
+def _overlapping_envelopes(envelopes: np.ndarray, other_envelopes: np.ndarray,
+                           distance: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Sweep over x of all pairs of overlapping envelopes (min x, min y, max x, max y).
+    :param envelopes:
+    :param other_envelopes:
+    :param distance: the envelopes are expanded by this distance
+    :return: indexes into envelopes and other_envelopes of the overlapping pairs
+    """
+    lower = envelopes[:, 0] - distance
+    upper = envelopes[:, 2] + distance
+    # pairs where the other envelope starts within the envelope, then pairs where the envelope starts within the other
+    other_order = np.argsort(other_envelopes[:, 0], kind="stable")
+    other_lower = other_envelopes[other_order, 0]
+    starts = np.searchsorted(other_lower, lower, "left")
+    ends = np.searchsorted(other_lower, upper, "right")
+    rows = [np.repeat(np.arange(len(envelopes)), ends - starts)]
+    columns = [other_order[_concatenated_ranges(starts, ends)]]
+    order = np.argsort(lower, kind="stable")
+    starts = np.searchsorted(lower[order], other_envelopes[:, 0], "right")
+    ends = np.searchsorted(lower[order], other_envelopes[:, 2], "right")
+    rows.append(order[_concatenated_ranges(starts, ends)])
+    columns.append(np.repeat(np.arange(len(other_envelopes)), ends - starts))
+    rows, columns = np.concatenate(rows), np.concatenate(columns)
+    overlapping = (envelopes[rows, 1] - distance <= other_envelopes[columns, 3]) & \
+                  (other_envelopes[columns, 1] <= envelopes[rows, 3] + distance)
+    return rows[overlapping], columns[overlapping]
+
+
+def _grid_overlapping_envelopes(envelopes: np.ndarray, previous_envelopes: np.ndarray, distance: float,
+                                cell_size: float = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Same pairs as _overlapping_envelopes for a layer and for the layer against the previous layer in one call, found
+    with a uniform grid like reference/thermaljs/Bins.js: the envelopes of both layers are binned into every grid cell
+    they cover (Bins.js bins the center only and relies on short elements), every pair sharing a cell is a candidate.
+    A pair is kept in the cell of the lower left corner of the overlap only, so it is found once.
+    :param envelopes: min x, min y, max x, max y of the roads of the layer
+    :param previous_envelopes: of the previous layer, may be empty
+    :param distance: the envelopes of the layer are expanded by this distance for the pairs within the layer
+    :param cell_size: None uses the mean envelope size
+    :return: indexes into envelopes of the overlapping pairs in the layer, indexes into envelopes and
+    previous_envelopes of the pairs overlapping without expansion
+    """
+    count = len(envelopes)
+    binned_envelopes = np.concatenate((envelopes, previous_envelopes))
+    lower = envelopes[:, :2] - distance
+    upper = envelopes[:, 2:] + distance
+    if count == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty
+    if cell_size is None:
+        cell_size = max(float(np.mean(np.max(binned_envelopes[:, 2:] - binned_envelopes[:, :2], axis=1))) + distance,
+                        XY_PRINTER_RESOLUTION)
+    origin = np.minimum(lower.min(axis=0), binned_envelopes[:, :2].min(axis=0))
+    first_cells = np.floor((binned_envelopes[:, :2] - origin) / cell_size).astype(np.int64)
+    last_cells = np.floor((binned_envelopes[:, 2:] - origin) / cell_size).astype(np.int64)
+    query_first_cells = np.floor((lower - origin) / cell_size).astype(np.int64)
+    query_last_cells = np.floor((upper - origin) / cell_size).astype(np.int64)
+    rows_of_cells = max(last_cells[:, 1].max(), query_last_cells[:, 1].max()) + 1
+    number_of_cells = max(last_cells[:, 0].max(), query_last_cells[:, 0].max()) * rows_of_cells + rows_of_cells
+
+    def cell_keys(first, last):
+        cells_y = last[:, 1] - first[:, 1] + 1
+        counts = (last[:, 0] - first[:, 0] + 1) * cells_y
+        items = np.repeat(np.arange(len(first)), counts)
+        positions = np.arange(len(items)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return items, (first[items, 0] + positions // cells_y[items]) * rows_of_cells + first[items, 1] + \
+            positions % cells_y[items]
+
+    # the envelopes per cell in CSR form
+    binned, keys = cell_keys(first_cells, last_cells)
+    binned = binned[np.argsort(keys)]
+    cell_pointers = np.zeros(number_of_cells + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=number_of_cells), out=cell_pointers[1:])
+    queried, query_keys = cell_keys(query_first_cells, query_last_cells)
+    starts = cell_pointers[query_keys]
+    ends = cell_pointers[query_keys + 1]
+    rows = np.repeat(queried, ends - starts)
+    columns = binned[_concatenated_ranges(starts, ends)]
+    # the cell of the lower left corner of the overlap, floor is monotonic
+    overlap_cells = np.maximum(query_first_cells[rows], first_cells[columns])
+    found_once = overlap_cells[:, 0] * rows_of_cells + overlap_cells[:, 1] == np.repeat(query_keys, ends - starts)
+    rows, columns = rows[found_once], columns[found_once]
+    instrumentation.count("grid_candidates", len(rows))
+
+    in_layer = columns < count
+    layer_rows, layer_columns = rows[in_layer], columns[in_layer]
+    overlapping = np.all((lower[layer_rows] <= binned_envelopes[layer_columns, 2:]) &
+                         (binned_envelopes[layer_columns, :2] <= upper[layer_rows]), axis=1)
+    previous_rows, previous_columns = rows[~in_layer], columns[~in_layer]
+    previous_overlapping = np.all((envelopes[previous_rows, :2] <= binned_envelopes[previous_columns, 2:]) &
+                                  (binned_envelopes[previous_columns, :2] <= envelopes[previous_rows, 2:]), axis=1)
+    return (layer_rows[overlapping], layer_columns[overlapping], previous_rows[previous_overlapping],
+            previous_columns[previous_overlapping] - count)
+
+
+def _concatenated_ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """:return: np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)]) without the loop"""
+    counts = ends - starts
+    offsets = np.cumsum(counts) - counts
+    return np.arange(counts.sum()) - np.repeat(offsets - starts, counts)
+
+
+def _convex_overlap_areas(subjects: np.ndarray, clips: np.ndarray) -> np.ndarray:
+    """
+    Sutherland-Hodgman clipping of pairs of convex polygons, all pairs at once.
+    :param subjects: counterclockwise corners (n, k, 2)
+    :param clips: counterclockwise corners (n, m, 2)
+    :return: intersection area per pair
+    """
+    count_pairs = len(subjects)
+    maximum_corners = subjects.shape[1] + clips.shape[1]
+    polygons = np.zeros((count_pairs, maximum_corners, 2))
+    polygons[:, :subjects.shape[1]] = subjects
+    corner_counts = np.full(count_pairs, subjects.shape[1])
+    rows = np.arange(count_pairs)[:, None]
+    corner_indexes = np.arange(maximum_corners)
+
+    def next_corners():
+        return np.where(corner_indexes + 1 < corner_counts[:, None], corner_indexes + 1, 0)
+
+    for edge in range(clips.shape[1]):
+        edge_start = clips[:, edge, None]
+        edge_direction = clips[:, (edge + 1) % clips.shape[1], None] - edge_start
+        # > 0 left of the edge, which is inside
+        sides = edge_direction[..., 0] * (polygons[..., 1] - edge_start[..., 1]) - \
+            edge_direction[..., 1] * (polygons[..., 0] - edge_start[..., 0])
+        following = next_corners()
+        following_sides = sides[rows, following]
+        inside = sides >= 0
+        valid = corner_indexes < corner_counts[:, None]
+        crossing = valid & (inside != (following_sides >= 0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fractions = np.where(crossing, sides / (sides - following_sides), 0)
+        intersections = polygons + fractions[..., None] * (polygons[rows, following] - polygons)
+        # every corner is followed by the intersection of its edge
+        candidates = np.stack((polygons, intersections), axis=2).reshape(count_pairs, 2 * maximum_corners, 2)
+        keep = np.stack((valid & inside, crossing), axis=2).reshape(count_pairs, 2 * maximum_corners)
+        kept = np.argsort(~keep, axis=1, kind="stable")[:, :maximum_corners]
+        polygons = np.take_along_axis(candidates, kept[..., None], axis=1)
+        corner_counts = np.minimum(keep.sum(axis=1), maximum_corners)
+
+    following_polygons = polygons[rows, next_corners()]
+    cross_products = polygons[..., 0] * following_polygons[..., 1] - following_polygons[..., 0] * polygons[..., 1]
+    cross_products[corner_indexes >= corner_counts[:, None]] = 0
+    return np.maximum(cross_products.sum(axis=1) / 2, 0)
+
+
+def calculate_free_areas(roads_by_geomid: OrderedDict[int, Road]):
     for geometry_id, road in roads_by_geomid.items():
         if not road.is_travel():
             free_area = calculate_road_free_area(road)
             roads_by_geomid[geometry_id].free_area = free_area
 
-    current_simulation_time = 0
-    current_gcode_time = 0
-    roads_in_simulation: set[Road] = set()
-    print("Simulation")
-    count_roads = len(roads_by_geomid)
-    for road in roads_by_geomid.values():
-        current_gcode_line_number = road.gcode_line_number
-        if current_gcode_line_number % 100 == 0:
-            progress = current_gcode_line_number / count_roads
-            print(int(progress * 100), end=" ")
 
-        road.heat_capacity = calculate_road_heat_capacity(road)
+_ROAD_ARRAY_FIELDS = ("gcode_line_number", "layer_number", "start_x", "start_y", "end_x", "end_y", "width", "length",
+                      "layer_height", "duration", "free_area", "contact_area_bottom", "contact_area_top",
+                      "contact_area_sides", "contact_area_total", "travel_duration", "travel_layer_number",
+                      "first_line_number", "last_line_number")
 
-        if not road.is_travel():  # hint: improve performance by joining multiple travel moves
-            if road.layer_number == 1:
-                road.temperature = environment_temperature
-            else:
-                road.temperature = EXTRUSION_TEMPERATURE  # hint: read extrusion temp from gcode
-            roads_in_simulation.add(road)
-            update_contacts_after_deposition(road)
 
-            calculate_contact_temperature_at_deposition(road)
+def roads_to_arrays(roads: list[Road]) -> dict[str, np.ndarray]:
+    """
+    Converts the roads and their contacts to arrays, the contacts are stored in CSR form in the order of the contacts
+    dicts (contact_pointers, contact_indexes into the roads, contact_areas).
+    :param roads: all roads (including travel moves) after calculate_free_areas
+    :return:
+    """
+    arrays = {}
+    for field in _ROAD_ARRAY_FIELDS:
+        dtype = np.int64 if field in ("gcode_line_number", "layer_number", "first_line_number", "last_line_number") \
+            else float
+        # travel moves have no free area
+        arrays[field] = np.fromiter((getattr(road, field, math.nan) for road in roads), dtype=dtype, count=len(roads))
+    positions = {road: position for position, road in enumerate(roads)}
+    arrays["contact_pointers"] = np.concatenate(([0], np.cumsum([len(road.contacts) for road in roads]))) \
+        .astype(np.int64)
+    arrays["contact_indexes"] = np.fromiter((positions[contact_road] for road in roads for contact_road in road.contacts),
+                                            dtype=np.int64, count=arrays["contact_pointers"][-1])
+    arrays["contact_areas"] = np.fromiter((contact_area for road in roads for contact_area in road.contacts.values()),
+                                          dtype=float, count=arrays["contact_pointers"][-1])
+    return arrays
 
-        # Active Body:
-        # roads which were added 8 seconds before are removed from simulation (computeStartIndex) (ACTIVE_TIME)
-        # using max 200 elements (N_CORE_ELEMENTS)
-        # using max distance of 3 roads to the current one (NEIGHBOR_DEPTH)
-        # instead of Active Body:
-        # roads are removed from simulation when their temperature does not change anymore (environment temp+10%)
-        # AND the layer number of the road is lower by 20 than the current road (keep them when they are close)
 
-        # 0.5s lead to problems with temperatures being too high (>extrusion temp) or too low (<environment)
-        MAX_SIMULATION_TIME_STEP = 0.2  # seconds
-        MIN_SIMULATION_TIME_STEP = 0.1  # seconds
-        current_layer_number = road.layer_number
-        current_gcode_time += road.duration
-        simulation_time_step_duration = current_gcode_time - current_simulation_time
+def roads_from_arrays(arrays: dict[str, np.ndarray]) -> list[Road]:
+    """
+    Inverse of roads_to_arrays, the roads have no geometry.
+    :param arrays:
+    :return:
+    """
+    roads = []
+    for values in zip(*(arrays[field].tolist() for field in _ROAD_ARRAY_FIELDS)):
+        road = Road()
+        for field, value in zip(_ROAD_ARRAY_FIELDS, values):
+            setattr(road, field, value)
+        road.geometry = None
+        if road.is_travel():
+            del road.free_area
+        roads.append(road)
+    contact_pointers = arrays["contact_pointers"].tolist()
+    contact_indexes = arrays["contact_indexes"].tolist()
+    contact_areas = arrays["contact_areas"].tolist()
+    for road, contacts_start, contacts_end in zip(roads, contact_pointers, contact_pointers[1:]):
+        road.contacts = {roads[index]: contact_area for index, contact_area in
+                         zip(contact_indexes[contacts_start:contacts_end], contact_areas[contacts_start:contacts_end])}
+    return roads
 
-        if simulation_time_step_duration > MAX_SIMULATION_TIME_STEP:
-            whole_time_steps = simulation_time_step_duration // MAX_SIMULATION_TIME_STEP
-            remainder_time_step = simulation_time_step_duration % MAX_SIMULATION_TIME_STEP
-            for step in range(int(whole_time_steps)):
-                current_simulation_time = simulate_time_step(current_simulation_time, current_layer_number, roads_in_simulation, MAX_SIMULATION_TIME_STEP)
-            current_simulation_time = simulate_time_step(current_simulation_time, current_layer_number, roads_in_simulation, remainder_time_step)
 
-        elif simulation_time_step_duration < MIN_SIMULATION_TIME_STEP:
-            # don't simulate too litte time steps, but only when enough time has passed
-            pass
-        else:
-            current_simulation_time = simulate_time_step(current_simulation_time, current_layer_number, roads_in_simulation, simulation_time_step_duration)
+def road_cache_key(gcode_filename: str) -> str:
+    """
+    :return: hash of the gcode content and of all constants changing the roads, their contacts or free areas
+    """
+    key = hashlib.sha256()
+    with open(gcode_filename, "rb") as gcode_file:
+        for block in iter(lambda: gcode_file.read(1024 * 1024), b""):
+            key.update(block)
+    # the analytic contact engine differs in rounding only, but the cached roads should be the ones calculated now
+    key.update(repr((XY_PRINTER_RESOLUTION, MINIMUM_CONTACT_AREA, FILAMENT_DIAMETER, MAXIMUM_SEGMENT_LENGTH,
+                     CONTACT_ENGINE, COALESCE_TRAVEL_MOVES, MESH_ROADS, MINIMUM_ELEMENT_LENGTH, MESH_ANGLE_TOLERANCE,
+                     _ROAD_ARRAY_FIELDS)).encode())
+    return key.hexdigest()
 
-    # todo: after depositing all roads continue running the simulation until all roads cooled to environment temp
-    end_temperatures = [road.temperature for road in roads_by_geomid.values() if hasattr(road, "temperature")]
-    max_duration = 0
-    line_number = 0
-    for road in roads_by_geomid.values():
-        if road.duration_temp_above_hdt > max_duration:
-            line_number = road.gcode_line_number
-    print("Road with longest duration over PETG HDT: %s" % line_number)
-    print(max(end_temperatures))
-    print(min(end_temperatures))
-    print(sum(end_temperatures) / len(end_temperatures))
-    print("Printing duration in minutes:", current_simulation_time / 60)
 
-    # Visualisation
-    # export_for_threejs(roads_by_geomid)
-    export_for_gcode(gcode_filename, roads_by_geomid)
+def prepare_roads(gcode_filename: str) -> tuple[OrderedDict[int, Road], dict[int, list[Road]], int]:
+    """
+    read_roads, calculate_contacts and calculate_free_areas, loaded from ROAD_CACHE_DIRECTORY if calculated before.
+    Roads loaded from the cache have no geometry, roads_by_geomid is then keyed by the position of the road.
+    :param gcode_filename:
+    :return: roads_by_geomid, roads_by_layer_number and the number of layers
+    """
+    if ROAD_CACHE_DIRECTORY is not None:
+        cache_filename = os.path.join(ROAD_CACHE_DIRECTORY, road_cache_key(gcode_filename) + ".npz")
+        arrays = _load_road_cache(cache_filename)
+        if arrays is not None:
+            roads = roads_from_arrays(arrays)
+            roads_by_layer_number: dict[int, list[Road]] = collections.defaultdict(list)
+            for road in roads:
+                roads_by_layer_number[road.layer_number].append(road)
+            return OrderedDict(enumerate(roads)), roads_by_layer_number, max(roads_by_layer_number, default=0)
 
+    with instrumentation.phase("read_roads"):
+        roads_by_geomid, roads_by_layer_number, number_of_layers = read_roads(gcode_filename)  # cube_test.gcode
+    with instrumentation.phase("calculate_contacts"):
+        calculate_contacts(roads_by_geomid, roads_by_layer_number, number_of_layers)
+    with instrumentation.phase("calculate_free_areas"):
+        calculate_free_areas(roads_by_geomid)
 
-def calculate_contact_temperature_at_deposition(road):
-    # only use previous layer
-    contact_temperatures_at_deposition = [contact_road.temperature for contact_road in road.contacts.keys() if
-                                          contact_road.gcode_line_number != road.gcode_line_number - 1]
-    contact_area_at_deposition = [contact_area for contact_road, contact_area in road.contacts.items() if
-                                  contact_road.gcode_line_number != road.gcode_line_number - 1]
-    sum_contact_areas = sum(contact_area_at_deposition)
-    # weight temperature by contact area
-    contact_temperatures = []
-    for temp, area in zip(contact_temperatures_at_deposition, contact_area_at_deposition):
-        weight = area / sum_contact_areas
-        contact_temperatures.append(temp * weight)
-    if road.layer_number == 1:
-        road.avg_contact_temperatures_at_deposition = environment_temperature
-    else:
-        if len(contact_temperatures_at_deposition) > 0:
-            avg_contact_temperatures_at_deposition = sum(contact_temperatures)
-            road.avg_contact_temperatures_at_deposition = avg_contact_temperatures_at_deposition
-        else:
-            road.avg_contact_temperatures_at_deposition = EXTRUSION_TEMPERATURE
+    if ROAD_CACHE_DIRECTORY is not None:
+        with instrumentation.phase("store_road_cache"):
+            store_road_cache(cache_filename, roads_to_arrays(list(roads_by_geomid.values())))
+    return roads_by_geomid, roads_by_layer_number, number_of_layers
 
 
-def simulate_time_step(current_time, current_layer_number: int, roads_in_simulation, simulation_time_step_duration):
-    args = [(r, simulation_time_step_duration) for r in roads_in_simulation]
-    new_temperatures = itertools.starmap(calculate_temperature, args)
-    # new_temperatures: set[tuple[Road, float]] = set()
-    # for simulated_road in roads_in_simulation:
-    #    temp = calculate_temperature(simulated_road, simulation_time_step_duration)
-    #    new_temperatures.add((simulated_road, temp))
-    current_time += simulation_time_step_duration
-    # setzt die neuen Temperaturen aller roads (erst nachdem alles durch berechnet ist!)
-    for updated_road, new_temp in new_temperatures:
-        if current_layer_number - updated_road.layer_number >= 3 and environment_temperature * 1.1 > new_temp:
-            # temperatur ist fast umgebungstemp und viele Schichten her -> rauswerfen
-            roads_in_simulation.remove(updated_road)
-        if new_temp > 80:  # above Tgt of PETG, todo: move to constants
-            updated_road.duration_temp_above_hdt += simulation_time_step_duration
-        updated_road.temperature = new_temp
-    return current_time
+def _load_road_cache(cache_filename: str) -> dict[str, np.ndarray]:
+    """:return: the arrays of the cache file, None if there is none (damaged files are removed)"""
+    try:
+        with instrumentation.phase("load_road_cache"), np.load(cache_filename) as cached_arrays:
+            arrays = {name: cached_arrays[name] for name in
+                      _ROAD_ARRAY_FIELDS + ("contact_pointers", "contact_indexes", "contact_areas")}
+        os.utime(cache_filename)  # least recently used is evicted first
+        instrumentation.count("road_cache_hits")
+        return arrays
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(cache_filename)  # damaged, e.g. by a full disk
+    return None
 
 
-def export_for_gcode(gcode_filename, roads_by_geomid):
-    """Visualise the temps by using the Gcode speed value as duration over HDT"""
-    with open("sample-input-output/export_contact_temps.gcode", "w") as contact_temps_target:
-        with open("sample-input-output/export_time_over_tgt.gcode", "w") as tgt_target:
-            with open(gcode_filename) as source:
-                line_number = 1
-                regex = re.compile(r"(F\d+)")
-                for road in roads_by_geomid.values():  # sorted by gcode_line_number
-                    while line_number != road.gcode_line_number:
-                        road_line = source.readline()
-                        contact_temps_target.write(road_line)  # skip until next G0/G1 line is reached
-                        tgt_target.write(road_line)
-                        line_number += 1
-                    road_line = source.readline()
-                    contact_temps_road_line = road_line
-                    tgt_road_line = road_line
-                    line_number += 1
-                    if road.avg_contact_temperatures_at_deposition > 0:
-                        # F in the gcode is in mm/minute, gcode viewer convert it to mm/s
-                        if road.avg_contact_temperatures_at_deposition > 80:  # Tgt of PETG
-                            new_value = int(road.avg_contact_temperatures_at_deposition * 60 * 10)
-                        else:
-                            new_value = int(road.avg_contact_temperatures_at_deposition * 60 * 10)
-                        if "F" in road_line:
-                            contact_temps_road_line = regex.sub(" F%s" % new_value, road_line)
-                        else:
-                            contact_temps_road_line = road_line.replace("\n", " F%s\n" % new_value)
-                    if road.duration_temp_above_hdt > 0:
-                        # F in the gcode is in mm/minute, gcode viewer convert it to mm/s and this should be the time in ms above HDT
-                        if "F" in road_line:
-                            tgt_road_line = regex.sub(" F%s" % (int(road.duration_temp_above_hdt * 60 * 1000)), road_line)
-                        else:
-                            tgt_road_line = road_line.replace("\n", " F%s\n" % (int(road.duration_temp_above_hdt * 60 * 1000)))
-                    contact_temps_target.write(contact_temps_road_line)
-                    tgt_target.write(tgt_road_line)
+def store_road_cache(cache_filename: str, arrays: dict[str, np.ndarray]):
+    """
+    Writes the cache file atomically and removes the least recently used files above ROAD_CACHE_MAXIMUM_SIZE.
+    """
+    cache_directory = os.path.dirname(cache_filename)
+    os.makedirs(cache_directory, exist_ok=True)
+    file_descriptor, temporary_filename = tempfile.mkstemp(dir=cache_directory, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as cache_file:
+            np.savez(cache_file, **arrays)
+        os.replace(temporary_filename, cache_filename)
+    except BaseException:
+        os.remove(temporary_filename)
+        raise
+
+    cache_files = []
+    for entry in os.scandir(cache_directory):
+        try:
+            if entry.name.endswith(".npz"):
+                cache_files.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+        except FileNotFoundError:
+            pass  # removed by another process
+    cache_size = 0
+    for _, size, cache_file in sorted(cache_files, reverse=True):
+        cache_size += size
+        if cache_size > ROAD_CACHE_MAXIMUM_SIZE:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(cache_file)
+            instrumentation.count("road_cache_evictions")
+
+
+def prepare_road_arrays(gcode_filename: str) -> dict[str, np.ndarray]:
+    """
+    Same as prepare_roads, but the roads are never Road objects (see LEAN_ROADS): they are parsed into arrays, the
+    contacts are calculated layer by layer (the shapely geometries of a layer are released once the contacts of the
+    next layer are calculated) and kept in CSR form. Uses the same ROAD_CACHE_DIRECTORY files as prepare_roads.
+    :param gcode_filename:
+    :return: see roads_to_arrays
+    """
+    if ROAD_CACHE_DIRECTORY is not None:
+        cache_filename = os.path.join(ROAD_CACHE_DIRECTORY, road_cache_key(gcode_filename) + ".npz")
+        arrays = _load_road_cache(cache_filename)
+        if arrays is not None:
+            return arrays
+
+    with instrumentation.phase("parse_roads"):
+        arrays, number_of_layers = parse_road_arrays(gcode_filename)
+    instrumentation.count("roads_created", len(arrays["gcode_line_number"]))
+    with instrumentation.phase("calculate_contacts"):
+        arrays["contact_pointers"], arrays["contact_indexes"], arrays["contact_areas"] = \
+            calculate_contact_arrays(arrays, number_of_layers)
+    instrumentation.count("contacts_found", len(arrays["contact_indexes"]))
+    with instrumentation.phase("calculate_free_areas"):
+        calculate_free_area_arrays(arrays)
+
+    if ROAD_CACHE_DIRECTORY is not None:
+        with instrumentation.phase("store_road_cache"):
+            store_road_cache(cache_filename, arrays)
+    return arrays
+
+
+def parse_road_arrays(gcode_filename: str) -> tuple[dict[str, np.ndarray], int]:
+    """
+    Same as parse_roads with the "chunks" parser, the roads are returned as arrays (see convert_move_batch_to_arrays).
+    :param gcode_filename:
+    :return: the arrays (additionally first_line_number and last_line_number, see mesh_road_arrays, travel_duration
+    and travel_layer_number, see coalesce_travel_move_arrays) and the number of layers
+    """
+    position_and_state = {"X": 0, "Y": 0, "Z": 0, "E": 0, "F": 3000, "layer_number": 0, "layer_height": 0}
+    batches = []
+    for moves in gcode_move_batches(gcode_filename):
+        arrays, position_and_state = convert_move_batch_to_arrays(moves, position_and_state)
+        batches.append(arrays)
+    if not batches:
+        batches.append(convert_move_batch_to_arrays(np.zeros(0, dtype=GCODE_MOVE_DTYPE), position_and_state)[0])
+    arrays = {field: np.concatenate([arrays[field] for arrays in batches]) for field in _ROAD_MOVE_FIELDS}
+    if MESH_ROADS:
+        arrays = mesh_road_arrays(arrays, MINIMUM_ELEMENT_LENGTH, MAXIMUM_SEGMENT_LENGTH, MESH_ANGLE_TOLERANCE)
+    else:
+        arrays["first_line_number"] = np.zeros(len(arrays["gcode_line_number"]), dtype=np.int64)
+        arrays["last_line_number"] = np.zeros(len(arrays["gcode_line_number"]), dtype=np.int64)
+    if COALESCE_TRAVEL_MOVES:
+        arrays = coalesce_travel_move_arrays(arrays)
+    else:
+        arrays["travel_duration"] = np.zeros(len(arrays["gcode_line_number"]))
+        arrays["travel_layer_number"] = np.zeros(len(arrays["gcode_line_number"]), dtype=np.int64)
+    return arrays, position_and_state["layer_number"]
+
+
+def calculate_contact_arrays(arrays: dict[str, np.ndarray], number_of_layers: int) \
+        -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Same as calculate_contacts for the roads of parse_road_arrays, only the roads of the current and the previous
+    layer are converted for the contact engine at a time.
+    :param arrays: the roads are sorted by layer
+    :param number_of_layers:
+    :return: contact_pointers, contact_indexes and contact_areas, see roads_to_arrays
+    """
+    layer_starts = np.searchsorted(arrays["layer_number"], np.arange(1, number_of_layers + 2))
+    # the roads with a geometry in build_geometries (travel moves have none, neither have negative widths)
+    has_geometry = arrays["width"] > 0
+    roads_in_layers = [start + np.flatnonzero(has_geometry[start:end])
+                       for start, end in zip(layer_starts.tolist(), layer_starts[1:].tolist())]
+    layers = ((arrays["gcode_line_number"][roads],
+               np.stack([arrays[field][roads] for field in ("start_x", "start_y", "end_x", "end_y", "width", "length",
+                                                           "layer_height")], axis=1))
+              for roads in roads_in_layers)
+    if CONTACT_ENGINE == "analytic":
+        layer_contacts = analytic_layer_contacts(layers)
+    elif CONTACT_DETECTION_PROCESSES != 1:
+        layer_contacts = parallel_layer_contacts(list(layers), CONTACT_DETECTION_PROCESSES)
+    else:
+        layer_contacts = shapely_layer_contacts(layers)
+
+    contact_rows = []
+    contact_indexes = []
+    contact_areas = []
+    roads_in_previous_layer = np.zeros(0, dtype=np.int64)
+    for layer, roads_in_layer, (rows, in_previous_layer, columns, areas) in zip(
+            itertools.count(1), roads_in_layers, layer_contacts):
+        print(layer)
+        indexes = np.empty(len(columns), dtype=np.int64)
+        indexes[~in_previous_layer] = roads_in_layer[columns[~in_previous_layer]]
+        indexes[in_previous_layer] = roads_in_previous_layer[columns[in_previous_layer]]
+        contact_rows.append(roads_in_layer[rows])
+        contact_indexes.append(indexes)
+        contact_areas.append(areas)
+        roads_in_previous_layer = roads_in_layer
+    # the layers and the roads in every layer are sorted, so are the rows
+    row_lengths = np.bincount(np.concatenate(contact_rows, dtype=np.int64),
+                              minlength=len(arrays["gcode_line_number"]))
+    return (np.concatenate(([0], np.cumsum(row_lengths))).astype(np.int64),
+            np.concatenate(contact_indexes, dtype=np.int64), np.concatenate(contact_areas, dtype=float))
+
+
+def calculate_free_area_arrays(arrays: dict[str, np.ndarray]):
+    """
+    Same as calculate_free_areas for the roads of parse_road_arrays, sets free_area (nan for travel moves) and the
+    contact area sums. The reduced contact areas are changed in contact_areas.
+    :param arrays: including the contacts of calculate_contact_arrays
+    """
+    count = len(arrays["gcode_line_number"])
+    roads = np.flatnonzero(arrays["width"] != 0)
+    contact_area_sums = _contact_area_sums(arrays["contact_pointers"], arrays["contact_indexes"],
+                                           arrays["contact_areas"], arrays["layer_number"], arrays["length"],
+                                           arrays["width"], arrays["layer_height"], roads)
+    for field, values in zip(("contact_area_bottom", "contact_area_top", "contact_area_sides", "contact_area_total"),
+                             contact_area_sums):
+        arrays[field] = np.zeros(count)
+        arrays[field][roads] = values
+    arrays["free_area"] = np.full(count, math.nan)
+    arrays["free_area"][roads] = _free_areas(arrays["length"][roads], arrays["width"][roads],
+                                             arrays["layer_height"][roads], arrays["contact_area_total"][roads])
+
+
+def _contact_area_sums(row_pointers: np.ndarray, columns: np.ndarray, contact_areas: np.ndarray,
+                       layer_number: np.ndarray, length: np.ndarray, width: np.ndarray, layer_height: np.ndarray,
+                       roads: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    calculate_road_free_area of the given rows of a CSR contact graph at once, the contact areas of the sides above
+    their surface are reduced in contact_areas. The areas of every row are added up in the order of the row like the
+    loops over the contacts dicts (np.bincount adds up in order), so the sums are bitwise identical.
+    :return: contact_area_bottom, contact_area_top, contact_area_sides and contact_area_total of the roads
+    """
+    row_starts = row_pointers[roads]
+    row_lengths = row_pointers[roads + 1] - row_starts
+    edges = _concatenated_ranges(row_starts, row_starts + row_lengths)
+    edge_roads = np.repeat(np.arange(len(roads)), row_lengths)
+    layer_offsets = layer_number[columns[edges]] - layer_number[roads][edge_roads]
+    surface_topbottom = length[roads] * width[roads]
+    surface_sides = 2 * (layer_height[roads] * length[roads]) + 2 * (layer_height[roads] * width[roads])
+
+    contact_area_sums = []
+    for layer_offset, surface in ((-1, surface_topbottom), (1, surface_topbottom), (0, surface_sides)):
+        side_edges = edges[layer_offsets == layer_offset]
+        side_roads = edge_roads[layer_offsets == layer_offset]
+        contact_area_sum = np.bincount(side_roads, weights=contact_areas[side_edges], minlength=len(roads))
+        # if this is too much then reduce all contact areas by the ratio
+        reduced = contact_area_sum > surface * 1.0001
+        if reduced.any():
+            area_reduction_factor = np.ones(len(roads))
+            area_reduction_factor[reduced] = surface[reduced] / contact_area_sum[reduced]
+            assert (area_reduction_factor < 1)[reduced].all()
+            reduced_edges = reduced[side_roads]
+            contact_areas[side_edges[reduced_edges]] *= area_reduction_factor[side_roads[reduced_edges]]
+            contact_area_sum[reduced] = np.bincount(side_roads[reduced_edges],
+                                                    weights=contact_areas[side_edges[reduced_edges]],
+                                                    minlength=len(roads))[reduced]
+        assert (contact_area_sum < surface * 1.0001).all()
+        contact_area_sums.append(contact_area_sum)
+    # the total of the roads without reduction is the same as when it is added up with the sides
+    contact_area_sums.append(np.bincount(edge_roads, weights=contact_areas[edges], minlength=len(roads)))
+    return tuple(contact_area_sums)
+
+
+def _free_areas(length: np.ndarray, width: np.ndarray, layer_height: np.ndarray,
+                contact_area_total: np.ndarray) -> np.ndarray:
+    """_free_area of several roads"""
+    total_surface = 2 * (length * width) + \
+        2 * (layer_height * length) + \
+        2 * (layer_height * width)
+
+    free_area = total_surface - contact_area_total
+    free_area[(0 > free_area) & (free_area > -0.02)] = 0  # rounding error
+    assert (free_area >= 0).all()
+    return free_area
+
+
+def road_array_layers(gcode_filename: str) -> Iterator[tuple[int, dict[str, np.ndarray]]]:
+    """
+    Same as parse_road_arrays, but the roads are returned layer by layer while the file is read.
+    :param gcode_filename:
+    :return: generator of the layer number and the arrays of the roads in the layer (including travel moves), for
+    every layer from 0 (the moves before the first layer change) to the last one, empty layers included
+    """
+    position_and_state = {"X": 0, "Y": 0, "Z": 0, "E": 0, "F": 3000, "layer_number": 0, "layer_height": 0}
+    layer_number = 0
+    # the roads of the current layer in the batches read so far
+    parts = [convert_move_batch_to_arrays(np.zeros(0, dtype=GCODE_MOVE_DTYPE), position_and_state)[0]]
+    # the temporary arrays of a chunk are about 25 times its size, GCODE_CHUNK_SIZE bounds the memory of the parsing
+    for moves in gcode_move_batches(gcode_filename, GCODE_CHUNK_SIZE):
+        arrays, position_and_state = convert_move_batch_to_arrays(moves, position_and_state)
+        layer_starts = np.searchsorted(arrays["layer_number"],
+                                       np.arange(layer_number, position_and_state["layer_number"] + 2)).tolist()
+        for start, end in zip(layer_starts, layer_starts[1:]):
+            parts.append({field: values[start:end] for field, values in arrays.items()})
+            if layer_number < position_and_state["layer_number"]:
+                yield layer_number, {field: np.concatenate([part[field] for part in parts])
+                                     for field in _ROAD_MOVE_FIELDS}
+                parts = []
+                layer_number += 1
+    yield layer_number, {field: np.concatenate([part[field] for part in parts]) for field in _ROAD_MOVE_FIELDS}
+
+
+def stream_road_layers(gcode_filename: str) \
+        -> Iterator[tuple[int, dict[str, np.ndarray], tuple[np.ndarray, np.ndarray, np.ndarray]]]:
+    """
+    prepare_road_arrays layer by layer for simulate_streaming: the contacts and the free areas of a layer are
+    calculated as soon as it is read, only the current and the previous layer are kept.
+    :param gcode_filename:
+    :return: generator of the layer number, the arrays of the layer (see road_array_layers, additionally the fields of
+    calculate_free_area_arrays) and its contacts: the number of contacts per deposited road of the layer, the
+    contacted roads (index among all deposited roads of the print) and the contact areas
+    """
+    layers = road_array_layers(gcode_filename)
+    pending = collections.deque()  # the layers given to the contact engine
+
+    def geometries():
+        for layer in layers:
+            pending.append(layer)
+            arrays = layer[1]
+            # the roads with a geometry in build_geometries (travel moves have none, neither have negative widths)
+            roads = np.flatnonzero(arrays["width"] > 0)
+            yield arrays["gcode_line_number"][roads], \
+                np.stack([arrays[field][roads] for field in ("start_x", "start_y", "end_x", "end_y", "width", "length",
+                                                            "layer_height")], axis=1)
+
+    # the moves before the first layer change get no contacts, see calculate_contact_arrays
+    no_contacts = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool), np.zeros(0, dtype=np.int64), np.zeros(0))
+    first_layer = next(layers)
+    if CONTACT_ENGINE == "analytic":
+        layer_contacts = analytic_layer_contacts(geometries())
+    else:
+        layer_contacts = shapely_layer_contacts(geometries())
+
+    first_index = 0  # index of the first deposited road of the layer among all deposited roads
+    # the deposited roads of the previous layer
+    previous_roads = {field: np.zeros(0, dtype=np.int64 if field == "layer_number" else float)
+                      for field in ("layer_number", "length", "width", "layer_height")}
+    previous_with_geometry = np.zeros(0, dtype=np.int64)
+    for (layer_number, arrays), (rows, in_previous_layer, columns, contact_areas) in itertools.chain(
+            [(first_layer, no_contacts)], ((pending.popleft(), contacts) for contacts in layer_contacts)):
+        print(layer_number)
+        deposited = arrays["width"] != 0
+        roads = {field: arrays[field][deposited] for field in ("layer_number", "length", "width", "layer_height")}
+        count = len(roads["layer_number"])
+        instrumentation.count("roads_created", len(deposited))
+        # the contacts index the roads with a geometry, calculate_free_area_arrays runs on the deposited roads of the
+        # previous and the current layer
+        with_geometry = np.flatnonzero(roads["width"] > 0)
+        previous_count = len(previous_roads["layer_number"])
+        indexes = np.empty(len(columns), dtype=np.int64)
+        indexes[~in_previous_layer] = previous_count + with_geometry[columns[~in_previous_layer]]
+        indexes[in_previous_layer] = previous_with_geometry[columns[in_previous_layer]]
+        row_pointers = np.concatenate(([0], np.cumsum(np.bincount(previous_count + with_geometry[rows],
+                                                                  minlength=previous_count + count))))
+        both_layers = {field: np.concatenate((previous_roads[field], roads[field])) for field in roads}
+        contact_area_sums = _contact_area_sums(row_pointers, indexes, contact_areas, both_layers["layer_number"],
+                                               both_layers["length"], both_layers["width"],
+                                               both_layers["layer_height"], previous_count + np.arange(count))
+        instrumentation.count("contacts_found", len(indexes))
+        for field, values in zip(("contact_area_bottom", "contact_area_top", "contact_area_sides",
+                                  "contact_area_total"), contact_area_sums):
+            arrays[field] = np.zeros(len(deposited))
+            arrays[field][deposited] = values
+        arrays["free_area"] = np.full(len(deposited), math.nan)
+        arrays["free_area"][deposited] = _free_areas(roads["length"], roads["width"], roads["layer_height"],
+                                                     arrays["contact_area_total"][deposited])
+        yield layer_number, arrays, (np.diff(row_pointers)[previous_count:],
+                                     indexes + (first_index - previous_count), contact_areas)
+
+        first_index += count
+        previous_roads = roads
+        previous_with_geometry = with_geometry
+
+
+# constants computed from other constants when the module is imported: the constants they are computed from and the
+# computation, in the order of the computation (see set_constants)
+_DERIVED_CONSTANTS = {
+    "MINIMUM_SEGMENT_LENGTH": (("XY_PRINTER_RESOLUTION",), lambda: XY_PRINTER_RESOLUTION),
+    "NOZZLE_AREA": (("FILAMENT_DIAMETER",), lambda: 0.25 * math.pi * (FILAMENT_DIAMETER ** 2)),
+    "_DENSITY": (("_MATERIALS", "_PRINTED_MATERIAL"), lambda: _MATERIALS[_PRINTED_MATERIAL][0]),
+    "_CAPACITY": (("_MATERIALS", "_PRINTED_MATERIAL"), lambda: _MATERIALS[_PRINTED_MATERIAL][1]),
+    "VOLUMETRIC_HEAT_CAPACITY": (("_DENSITY", "_CAPACITY"), lambda: _DENSITY * _CAPACITY),
+    "THERMAL_CONDUCTIVITY": (("_MATERIALS", "_PRINTED_MATERIAL"), lambda: _MATERIALS[_PRINTED_MATERIAL][2]),
+    "ENVIRONMENT_TEMPERATURE_IN_KELVIN": (("environment_temperature", "abs_zero_temp"),
+                                          lambda: environment_temperature - abs_zero_temp)}
+
+
+def _check_constants(names: Iterable[str]):
+    """
+    :raise ValueError: for names which are no constants of this module (numbers, strings, None and containers), and
+    for a derived constant (see _DERIVED_CONSTANTS) together with a constant it is computed from
+    """
+    names = set(names)
+    for name in sorted(names):
+        if name.startswith("__") or name not in globals() or \
+                not isinstance(globals()[name], (bool, int, float, str, type(None), tuple, list, dict)):
+            raise ValueError("%s is not a constant of the simulator" % name)
+    sources = {name: {name} for name in names}  # the given names a changed constant is computed from
+    for name, (inputs, _) in _DERIVED_CONSTANTS.items():
+        given = set().union(*(sources[input_name] for input_name in inputs if input_name in sources))
+        if given:
+            if name in names:
+                raise ValueError("%s is computed from %s, it can not be set together with it" %
+                                 (name, ", ".join(sorted(given))))
+            sources[name] = given
+
+
+def parse_constants(assignments: Iterable[str]) -> dict:
+    """
+    Parses the NAME=VALUE arguments of --set (batch.py, benchmark.py), see set_constants.
+    :param assignments: the values are Python literals, everything else is taken as string
+    :return: the values by name
+    :raise ValueError: see _check_constants
+    """
+    constants = {}
+    for assignment in assignments:
+        name, separator, value = assignment.partition("=")
+        if not separator:
+            raise ValueError("%s is not of the form NAME=VALUE" % assignment)
+        try:
+            constants[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            constants[name] = value
+    _check_constants(constants)
+    return constants
+
+
+def set_constants(constants: dict):
+    """
+    Changes module constants, the derived constants (see _DERIVED_CONSTANTS) are computed again from the changed ones.
+    :param constants: the values by name
+    :raise ValueError: see _check_constants
+    """
+    _check_constants(constants)
+    globals().update(constants)
+    changed = set(constants)
+    for name, (inputs, compute) in _DERIVED_CONSTANTS.items():
+        if changed.intersection(inputs):
+            globals()[name] = compute()
+            changed.add(name)
+
+
+def main(gcode_filename="sample-input-output/uberhangtest_6s.gcode",
+         contact_temps_filename="sample-input-output/export_contact_temps.gcode",
+         time_over_tgt_filename="sample-input-output/export_time_over_tgt.gcode", result_filename=None) -> dict:
+    """
+    Simulates the print of the gcode file and exports the results, see export_for_gcode.
+    :param result_filename: optional, the per road results are written to this file, see write_road_results
+    :return: see summarize_results, additionally the printing duration in seconds
+    """
+    if INSTRUMENTATION:
+        instrumentation.enable(profile=PROFILE_FILENAME is not None)
+    if STREAMING:
+        streamed_filename = result_filename
+        if result_filename is None:
+            file_descriptor, streamed_filename = tempfile.mkstemp(suffix=".roads")
+            os.close(file_descriptor)
+        result_writer = RoadResultWriter(streamed_filename)
+        with instrumentation.phase("simulate_deposition"):
+            current_simulation_time = simulate_streaming(gcode_filename, result_writer)
+        with instrumentation.phase("write_road_results"):
+            result_writer.close({"gcode_filename": gcode_filename, "printing_duration": current_simulation_time})
+        results = read_road_results(streamed_filename)[0]
+    elif LEAN_ROADS:
+        arrays = prepare_road_arrays(gcode_filename)
+        road_store = LeanRoadStore(arrays)
+        # the road store has its own copy of the contacts
+        del arrays["contact_pointers"], arrays["contact_indexes"], arrays["contact_areas"]
+        with instrumentation.phase("simulate_deposition"):
+            current_simulation_time = simulate_lean_deposition(arrays, road_store)
+        results = road_store.results(arrays)
+        if MESH_ROADS:
+            results = line_results(results, arrays["first_line_number"], arrays["last_line_number"])
+    else:
+        roads_by_geomid, roads_by_layer_number, number_of_layers = prepare_roads(gcode_filename)
+
+        with instrumentation.phase("simulate_deposition"):
+            current_simulation_time = simulate_deposition(roads_by_geomid.values(), len(roads_by_geomid))
+        results = road_results(roads_by_geomid.values())
+        if MESH_ROADS:
+            results = line_results(results, *(np.array([getattr(road, name) for road in roads_by_geomid.values()],
+                                                       dtype=np.int64)
+                                              for name in ("first_line_number", "last_line_number")))
+
+    # todo: after depositing all roads continue running the simulation until all roads cooled to environment temp
+    summary = summarize_results(results)
+    summary["printing_duration"] = current_simulation_time
+    print("Road with longest duration over PETG HDT: %s" % summary["longest_above_hdt_line_number"])
+    print(summary["max_temperature"])
+    print(summary["min_temperature"])
+    print(summary["mean_temperature"])
+    print("Printing duration in minutes:", current_simulation_time / 60)
+
+    # Visualisation
+    # export_for_threejs(roads_by_geomid)
+    with instrumentation.phase("export_for_gcode"):
+        export_for_gcode(gcode_filename, results, contact_temps_filename, time_over_tgt_filename)
+    if STREAMING:
+        del results  # the memory map
+        if result_filename is None:
+            os.remove(streamed_filename)
+    elif result_filename is not None:
+        with instrumentation.phase("write_road_results"):
+            write_road_results(result_filename, results,
+                               {"gcode_filename": gcode_filename, "printing_duration": current_simulation_time})
+
+    if INSTRUMENTATION:
+        instrumentation.disable()
+        instrumentation.print_summary()
+        instrumentation.write_trace(TRACE_FILENAME)
+        if PROFILE_FILENAME is not None:
+            instrumentation.write_profile(PROFILE_FILENAME)
+    return summary
+
+
+_SUMMARY_CHUNK_ROADS = 2 ** 20  # roads per chunk of summarize_results
+
+
+def summarize_results(results: dict[str, np.ndarray]) -> dict:
+    """
+    :param results: see road_results
+    :return: maximum, minimum and mean temperature at the end, the road with the longest duration above the HDT
+    """
+    # in chunks, the results may be a memory map (see read_road_results), the sum is added up in the same order
+    temperature_sum = 0
+    temperature_count = 0
+    maximum_temperature = -math.inf
+    minimum_temperature = math.inf
+    for start in range(0, len(results["temperature"]), _SUMMARY_CHUNK_ROADS):
+        temperatures = np.asarray(results["temperature"][start:start + _SUMMARY_CHUNK_ROADS])
+        end_temperatures = temperatures[~np.isnan(temperatures)].tolist()
+        if end_temperatures:
+            temperature_sum = sum(end_temperatures, temperature_sum)
+            temperature_count += len(end_temperatures)
+            maximum_temperature = max(maximum_temperature, max(end_temperatures))
+            minimum_temperature = min(minimum_temperature, min(end_temperatures))
+    longest_road = int(np.argmax(results["duration_temp_above_hdt"]))  # the first one
+    return {"max_temperature": maximum_temperature,
+            "min_temperature": minimum_temperature,
+            "mean_temperature": temperature_sum / temperature_count,
+            "longest_above_hdt_line_number": int(results["gcode_line_number"][longest_road]),
+            "longest_above_hdt_duration": float(results["duration_temp_above_hdt"][longest_road])}
+
+
+def parameter_grid(**values: list) -> list[dict]:
+    """
+    :param values: the values of each swept parameter, e.g. HC_ROAD=[1000, 3000], EMISSIVITY=[0.9, 0.96]
+    :return: all combinations as variants for simulate_sweep
+    """
+    return [dict(zip(values, combination)) for combination in itertools.product(*values.values())]
+
+
+def simulate_sweep(gcode_filename: str, variants: list[dict]) -> tuple["SweepRoadStore", float]:
+    """
+    Simulates the print once per variant, the roads, contacts and free areas are only calculated once.
+    :param gcode_filename:
+    :param variants: see SweepRoadStore and parameter_grid
+    :return: the store holding the results of all variants, the simulated time in seconds
+    """
+    if SIMULATION_ENGINE == "python":
+        raise ValueError("the parameter sweep requires the numpy engine")
+    if TIME_STEPPING == "adaptive":
+        raise ValueError("the adaptive time stepping is not supported by the parameter sweep")
+    if COOLING_FAST_FORWARD:
+        raise ValueError("the cooling fast-forward is not supported by the parameter sweep")
+    if MESH_ROADS:
+        raise ValueError("the meshing is not supported by the parameter sweep")
+    if CHECKPOINT_FILENAME is not None:
+        raise ValueError("the checkpoints are not supported by the parameter sweep")
+    roads_by_geomid, roads_by_layer_number, number_of_layers = prepare_roads(gcode_filename)
+    roads = list(roads_by_geomid.values())
+    road_store = SweepRoadStore(roads, variants)
+    with instrumentation.phase("simulate_deposition"):
+        current_simulation_time = simulate_deposition(roads, len(roads), road_store)
+    return road_store, current_simulation_time
+
+
+def write_sweep_results(filename: str, road_store: "SweepRoadStore"):
+    """
+    Writes the results of all variants as npz file, the arrays are indexed by [variant, road] and the roads are the
+    deposited roads in the order of gcode_line_number.
+    """
+    np.savez_compressed(filename, variants=np.array(json.dumps(road_store.variants)),
+                        gcode_line_number=np.array([road.gcode_line_number for road in road_store.roads],
+                                                   dtype=np.int64),
+                        duration_temp_above_hdt=road_store.duration_temp_above_hdt,
+                        temperature=road_store.temperature,
+                        avg_contact_temperatures_at_deposition=road_store.avg_contact_temperatures_at_deposition)
+
+
+def main_sweep(gcode_filename="sample-input-output/uberhangtest_6s.gcode", results_filename="sweep.npz",
+               **values: list):
+    """Simulates all combinations of the given parameter values and prints a summary per variant."""
+    road_store, current_simulation_time = simulate_sweep(gcode_filename, parameter_grid(**values))
+    print()
+    for variant, variant_parameters in enumerate(road_store.variants):
+        duration_temp_above_hdt = road_store.duration_temp_above_hdt[variant]
+        print(variant_parameters)
+        print("  Road with longest duration over HDT: %s (%.1f s), max temperature %.1f" %
+              (road_store.roads[np.argmax(duration_temp_above_hdt)].gcode_line_number,
+               duration_temp_above_hdt.max(), road_store.temperature[variant].max()))
+    print("Printing duration in minutes:", current_simulation_time / 60)
+    write_sweep_results(results_filename, road_store)
+
+
+def calculate_contact_temperature_at_deposition(road):
+    # only use previous layer
+    contact_temperatures_at_deposition = [contact_road.temperature for contact_road in road.contacts.keys() if
+                                          contact_road.gcode_line_number != road.gcode_line_number - 1]
+    contact_area_at_deposition = [contact_area for contact_road, contact_area in road.contacts.items() if
+                                  contact_road.gcode_line_number != road.gcode_line_number - 1]
+    sum_contact_areas = sum(contact_area_at_deposition)
+    # weight temperature by contact area
+    contact_temperatures = []
+    for temp, area in zip(contact_temperatures_at_deposition, contact_area_at_deposition):
+        weight = area / sum_contact_areas
+        contact_temperatures.append(temp * weight)
+    if road.layer_number == 1:
+        road.avg_contact_temperatures_at_deposition = environment_temperature
+    else:
+        if len(contact_temperatures_at_deposition) > 0:
+            avg_contact_temperatures_at_deposition = sum(contact_temperatures)
+            road.avg_contact_temperatures_at_deposition = avg_contact_temperatures_at_deposition
+        else:
+            road.avg_contact_temperatures_at_deposition = EXTRUSION_TEMPERATURE
+
+
+def simulate_time_step(current_time, current_layer_number: int, roads_in_simulation, simulation_time_step_duration):
+    args = [(r, simulation_time_step_duration) for r in roads_in_simulation]
+    # list() is required, a lazy starmap would already see the new temperatures of the roads updated before
+    new_temperatures = list(itertools.starmap(calculate_temperature, args))
+    # new_temperatures: set[tuple[Road, float]] = set()
+    # for simulated_road in roads_in_simulation:
+    #    temp = calculate_temperature(simulated_road, simulation_time_step_duration)
+    #    new_temperatures.add((simulated_road, temp))
+    current_time += simulation_time_step_duration
+    if instrumentation.enabled:
+        instrumentation.count("time_steps")
+        instrumentation.sample("active_roads", len(new_temperatures))
+    # setzt die neuen Temperaturen aller roads (erst nachdem alles durch berechnet ist!)
+    for updated_road, new_temp in new_temperatures:
+        if current_layer_number - updated_road.layer_number >= 3 and environment_temperature * 1.1 > new_temp:
+            # temperatur ist fast umgebungstemp und viele Schichten her -> rauswerfen
+            roads_in_simulation.remove(updated_road)
+            instrumentation.count("roads_retired")
+        if new_temp > 80:  # above Tgt of PETG, todo: move to constants
+            updated_road.duration_temp_above_hdt += simulation_time_step_duration
+        updated_road.temperature = new_temp
+    return current_time
+
+
+def simulate_deposition(roads: Iterable[Road], count_roads: int, road_store: "RoadStore" = None) -> float:
+    """
+    Deposits the roads one after another and simulates the time in between.
+    :param roads: all roads (including travel moves) sorted by gcode_line_number
+    :param count_roads: used for the progress output
+    :param road_store: optional, a RoadStore of the roads (to read its statistics afterwards)
+    :return: the simulated time in seconds
+    """
+    roads_in_simulation: set[Road] = set()
+    if ACTIVE_BODY and SIMULATION_ENGINE == "python":
+        raise ValueError("the active body requires the numpy engine")
+    if TEMPERATURE_HISTORY and SIMULATION_ENGINE == "python":
+        raise ValueError("the temperature history requires the numpy engine")
+    if TIME_INTEGRATION == "implicit" and SIMULATION_ENGINE == "python":
+        raise ValueError("the implicit time integration requires the numpy engine")
+    if CHECKPOINT_FILENAME is not None:
+        raise ValueError("the checkpoints require the lean roads")
+    if SIMULATION_ENGINE != "python":
+        if road_store is None:
+            roads = list(roads)
+            road_store = RoadStore(roads)
+
+        def time_step(current_time, current_layer_number, simulation_time_step_duration):
+            return road_store.simulate_time_step(current_time, current_layer_number, simulation_time_step_duration)
+        adaptive_time_step = road_store.adaptive_time_step
+        fast_forward = road_store.fast_forward
+    else:
+        road_store = None
+        adaptive_time_step = None
+        fast_forward = None
+
+        def time_step(current_time, current_layer_number, simulation_time_step_duration):
+            return simulate_time_step(current_time, current_layer_number, roads_in_simulation,
+                                      simulation_time_step_duration)
+
+    def deposit(road: Road, current_simulation_time):
+        if road is None:
+            return  # joined travel moves, see COALESCE_TRAVEL_MOVES
+        road.heat_capacity = calculate_road_heat_capacity(road)
+
+        if not road.is_travel():  # most travel moves are joined with COALESCE_TRAVEL_MOVES
+            if road.layer_number == 1:
+                road.temperature = environment_temperature
+            else:
+                road.temperature = EXTRUSION_TEMPERATURE  # hint: read extrusion temp from gcode
+            update_contacts_after_deposition(road)
+            instrumentation.count("roads_deposited")
+            if road_store is None:
+                roads_in_simulation.add(road)
+            else:
+                road_store.deposit(road, current_simulation_time)
+
+            calculate_contact_temperature_at_deposition(road)
+
+    def moves():
+        for road in roads:
+            yield road.gcode_line_number, road.layer_number, road.duration, road
+            if road.travel_duration > 0:
+                yield road.gcode_line_number, road.travel_layer_number, road.travel_duration, None
+
+    print("Simulation")
+    current_simulation_time = simulate_moves(moves(), count_roads, deposit, time_step, adaptive_time_step,
+                                             fast_forward)
+
+    if road_store is not None:
+        road_store.write_back()
+        if road_store.history is not None:
+            road_store.history.close()
+    return current_simulation_time
+
+
+def simulate_lean_deposition(arrays: dict[str, np.ndarray], road_store: "LeanRoadStore") -> float:
+    """
+    Same as simulate_deposition for the roads of prepare_road_arrays, see LEAN_ROADS. The results are kept in the
+    road store, see LeanRoadStore.results.
+    :param arrays: all roads (including travel moves)
+    :param road_store: LeanRoadStore of the arrays
+    :return: the simulated time in seconds
+    """
+    if SIMULATION_ENGINE == "python":
+        raise ValueError("the lean roads require the numpy engine")
+
+    def deposit(index: int, current_simulation_time):
+        if index >= 0:
+            road_store.deposit(index, current_simulation_time)
+            instrumentation.count("roads_deposited")
+
+    # the index of every road in the road store, -1 for travel moves
+    indexes = np.full(len(arrays["gcode_line_number"]), -1, dtype=np.int64)
+    indexes[road_store.road_positions] = np.arange(len(road_store.road_positions))
+    moves = zip(arrays["gcode_line_number"].tolist(), arrays["layer_number"].tolist(), arrays["duration"].tolist(),
+                indexes.tolist())
+    if COALESCE_TRAVEL_MOVES:
+        moves = _with_travel_moves(moves, arrays["travel_duration"].tolist(), arrays["travel_layer_number"].tolist())
+    print("Simulation")
+    if CHECKPOINT_FILENAME is None:
+        current_simulation_time = simulate_moves(moves, len(indexes), deposit, road_store.simulate_time_step,
+                                                 road_store.adaptive_time_step, road_store.fast_forward)
+    else:
+        current_simulation_time = _simulate_moves_with_checkpoints(arrays, road_store, moves, len(indexes), deposit)
+
+    if road_store.history is not None:
+        road_store.history.close()
+    return current_simulation_time
+
+
+# the constants changing the simulation of the roads, a checkpoint is only used with the same values
+_CHECKPOINT_CONSTANTS = ("EXTRUSION_TEMPERATURE", "MINIMUM_CONTACT_AREA", "VOLUMETRIC_HEAT_CAPACITY",
+                         "THERMAL_CONDUCTIVITY", "EMISSIVITY", "HC_ROAD", "CONTACT_HEAT_TRANSFER",
+                         "ENVIRONMENT_CONVECTION_COEFFICIENT", "environment_temperature", "TIME_INTEGRATION",
+                         "IMPLICIT_THETA", "IMPLICIT_SOLVER_TOLERANCE", "MAX_SIMULATION_TIME_STEP",
+                         "MIN_SIMULATION_TIME_STEP", "IMPLICIT_MAX_SIMULATION_TIME_STEP",
+                         "IMPLICIT_MIN_SIMULATION_TIME_STEP", "TIME_STEPPING", "ADAPTIVE_TEMPERATURE_CHANGE",
+                         "ADAPTIVE_MIN_TIME_STEP", "ADAPTIVE_MAX_TIME_STEP", "ADAPTIVE_STABILITY_FACTOR",
+                         "COOLING_FAST_FORWARD", "FAST_FORWARD_MIN_DURATION", "FAST_FORWARD_COUPLING", "ACTIVE_BODY",
+                         "ACTIVE_TIME", "N_CORE_ELEMENTS", "NEIGHBOR_DEPTH", "ACTIVE_BODY_RETIREMENT_TEMPERATURE",
+                         "COALESCE_TRAVEL_MOVES")
+
+
+def checkpoint_key(arrays: dict[str, np.ndarray]) -> str:
+    """:return: hash of the roads and of the constants changing their simulation, see _CHECKPOINT_CONSTANTS"""
+    key = hashlib.sha256()
+    for name in sorted(arrays):
+        key.update(name.encode())
+        key.update(np.ascontiguousarray(arrays[name]).view(np.uint8))
+    key.update(repr(tuple(globals()[name] for name in _CHECKPOINT_CONSTANTS)).encode())
+    return key.hexdigest()
+
+
+def _simulate_moves_with_checkpoints(arrays: dict[str, np.ndarray], road_store: "LeanRoadStore",
+                                     moves: Iterable[tuple[int, int, float, int]], count_roads: int,
+                                     deposit: Callable) -> float:
+    """
+    simulate_moves with checkpoints (see CHECKPOINT_FILENAME), resumes from the checkpoint if it is one of these roads.
+    """
+    if road_store.history is not None:
+        raise ValueError("the temperature history is not supported by the checkpoints")
+    key = checkpoint_key(arrays)
+    state = road_store.resume(CHECKPOINT_FILENAME, key)
+    if state is None:
+        moves_done, simulation_time, gcode_time = 0, 0.0, 0.0
+    else:
+        moves_done, simulation_time, gcode_time = state
+        print("Resuming at %.1f s of the print" % simulation_time)
+    checkpoint_durations = []
+    last_checkpoint = time.perf_counter()
+
+    def checkpoint(move_number, current_simulation_time, current_gcode_time):
+        nonlocal last_checkpoint
+        if time.perf_counter() - last_checkpoint < CHECKPOINT_INTERVAL:
+            return
+        with instrumentation.phase("checkpoint"):
+            start = time.perf_counter()
+            road_store.checkpoint(CHECKPOINT_FILENAME, key, (moves_done + move_number, current_simulation_time,
+                                                             current_gcode_time))
+            last_checkpoint = time.perf_counter()
+            checkpoint_durations.append(last_checkpoint - start)
+        instrumentation.count("checkpoints")
+
+    start = time.perf_counter()
+    current_simulation_time = simulate_moves(itertools.islice(moves, moves_done, None), count_roads - moves_done,
+                                             deposit, road_store.simulate_time_step, road_store.adaptive_time_step,
+                                             road_store.fast_forward, checkpoint, (simulation_time, gcode_time))
+    runtime = time.perf_counter() - start
+    print("\n%d checkpoints in %.2f s (%.2f %% of the simulation)" % (
+        len(checkpoint_durations), sum(checkpoint_durations), 100 * sum(checkpoint_durations) / runtime))
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(CHECKPOINT_FILENAME)
+    return current_simulation_time
+
+
+def _with_travel_moves(moves: Iterable[tuple[int, int, float, int]], travel_durations: list[float],
+                       travel_layer_numbers: list[int]) -> Iterator[tuple[int, int, float, int]]:
+    """:return: the moves of simulate_lean_deposition with the joined travel moves (COALESCE_TRAVEL_MOVES) inserted"""
+    for move, travel_duration, travel_layer_number in zip(moves, travel_durations, travel_layer_numbers):
+        yield move
+        if travel_duration > 0:
+            yield move[0], travel_layer_number, travel_duration, -1
+
+
+def simulate_streaming(gcode_filename: str, result_writer: "RoadResultWriter") -> float:
+    """
+    Same as simulate_lean_deposition, but the roads are read, their contacts calculated and simulated layer by layer
+    (see STREAMING): the roads of a layer are added to a StreamingRoadStore right before the layer is printed, the
+    layers below StreamingRoadStore.first_kept_layer are written to the result writer and removed from the store.
+    :param gcode_filename:
+    :param result_writer: gets the results of all roads (including travel moves) in the order of the gcode file
+    :return: the simulated time in seconds
+    """
+    if SIMULATION_ENGINE == "python":
+        raise ValueError("the streaming requires the numpy engine")
+    if TEMPERATURE_HISTORY:
+        raise ValueError("the temperature history is not supported by the streaming")
+    if COALESCE_TRAVEL_MOVES:
+        raise ValueError("the travel move coalescing is not supported by the streaming")
+    if MESH_ROADS:
+        raise ValueError("the meshing is not supported by the streaming")
+    if CHECKPOINT_FILENAME is not None:
+        raise ValueError("the checkpoints are not supported by the streaming")
+    if CONTACT_DETECTION_PROCESSES != 1:
+        raise ValueError("the contact detection processes are not supported by the streaming")
+    if ROAD_CACHE_DIRECTORY is not None:
+        raise ValueError("the road cache is not supported by the streaming")
+    road_store = StreamingRoadStore()
+    layers = collections.deque()  # layer number and arrays of the layers in the road store
+
+    def retire(first_kept_layer):
+        retired_layers = []
+        while layers and layers[0][0] < first_kept_layer:
+            retired_layers.append(layers.popleft()[1])
+        if retired_layers:
+            arrays = {field: np.concatenate([layer[field] for layer in retired_layers]) for field in _ROAD_MOVE_FIELDS}
+            road_positions = np.flatnonzero(arrays["width"] != 0)
+            result_writer.write(_array_road_results(arrays, road_positions,
+                                                    road_store.drop_roads(len(road_positions))))
+
+    def moves():
+        first_index = 0  # index of the first deposited road of the layer among all deposited roads
+        for layer_number, arrays, (forward_counts, forward_columns, forward_areas) in \
+                stream_road_layers(gcode_filename):
+            retire(road_store.first_kept_layer(layer_number))
+            deposited = arrays["width"] != 0
+            road_store.append_roads({field: arrays[field][deposited] for field in StreamingRoadStore.ROAD_FIELDS},
+                                    forward_counts, forward_columns, forward_areas)
+            layers.append((layer_number, {field: arrays[field] for field in _ROAD_MOVE_FIELDS}))
+            # the index of every road among all deposited roads, -1 for travel moves
+            indexes = np.full(len(deposited), -1, dtype=np.int64)
+            indexes[deposited] = first_index + np.arange(len(forward_counts))
+            first_index += len(forward_counts)
+            yield from zip(arrays["gcode_line_number"].tolist(), arrays["layer_number"].tolist(),
+                           arrays["duration"].tolist(), indexes.tolist())
+
+    def deposit(index: int, current_simulation_time):
+        if index >= 0:
+            road_store.deposit(index - road_store.offset, current_simulation_time)
+            instrumentation.count("roads_deposited")
+
+    print("Simulation")
+    current_simulation_time = simulate_moves(moves(), None, deposit, road_store.simulate_time_step,
+                                             road_store.adaptive_time_step, road_store.fast_forward)
+    retire(math.inf)
+    print("Most roads in the road store at once: %d" % road_store.max_road_count)
+    return current_simulation_time
+
+
+def simulate_moves(moves: Iterable[tuple[int, int, float, object]], count_roads: int, deposit: Callable,
+                   time_step: Callable, adaptive_time_step: Callable = None, fast_forward: Callable = None,
+                   checkpoint: Callable = None, start_times: tuple[float, float] = (0, 0)) -> float:
+    """
+    The time loop of simulate_deposition: deposits the roads one after another and simulates the time in between.
+    :param moves: gcode line number, layer number, duration and the road passed to deposit per road, sorted by
+    gcode_line_number
+    :param count_roads: used for the progress output, None if unknown (no progress output)
+    :param deposit: deposits the road at the current time
+    :param time_step: simulates the time step, see RoadStore.simulate_time_step
+    :param adaptive_time_step: returns the size of the next time step (see RoadStore.adaptive_time_step), only used
+    with TIME_STEPPING = "adaptive"
+    :param fast_forward: takes the weakly coupled roads out of the time steps of a gap (see RoadStore.fast_forward),
+    only used with COOLING_FAST_FORWARD
+    :param checkpoint: called before the first road of every layer (but the first) with the number of moves done, the
+    simulation time and the gcode time, see CHECKPOINT_FILENAME
+    :param start_times: the simulation time and the gcode time before the first move, see CHECKPOINT_FILENAME
+    :return: the simulated time in seconds
+    """
+    if TIME_STEPPING == "adaptive" and adaptive_time_step is None:
+        raise ValueError("the adaptive time stepping requires the numpy engine")
+    if COOLING_FAST_FORWARD and fast_forward is None:
+        raise ValueError("the cooling fast-forward requires the numpy engine")
+    current_simulation_time, current_gcode_time = start_times
+    previous_layer_number = None
+    if TIME_INTEGRATION == "implicit":
+        max_simulation_time_step = IMPLICIT_MAX_SIMULATION_TIME_STEP
+        min_simulation_time_step = IMPLICIT_MIN_SIMULATION_TIME_STEP
+    else:
+        max_simulation_time_step = MAX_SIMULATION_TIME_STEP
+        min_simulation_time_step = MIN_SIMULATION_TIME_STEP
+
+    for move_number, (current_gcode_line_number, layer_number, duration, road) in enumerate(moves):
+        # the moves are counted, the gcode line numbers of meshed roads (see MESH_ROADS) are not the ones of the file
+        if count_roads is not None and move_number % 100 == 0:
+            progress = move_number / count_roads
+            print(int(progress * 100), end=" ")
+        if checkpoint is not None and previous_layer_number is not None and layer_number != previous_layer_number:
+            checkpoint(move_number, current_simulation_time, current_gcode_time)
+        previous_layer_number = layer_number
+
+        deposit(road, current_simulation_time)
+
+        # Active Body (ACTIVE_BODY, see RoadStore.active_body):
+        # roads which were added 8 seconds before are removed from simulation (computeStartIndex) (ACTIVE_TIME)
+        # using max 200 elements (N_CORE_ELEMENTS)
+        # using max distance of 3 roads to the current one (NEIGHBOR_DEPTH)
+        # without Active Body:
+        # roads are removed from simulation when their temperature does not change anymore (environment temp+10%)
+        # AND the layer number of the road is lower by 20 than the current road (keep them when they are close)
+
+        current_layer_number = layer_number
+        current_gcode_time += duration
+        simulation_time_step_duration = current_gcode_time - current_simulation_time
+        finish_fast_forward = None
+        if COOLING_FAST_FORWARD and simulation_time_step_duration >= FAST_FORWARD_MIN_DURATION:
+            finish_fast_forward = fast_forward(current_simulation_time, current_layer_number,
+                                               simulation_time_step_duration)
+
+        if TIME_STEPPING == "adaptive":
+            while simulation_time_step_duration >= ADAPTIVE_MIN_TIME_STEP:
+                # the rest of the time is split into equal steps, so the last one is not shorter than the others
+                steps = math.ceil(simulation_time_step_duration / adaptive_time_step(current_simulation_time))
+                current_simulation_time = time_step(current_simulation_time, current_layer_number,
+                                                    simulation_time_step_duration / steps)
+                simulation_time_step_duration = current_gcode_time - current_simulation_time
+        elif simulation_time_step_duration > max_simulation_time_step:
+            whole_time_steps = simulation_time_step_duration // max_simulation_time_step
+            remainder_time_step = simulation_time_step_duration % max_simulation_time_step
+            for step in range(int(whole_time_steps)):
+                current_simulation_time = time_step(current_simulation_time, current_layer_number, max_simulation_time_step)
+            current_simulation_time = time_step(current_simulation_time, current_layer_number, remainder_time_step)
+
+        elif simulation_time_step_duration < min_simulation_time_step:
+            # don't simulate too litte time steps, but only when enough time has passed
+            pass
+        else:
+            current_simulation_time = time_step(current_simulation_time, current_layer_number, simulation_time_step_duration)
+        if finish_fast_forward is not None:
+            finish_fast_forward(current_simulation_time)
+
+    # the time after the last move which was too short for a time step, otherwise the roads deposited since the last
+    # time step (e.g. the short elements of MESH_ROADS) would keep their deposition temperature
+    if previous_layer_number is not None and current_gcode_time > current_simulation_time:
+        current_simulation_time = time_step(current_simulation_time, previous_layer_number,
+                                            current_gcode_time - current_simulation_time)
+    return current_simulation_time
+
+
+_COOLING_CURVE_POINTS = 4096
+_COOLING_CURVE_MINIMUM_DIFFERENCE = 1e-6  # K, the curve ends this close to the environment temperature
+
+
+@functools.lru_cache(maxsize=16)
+def cooling_curve(convection_coefficient: float, emissivity: float, environment_temperature: float,
+                  extrusion_temperature: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Exact solution of a road cooling by convection and radiation from its free area A only (heat capacity C):
+    C * dT/dt = -A * (h * (T - T_env) + e * s * (T^4 - T_env^4))
+    It only depends on the scaled time A/C * t, which is tabulated as the scaled time from the extrusion temperature
+    to T over x = ln(T - T_env) (the integrand (T - T_env) / flux is smooth in x, also close to T_env).
+    :return: x (increasing), the scaled time in m²*s*K/J at x (decreasing), see cooled_temperatures
+    """
+    x = np.linspace(math.log(_COOLING_CURVE_MINIMUM_DIFFERENCE),
+                    math.log(extrusion_temperature - environment_temperature), _COOLING_CURVE_POINTS)
+    temperature_difference = np.exp(x)
+    temperature_in_kelvin = environment_temperature + temperature_difference - abs_zero_temp
+    flux = convection_coefficient * temperature_difference + emissivity * BOLTZMAN_CONSTANT * \
+        (temperature_in_kelvin ** 4 - (environment_temperature - abs_zero_temp) ** 4)
+    integrand = temperature_difference / flux
+    scaled_time = np.concatenate((np.cumsum(((integrand[1:] + integrand[:-1]) * 0.5 * np.diff(x))[::-1])[::-1], [0]))
+    return x, scaled_time
+
+
+def cooled_temperatures(temperatures: np.ndarray, durations: np.ndarray, time_scales: np.ndarray) \
+        -> tuple[np.ndarray, np.ndarray]:
+    """
+    Cooling by convection and radiation only, see cooling_curve.
+    :param temperatures: start temperatures, above the environment temperature
+    :param durations: seconds
+    :param time_scales: free area in m² / heat capacity
+    :return: the temperatures after the durations, the time above the HDT within the durations
+    """
+    x, scaled_time = cooling_curve(ENVIRONMENT_CONVECTION_COEFFICIENT, EMISSIVITY, environment_temperature,
+                                   EXTRUSION_TEMPERATURE)
+    start_scaled_time = np.interp(np.log(temperatures - environment_temperature), x, scaled_time)
+    new_temperatures = environment_temperature + np.exp(np.interp(start_scaled_time + durations * time_scales,
+                                                                  scaled_time[::-1], x[::-1]))
+    # the time until the HDT is crossed, infinite without free area
+    with np.errstate(divide="ignore"):
+        crossing_time = (np.interp(math.log(80 - environment_temperature), x, scaled_time) - start_scaled_time) / \
+            time_scales
+    return new_temperatures, np.where(temperatures > 80, np.minimum(crossing_time, durations), 0.0)
+
+
+@functools.lru_cache
+def _numba_kernels() -> dict[str, Callable]:
+    """
+    Compiles (or loads from the cache) the kernels of the "numba" engine, they release the GIL (see STEPPING_THREADS)
+    and fill out[start:end]:
+    - explicit_temperatures: the same operations as RoadStore._explicit_temperatures in the same order, one loop over
+      the rows of the simulated roads active_roads[start:end]
+    - system_product: the product of the system matrix of RoadStore._implicit_temperatures for the rows start to end
+    :return: the compiled functions by name, None if numba is not installed
+    """
+    try:
+        import numba
+    except ImportError:
+        print("numba is not installed, using the numpy engine")
+        return None
+
+    # compiled when defined (the signature is given), so RoadStore compiles them before the time loop
+    @numba.njit("void(int64[:], int64[:], int64[:], float64[:], float64[:], float64[:], float64[:], float64[:], "
+                "float64, boolean, float64, float64, float64, float64, float64, float64, float64, float64, int64, "
+                "int64, float64[:])", cache=True, nogil=True)
+    def explicit_temperatures(active_roads, row_pointers, columns, edge_area, edge_thickness_in_m, temperature,
+                              free_area, heat_capacity, simulation_time_step_duration, gap_conductance, hc_road,
+                              thermal_conductivity, convection_coefficient, emissivity, boltzman_constant,
+                              environment_temperature, environment_temperature_in_kelvin_4, extrusion_temperature,
+                              start, end, out):
+        for position in range(start, end):
+            road = active_roads[position]
+            road_temperature = temperature[road]
+            # 1. conduction to contacts, see calculate_contact_conduction
+            edge_energy_sum = 0.0
+            for edge in range(row_pointers[road], row_pointers[road + 1]):
+                if gap_conductance:
+                    edge_energy_sum += hc_road * (0.000001 * edge_area[edge]) * \
+                        (road_temperature - temperature[columns[edge]])
+                else:
+                    edge_energy_sum += thermal_conductivity * (0.000001 * edge_area[edge]) * \
+                        ((road_temperature - temperature[columns[edge]]) / edge_thickness_in_m[edge])
+            contact_energy = edge_energy_sum * simulation_time_step_duration
+
+            # 2. convection and radiation from free area
+            free_area_in_m = 0.000001 * free_area[road]
+            convection_energy = simulation_time_step_duration * free_area_in_m * convection_coefficient * \
+                (road_temperature - environment_temperature)
+            road_temperature_in_kelvin = road_temperature - abs_zero_temp
+            radiation_energy = simulation_time_step_duration * free_area_in_m * emissivity * boltzman_constant * \
+                (road_temperature_in_kelvin * road_temperature_in_kelvin * road_temperature_in_kelvin *
+                 road_temperature_in_kelvin - environment_temperature_in_kelvin_4)
+            new_temperature = road_temperature - (contact_energy + convection_energy + radiation_energy) / \
+                heat_capacity[road]
+
+            # todo: simulation is apparently not precise enough for small roads
+            if (new_temperature < environment_temperature or new_temperature >= extrusion_temperature) and \
+                    heat_capacity[road] < 0.0001:
+                # the contacts of the road which exist yet
+                new_temperature = math.inf
+                for edge in range(row_pointers[road], row_pointers[road + 1]):
+                    if edge_area[edge] > 0:
+                        new_temperature = min(new_temperature, temperature[columns[edge]])
+                if new_temperature == math.inf:
+                    new_temperature = environment_temperature
+            out[position] = new_temperature
+
+    @numba.njit("void(int64[:], int64[:], float64[:], float64[:], float64[:], float64, int64, int64, float64[:])",
+                cache=True, nogil=True)
+    def system_product(row_pointers, positions, conductance, diagonal, x, theta, start, end, out):
+        for row in range(start, end):
+            coupled_flow = 0.0
+            for edge in range(row_pointers[row], row_pointers[row + 1]):
+                coupled_flow += conductance[edge] * x[positions[edge]]
+            out[row] = diagonal[row] * x[row] - theta * coupled_flow
+
+    return {"explicit_temperatures": explicit_temperatures, "system_product": system_product}
+
+
+@functools.lru_cache
+def _stepping_executor(threads: int) -> concurrent.futures.ThreadPoolExecutor:
+    return concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix="stepping")
+
+
+def _run_in_blocks(kernel: Callable, edge_pointers: np.ndarray, out: np.ndarray, *arguments):
+    """
+    Runs kernel(*arguments, start, end, out) for blocks of consecutive rows with a similar number of edges, in the
+    threads of STEPPING_THREADS.
+    :param edge_pointers: the CSR row pointers of the rows
+    """
+    count = len(edge_pointers) - 1
+    blocks = max(1, min(STEPPING_THREADS, count // STEPPING_MINIMUM_BLOCK_ROADS))
+    instrumentation.count("stepping_calls")
+    instrumentation.count("stepping_blocks", blocks)
+    if blocks == 1:
+        kernel(*arguments, 0, count, out)
+        return
+    bounds = np.searchsorted(edge_pointers, np.linspace(0, edge_pointers[-1], blocks + 1)).tolist()
+    bounds[0], bounds[-1] = 0, count
+    futures = [_stepping_executor(STEPPING_THREADS).submit(kernel, *arguments, start, end, out)
+               for start, end in zip(bounds, bounds[1:]) if end > start]
+    for future in futures:
+        future.result()
+
+
+class RoadStore(object):
+    """
+    Structure-of-arrays copy of the deposited (non-travel) roads used by the "numpy" engine.
+
+    Temperature, heat capacity, free area and layer number are kept in contiguous arrays indexed by road.index, the
+    contact graph is kept in CSR form (row = road, columns = contacted roads). The CSR holds every contact the print
+    will ever have in both directions, contacts which do not exist yet have an area of 0. A time step is one
+    gather/scatter over the edges of the simulated roads (the sparse mat-vec) plus element-wise convection and
+    radiation, the result is the same as calculate_temperature for every road in roads_in_simulation.
+    The Road objects stay the owner of the contacts, deposit() syncs the changed rows into the arrays.
+    """
+
+    def __init__(self, roads: list[Road]):
+        self.roads = [road for road in roads if not road.is_travel()]
+        for index, road in enumerate(self.roads):
+            road.index = index
+        self._initialize({field: np.array([getattr(road, field) for road in self.roads],
+                                          dtype=np.int64 if field in ("gcode_line_number", "layer_number") else float)
+                          for field in ("gcode_line_number", "layer_number", "length", "width", "layer_height",
+                                        "free_area")},
+                         np.array([len(road.contacts) for road in self.roads], dtype=np.int64),
+                         np.fromiter((contact_road.index for road in self.roads for contact_road in road.contacts),
+                                     dtype=np.int64),
+                         np.fromiter((contact_area for road in self.roads for contact_area in road.contacts.values()),
+                                     dtype=float))
+
+    def _initialize(self, roads: dict[str, np.ndarray], forward_counts: np.ndarray, forward_columns: np.ndarray,
+                    forward_areas: np.ndarray):
+        """
+        :param roads: gcode_line_number, layer_number, length, width, layer_height and free_area per road
+        :param forward_counts: number of contacts per road
+        :param forward_columns: the contacted roads, in the order of the contacts dicts
+        :param forward_areas: the contact areas
+        """
+        count = len(roads["layer_number"])
+        self.gcode_line_number = roads["gcode_line_number"]
+        self.layer_number = roads["layer_number"]
+        self.length = roads["length"]
+        self.width = roads["width"]
+        self.layer_height = roads["layer_height"]
+        self.temperature = np.full(count, float(environment_temperature))
+        self.heat_capacity = np.ones(count)  # set on deposition, 1 avoids divisions by zero before
+        self.free_area = np.array(roads["free_area"], dtype=float)
+        self.duration_temp_above_hdt = np.zeros(count)
+        self.in_simulation = np.zeros(count, dtype=bool)
+        self.deposition_time = np.zeros(count)
+        self.deposited_count = 0  # the roads are deposited in the order of their index
+
+        # Contacts are only stored towards already deposited roads, the reverse direction is added on deposition.
+        # Each row is laid out in the iteration order of road.contacts (stored contacts first, then the reverse
+        # contacts in deposition order), so the sums are added up in the same order as calculate_contact_conduction.
+        self.forward_counts = forward_counts
+        row_lengths = forward_counts + np.bincount(forward_columns, minlength=count)
+        self.row_pointers = np.concatenate(([0], np.cumsum(row_lengths)))
+        forward_edges = _concatenated_ranges(self.row_pointers[:-1], self.row_pointers[:-1] + forward_counts)
+        reverse_edges = _concatenated_ranges(self.row_pointers[:-1] + forward_counts, self.row_pointers[1:])
+        self.columns = np.empty(self.row_pointers[-1], dtype=np.int64)
+        self.columns[forward_edges] = forward_columns
+        # the stored contacts are sorted by road, so are the reverse contacts of every contacted road
+        self.columns[reverse_edges] = np.repeat(np.arange(count), forward_counts)[
+            np.argsort(forward_columns, kind="stable")]
+        self.edge_thickness_in_m = self._edge_thickness_in_m(np.repeat(np.arange(count), row_lengths), self.columns)
+        self.edge_area = np.zeros(len(self.columns))
+        self.edge_area[forward_edges] = forward_areas
+
+        self._active_roads = None  # cache of _update_active_edges()
+        self._active_edges = None
+        self._active_rows = None
+        self._active_positions = None  # reused, see _set_active_roads
+        self._positioned_roads = None  # the roads set in _active_positions
+        self._first_simulated = 0  # no road below is in the simulation, see _simulated_roads
+        self._body_mask = None  # all False between the calls of active_body
+        self._simulated_road_count = 0
+        self.time_step_count = 0
+        # per time step: simulated roads, roads which would be simulated without the active body
+        self.active_road_counts: list[int] = []
+        self.simulated_road_counts: list[int] = []
+        self.max_inactive_above_hdt = 0  # roads outside of the active body with a temperature above the HDT
+        self.history = None
+        if TEMPERATURE_HISTORY:
+            if MESH_ROADS:
+                raise ValueError("the temperature history is not supported by the meshing")
+            self.history = TemperatureHistory(self.gcode_line_number, TEMPERATURE_HISTORY_FILENAME,
+                                              TEMPERATURE_HISTORY_ROADS)
+        if SIMULATION_ENGINE == "numba":
+            _numba_kernels()
+
+    def _edge_thickness_in_m(self, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        """:return: the thickness used by calculate_contact_conduction per edge, it does not change over time"""
+        thickness = np.where(self.layer_number[rows] != self.layer_number[columns],
+                             self.layer_height[rows] + self.layer_height[columns],
+                             self.width[rows] + self.width[columns])
+        successive = np.abs(self.gcode_line_number[rows] - self.gcode_line_number[columns]) == 1
+        thickness[successive] = self.length[rows][successive] + self.length[columns][successive]
+        return thickness * 0.001
+
+    def _update_row(self, road: Road):
+        row_start, row_end = self.row_pointers[road.index], self.row_pointers[road.index + 1]
+        reverse_start = row_start + self.forward_counts[road.index]
+        areas = np.fromiter(road.contacts.values(), dtype=float, count=len(road.contacts))
+        self.edge_area[row_start:row_end] = 0
+        self.edge_area[row_start:reverse_start] = areas[:self.forward_counts[road.index]]
+        if len(areas) > self.forward_counts[road.index]:
+            # not every reverse contact exists (yet), see update_contacts_after_deposition
+            reverse_indexes = np.fromiter((contact_road.index for contact_road in
+                                           itertools.islice(road.contacts, self.forward_counts[road.index], None)),
+                                          dtype=np.int64)
+            positions = reverse_start + np.searchsorted(self.columns[reverse_start:row_end], reverse_indexes)
+            self.edge_area[positions] = areas[self.forward_counts[road.index]:]
+
+    def deposit(self, road: Road, current_time=0.0):
+        """
+        Adds a road to the simulation, must be called after update_contacts_after_deposition.
+        The temperatures of the contacted roads are copied to the Road objects for the deposition statistics.
+        :param road:
+        :param current_time: deposition time used by the active body
+        :return:
+        """
+        self.deposition_time[road.index] = current_time
+        self.deposited_count = road.index + 1
+        self.temperature[..., road.index] = road.temperature
+        self.heat_capacity[..., road.index] = road.heat_capacity
+        self.in_simulation[road.index] = True
+        self._active_roads = None
+        if self.history is not None:
+            self.history.deposit(road.index, current_time, self.road_temperature(road.index))
+        for contact_road in road.contacts:
+            # contact areas and free area of the contacted roads were changed by update_contacts_after_deposition
+            self._update_row(contact_road)
+            self.free_area[contact_road.index] = contact_road.free_area
+            contact_road.temperature = self.road_temperature(contact_road.index)
+
+    def active_body(self, current_time, roads: np.ndarray) -> np.ndarray:
+        """
+        Port of ActiveBody.BFS: the roads deposited within ACTIVE_TIME and the last N_CORE_ELEMENTS roads plus their
+        deposited contacts up to NEIGHBOR_DEPTH contacts away. Additionally all roads above
+        ACTIVE_BODY_RETIREMENT_TEMPERATURE. Only the given roads and the contacts of the search are visited, not all
+        roads.
+        :param current_time:
+        :param roads: deposited roads
+        :return: mask of the given roads which are in the active body
+        """
+        deposited_count = self.deposited_count
+        # the roads deposited within ACTIVE_TIME and the core are both the last deposited roads
+        core_start = max(0, deposited_count - N_CORE_ELEMENTS)
+        recent_start = min(core_start, int(np.searchsorted(self.deposition_time[:deposited_count],
+                                                           current_time - ACTIVE_TIME)))
+        if self._body_mask is None or len(self._body_mask) != len(self.layer_number):
+            self._body_mask = np.zeros(len(self.layer_number), dtype=bool)
+        neighbors = self._body_mask  # the contacts found by the search below recent_start
+        frontier = np.arange(core_start, deposited_count)
+        found = []
+        for _ in range(NEIGHBOR_DEPTH):
+            row_starts = self.row_pointers[frontier]
+            row_lengths = self.row_pointers[frontier + 1] - row_starts
+            edges = np.arange(row_lengths.sum()) - np.repeat(np.cumsum(row_lengths) - row_lengths - row_starts,
+                                                             row_lengths)
+            # contacts which do not exist yet have an area of 0
+            contacts = self.columns[edges[self.edge_area[edges] > 0]]
+            frontier = np.unique(contacts[(contacts < recent_start) & ~neighbors[contacts]])
+            neighbors[frontier] = True
+            found.append(frontier)
+        active = (roads >= recent_start) | neighbors[roads]
+        for frontier in found:
+            neighbors[frontier] = False
+        if ACTIVE_BODY_RETIREMENT_TEMPERATURE is not None:
+            active |= self.maximum_temperature(roads) > ACTIVE_BODY_RETIREMENT_TEMPERATURE
+        return active
+
+    def _simulated_roads(self) -> np.ndarray:
+        """
+        :return: the roads in the simulation, only the deposited roads from the lowest road still in the simulation
+        are scanned (the roads leave the simulation roughly in the order of their deposition)
+        """
+        simulated = self._first_simulated + np.flatnonzero(self.in_simulation[self._first_simulated:
+                                                                               self.deposited_count])
+        self._first_simulated = int(simulated[0]) if len(simulated) > 0 else self.deposited_count
+        return simulated
+
+    def _update_active_edges(self, current_time):
+        # the edges of all simulated roads, cached until a road is deposited or removed
+        simulated = self._simulated_roads()
+        self._simulated_road_count = len(simulated)
+        if ACTIVE_BODY:
+            active_body = self.active_body(current_time, simulated)
+            self._set_active_roads(simulated[active_body])
+            self.max_inactive_above_hdt = max(self.max_inactive_above_hdt, np.count_nonzero(
+                ~active_body & (self.maximum_temperature(simulated) > 80)))
+        else:
+            self._set_active_roads(simulated)
+
+    def _set_active_roads(self, active_roads: np.ndarray):
+        self._active_roads = active_roads
+        row_starts = self.row_pointers[self._active_roads]
+        row_lengths = self.row_pointers[self._active_roads + 1] - row_starts
+        self._active_rows = np.repeat(np.arange(len(self._active_roads)), row_lengths)
+        self._active_edges = np.arange(row_lengths.sum()) - np.repeat(np.cumsum(row_lengths) - row_lengths, row_lengths) \
+            + np.repeat(row_starts, row_lengths)
+        # position of each road in _active_roads, -1 if it is not simulated
+        if self._active_positions is None or len(self._active_positions) != len(self.layer_number):
+            self._active_positions = np.full(len(self.layer_number), -1, dtype=np.int64)
+        else:
+            self._active_positions[self._positioned_roads] = -1
+        self._active_positions[self._active_roads] = np.arange(len(self._active_roads))
+        self._positioned_roads = self._active_roads
+
+    def simulate_time_step(self, current_time, current_layer_number: int, simulation_time_step_duration):
+        if self._active_roads is None:
+            self._update_active_edges(current_time)
+        active_roads = self._active_roads
+        self.active_road_counts.append(len(active_roads))
+        self.simulated_road_counts.append(self._simulated_road_count)
+        if instrumentation.enabled:
+            instrumentation.count("time_steps")
+            instrumentation.sample("active_roads", len(active_roads))
+        if TIME_INTEGRATION == "implicit":
+            new_temperatures = self._implicit_temperatures(simulation_time_step_duration)
+        else:
+            new_temperatures = self._explicit_temperatures(simulation_time_step_duration)
+        new_temperatures[..., self.layer_number[active_roads] == 1] = environment_temperature
+        assert (new_temperatures >= environment_temperature * 0.99).all()
+        assert (new_temperatures <= EXTRUSION_TEMPERATURE).all()
+        self.time_step_count += 1
+
+        current_time += simulation_time_step_duration
+        # temperatur ist fast umgebungstemp und viele Schichten her -> rauswerfen
+        removed = (current_layer_number - self.layer_number[active_roads] >= 3) & \
+            np.all(environment_temperature * 1.1 > np.atleast_2d(new_temperatures), axis=0)
+        if removed.any():
+            self.in_simulation[active_roads[removed]] = False
+            self._active_roads = None
+            instrumentation.count("roads_retired", int(np.count_nonzero(removed)))
+        self.duration_temp_above_hdt[..., active_roads] += np.where(new_temperatures > 80,
+                                                                    simulation_time_step_duration, 0.0)
+        self.temperature[..., active_roads] = new_temperatures
+        if self.history is not None:
+            # the first variant of a SweepRoadStore
+            self.history.update(current_time, active_roads, np.atleast_2d(new_temperatures)[0])
+        return current_time
+
+    def road_temperature(self, index: int) -> float:
+        return float(self.temperature[index])
+
+    def maximum_temperature(self, roads: np.ndarray) -> np.ndarray:
+        """:return: temperature of the roads, the maximum of all variants of a SweepRoadStore"""
+        return self.temperature[roads]
+
+    def adaptive_time_step(self, current_time) -> float:
+        """
+        Step size of TIME_STEPPING = "adaptive" for the next time step: no simulated road may change by more than
+        ADAPTIVE_TEMPERATURE_CHANGE at its current rate of change. The explicit integration is additionally limited to
+        ADAPTIVE_STABILITY_FACTOR times the stability limit heat capacity / sum of the conductances of every road (the
+        forward Euler step of a single road does not overshoot below it), except for the small roads which are clamped
+        by _explicit_temperatures. The roads in layer 1 are fixed and not considered.
+        :param current_time: used by the active body
+        :return: seconds between ADAPTIVE_MIN_TIME_STEP and ADAPTIVE_MAX_TIME_STEP
+        """
+        if self._active_roads is None:
+            self._update_active_edges(current_time)
+        active_roads = self._active_roads
+        active_rows = self._active_rows
+        active_edges = self._active_edges
+        temperature = self.temperature
+        active_temperature = temperature[active_roads]
+        count = len(active_roads)
+
+        edge_conductance = self._edge_conductance(active_edges)
+        conductance_sum = np.bincount(active_rows, weights=edge_conductance, minlength=count)
+        free_area_in_m = 0.000001 * self.free_area[active_roads]
+        convection_conductance = free_area_in_m * ENVIRONMENT_CONVECTION_COEFFICIENT
+        active_temperature_in_kelvin = active_temperature - abs_zero_temp
+        radiation_factor = free_area_in_m * EMISSIVITY * BOLTZMAN_CONSTANT
+        heat_flow = conductance_sum * active_temperature - \
+            np.bincount(active_rows, weights=edge_conductance * temperature[self.columns[active_edges]],
+                        minlength=count) + \
+            convection_conductance * (active_temperature - environment_temperature) + \
+            radiation_factor * (active_temperature_in_kelvin ** 4 - ENVIRONMENT_TEMPERATURE_IN_KELVIN ** 4)
+
+        heat_capacity = self.heat_capacity[active_roads]
+        considered = self.layer_number[active_roads] != 1
+        time_step = ADAPTIVE_MAX_TIME_STEP
+        maximum_rate = np.max(np.abs(heat_flow[considered]) / heat_capacity[considered], initial=0)
+        if maximum_rate > 0:
+            time_step = min(time_step, ADAPTIVE_TEMPERATURE_CHANGE / maximum_rate)
+        if TIME_INTEGRATION != "implicit":
+            considered &= heat_capacity >= 0.0001
+            # derivative of the radiation as conductance
+            total_conductance = conductance_sum + convection_conductance + \
+                4 * radiation_factor * active_temperature_in_kelvin ** 3
+            time_step = min(time_step, ADAPTIVE_STABILITY_FACTOR * np.min(
+                heat_capacity[considered] / total_conductance[considered], initial=math.inf))
+        return max(time_step, ADAPTIVE_MIN_TIME_STEP)
+
+    def _edge_conductance(self, edges: np.ndarray) -> np.ndarray:
+        """:return: conductance of the contact per edge in W/K, see calculate_contact_conduction"""
+        if CONTACT_HEAT_TRANSFER == "gap_conductance":
+            return HC_ROAD * (0.000001 * self.edge_area[edges])
+        return THERMAL_CONDUCTIVITY * (0.000001 * self.edge_area[edges]) / self.edge_thickness_in_m[edges]
+
+    def fast_forward(self, current_time, current_layer_number: int, duration) -> Callable[[float], None]:
+        """
+        Takes the weakly coupled roads (see COOLING_FAST_FORWARD) out of the simulation until the returned function is
+        called at the end of the gap, which advances them over the whole gap at once (see cooled_temperatures). Roads
+        which would cool below the current temperature of a contact within the gap are not weakly coupled.
+        :param current_time: start of the gap
+        :param current_layer_number:
+        :param duration: length of the gap, the gap may end earlier
+        :return: function of the time at the end of the gap
+        """
+        if self._active_roads is None:
+            self._update_active_edges(current_time)
+        active_roads = self._active_roads
+        active_rows = self._active_rows
+        active_edges = self._active_edges
+        temperature = self.temperature
+        active_temperature = temperature[active_roads]
+        count = len(active_roads)
+
+        edge_conductance = self._edge_conductance(active_edges)
+        # contacts which do not exist yet have an area of 0
+        temperature_difference = active_temperature[active_rows] - temperature[self.columns[active_edges]]
+        contact_temperature_difference = np.full(count, math.inf)  # to the hottest contact
+        np.minimum.at(contact_temperature_difference, active_rows[edge_conductance > 0],
+                      temperature_difference[edge_conductance > 0])
+        conduction = np.bincount(active_rows, weights=edge_conductance * temperature_difference, minlength=count)
+        free_area_in_m = 0.000001 * self.free_area[active_roads]
+        active_temperature_in_kelvin = active_temperature - abs_zero_temp
+        surface_flow = free_area_in_m * (
+            ENVIRONMENT_CONVECTION_COEFFICIENT * (active_temperature - environment_temperature) +
+            EMISSIVITY * BOLTZMAN_CONSTANT * (active_temperature_in_kelvin ** 4 - ENVIRONMENT_TEMPERATURE_IN_KELVIN ** 4))
+        # layer 1 is fixed to the environment temperature
+        weakly_coupled = (contact_temperature_difference >= 0) & (conduction <= FAST_FORWARD_COUPLING * surface_flow) & \
+            (active_temperature - environment_temperature > _COOLING_CURVE_MINIMUM_DIFFERENCE) & \
+            (self.layer_number[active_roads] != 1)
+        candidates = np.flatnonzero(weakly_coupled)
+        time_scale = free_area_in_m[candidates] / self.heat_capacity[active_roads[candidates]]
+        weakly_coupled[candidates] = active_temperature[candidates] - contact_temperature_difference[candidates] <= \
+            cooled_temperatures(active_temperature[candidates], duration, time_scale)[0]
+        roads = active_roads[weakly_coupled]
+        start_temperature = active_temperature[weakly_coupled]
+        time_scale = time_scale[weakly_coupled[candidates]]
+        self.in_simulation[roads] = False
+        self._active_roads = None
+        instrumentation.count("roads_fast_forwarded", len(roads))
+
+        def finish(end_time):
+            end_temperature, duration_above_hdt = cooled_temperatures(start_temperature, end_time - current_time,
+                                                                      time_scale)
+            self.duration_temp_above_hdt[roads] += duration_above_hdt
+            self.temperature[roads] = end_temperature
+            # temperatur ist fast umgebungstemp und viele Schichten her -> rauswerfen
+            removed = (current_layer_number - self.layer_number[roads] >= 3) & \
+                (environment_temperature * 1.1 > end_temperature)
+            self.in_simulation[roads[~removed]] = True
+            self._first_simulated = min(self._first_simulated, int(roads.min(initial=self._first_simulated)))
+            self._active_roads = None
+            instrumentation.count("roads_retired", int(np.count_nonzero(removed)))
+            if self.history is not None:
+                self.history.update(end_time, roads, end_temperature)
+        return finish
+
+    def _explicit_temperatures(self, simulation_time_step_duration):
+        active_roads = self._active_roads
+        temperature = self.temperature
+        if SIMULATION_ENGINE == "numba" and _numba_kernels() is not None:
+            new_temperatures = np.empty(len(active_roads))
+            _run_in_blocks(_numba_kernels()["explicit_temperatures"],
+                           np.concatenate(([0], np.cumsum(self.row_pointers[active_roads + 1] -
+                                                          self.row_pointers[active_roads]))), new_temperatures,
+                           active_roads, self.row_pointers, self.columns, self.edge_area, self.edge_thickness_in_m,
+                           temperature, self.free_area, self.heat_capacity, float(simulation_time_step_duration),
+                           CONTACT_HEAT_TRANSFER == "gap_conductance", float(HC_ROAD), float(THERMAL_CONDUCTIVITY),
+                           float(ENVIRONMENT_CONVECTION_COEFFICIENT), float(EMISSIVITY), float(BOLTZMAN_CONSTANT),
+                           float(environment_temperature), float(ENVIRONMENT_TEMPERATURE_IN_KELVIN ** 4),
+                           float(EXTRUSION_TEMPERATURE))
+            return new_temperatures
+        active_temperature = temperature[active_roads]
+
+        # 1. conduction to contacts, see calculate_contact_conduction
+        active_edges = self._active_edges
+        if CONTACT_HEAT_TRANSFER == "gap_conductance":
+            edge_energy = HC_ROAD * (0.000001 * self.edge_area[active_edges]) * \
+                (active_temperature[self._active_rows] - temperature[self.columns[active_edges]])
+        else:
+            edge_energy = THERMAL_CONDUCTIVITY * (0.000001 * self.edge_area[active_edges]) * \
+                ((active_temperature[self._active_rows] - temperature[self.columns[active_edges]]) /
+                 self.edge_thickness_in_m[active_edges])
+        contact_energy = np.bincount(self._active_rows, weights=edge_energy, minlength=len(active_roads)) * \
+            simulation_time_step_duration
+
+        # 2. convection and radiation from free area
+        free_area_in_m = 0.000001 * self.free_area[active_roads]
+        convection_energy = simulation_time_step_duration * free_area_in_m * ENVIRONMENT_CONVECTION_COEFFICIENT * \
+            (active_temperature - environment_temperature)
+        active_temperature_in_kelvin = active_temperature - abs_zero_temp
+        radiation_energy = simulation_time_step_duration * free_area_in_m * EMISSIVITY * BOLTZMAN_CONSTANT * \
+            (active_temperature_in_kelvin * active_temperature_in_kelvin * active_temperature_in_kelvin *
+             active_temperature_in_kelvin - ENVIRONMENT_TEMPERATURE_IN_KELVIN ** 4)
+
+        heat_capacity = self.heat_capacity[active_roads]
+        new_temperatures = active_temperature - (contact_energy + convection_energy + radiation_energy) / heat_capacity
+
+        # todo: simulation is apparently not precise enough for small roads
+        imprecise = ((new_temperatures < environment_temperature) | (new_temperatures >= EXTRUSION_TEMPERATURE)) & \
+            (heat_capacity < 0.0001)
+        for position in np.flatnonzero(imprecise):
+            row_start, row_end = self.row_pointers[active_roads[position]], self.row_pointers[active_roads[position] + 1]
+            # the contacts of the road which exist yet
+            contacts = self.columns[row_start:row_end][self.edge_area[row_start:row_end] > 0]
+            if len(contacts) > 0:
+                new_temperatures[position] = temperature[contacts].min()
+            else:
+                new_temperatures[position] = environment_temperature
+        return new_temperatures
+
+    def _implicit_temperatures(self, simulation_time_step_duration):
+        """
+        Theta scheme for the simulated roads, roads outside of the simulation keep their temperature and act as
+        boundary. The radiation is linearised around the current temperature:
+        R(T') = R(T) + 4*e*s*A*T^3 * (T' - T)
+        No clamping is necessary, backward Euler keeps all temperatures between the ambient and the extrusion
+        temperature for every step size (Crank-Nicolson may oscillate for very long steps).
+        """
+        theta = IMPLICIT_THETA
+        active_roads = self._active_roads
+        active_rows = self._active_rows
+        active_edges = self._active_edges
+        temperature = self.temperature
+        active_temperature = temperature[active_roads]
+        if simulation_time_step_duration <= 0:
+            return active_temperature  # remainder of a whole number of steps
+        contact_temperature = temperature[self.columns[active_edges]]
+        count = len(active_roads)
+
+        edge_conductance = self._edge_conductance(active_edges)
+        # layer 1 is fixed to the environment temperature
+        fixed = self.layer_number[active_roads] == 1
+        edge_conductance[fixed[active_rows]] = 0
+        contact_positions = self._active_positions[self.columns[active_edges]]
+        # the unknowns are only coupled by existing contacts between simulated roads
+        coupled = (contact_positions >= 0) & (edge_conductance > 0)
+        coupled_rows = active_rows[coupled]
+        coupled_positions = contact_positions[coupled]
+        coupled_conductance = edge_conductance[coupled]
+
+        free_area_in_m = 0.000001 * self.free_area[active_roads]
+        convection_conductance = free_area_in_m * ENVIRONMENT_CONVECTION_COEFFICIENT
+        active_temperature_in_kelvin = active_temperature - abs_zero_temp
+        radiation_factor = free_area_in_m * EMISSIVITY * BOLTZMAN_CONSTANT
+        radiation = radiation_factor * (active_temperature_in_kelvin * active_temperature_in_kelvin *
+                                        active_temperature_in_kelvin * active_temperature_in_kelvin -
+                                        ENVIRONMENT_TEMPERATURE_IN_KELVIN ** 4)
+        radiation_conductance = 4 * radiation_factor * active_temperature_in_kelvin ** 3
+
+        # heat flow out of each road at the current temperatures
+        conductance_sum = np.bincount(active_rows, weights=edge_conductance, minlength=count)
+        heat_flow = conductance_sum * active_temperature - \
+            np.bincount(active_rows, weights=edge_conductance * contact_temperature, minlength=count) + \
+            convection_conductance * (active_temperature - environment_temperature) + radiation
+
+        capacity_rate = self.heat_capacity[active_roads] / simulation_time_step_duration
+        diagonal = capacity_rate + theta * (conductance_sum + convection_conductance + radiation_conductance)
+        fixed_contacts_flow = np.bincount(active_rows, weights=np.where(coupled, 0, edge_conductance) *
+                                          contact_temperature, minlength=count)
+        right_hand_side = capacity_rate * active_temperature - (1 - theta) * heat_flow + \
+            theta * (convection_conductance * environment_temperature + radiation_conductance * active_temperature -
+                     radiation + fixed_contacts_flow)
+        diagonal[fixed] = 1
+        right_hand_side[fixed] = environment_temperature
+
+        if SIMULATION_ENGINE == "numba" and _numba_kernels() is not None:
+            coupled_pointers = np.searchsorted(coupled_rows, np.arange(count + 1))  # the rows are sorted
+
+            def system_product(x):
+                product = np.empty(count)
+                _run_in_blocks(_numba_kernels()["system_product"], coupled_pointers, product, coupled_pointers,
+                               coupled_positions, coupled_conductance, diagonal, x, float(theta))
+                return product
+        else:
+            def system_product(x):
+                return diagonal * x - theta * np.bincount(coupled_rows, weights=coupled_conductance *
+                                                          x[coupled_positions], minlength=count)
+
+        new_temperatures = solve_bicgstab(system_product, right_hand_side, active_temperature, diagonal,
+                                          IMPLICIT_SOLVER_TOLERANCE)
+        # only removes the deviations of the iterative solver
+        return np.clip(new_temperatures, environment_temperature, EXTRUSION_TEMPERATURE)
+
+    def active_body_statistics(self) -> dict[str, float]:
+        """
+        :return: size of the simulated set per time step (mean, 99th percentile, max), the same without the active body
+        and the maximum number of roads above the HDT which were outside of the active body
+        """
+        active_road_counts = np.array(self.active_road_counts, dtype=float)
+        simulated_road_counts = np.array(self.simulated_road_counts, dtype=float)
+        if len(active_road_counts) == 0:
+            active_road_counts = simulated_road_counts = np.zeros(1)
+        return {"mean_active_roads": active_road_counts.mean(),
+                "p99_active_roads": np.percentile(active_road_counts, 99),
+                "max_active_roads": active_road_counts.max(),
+                "mean_simulated_roads": simulated_road_counts.mean(),
+                "max_simulated_roads": simulated_road_counts.max(),
+                "max_inactive_above_hdt": self.max_inactive_above_hdt}
+
+    def write_back(self):
+        """Copies the simulation results to the Road objects."""
+        for road in self.roads:
+            road.temperature = self.road_temperature(road.index)
+            road.duration_temp_above_hdt = float(self.duration_temp_above_hdt[road.index])
+
+
+class LeanRoadStore(RoadStore):
+    """
+    RoadStore of the roads of prepare_road_arrays (see LEAN_ROADS) without Road objects. The roads are addressed by
+    their index, the contacts only exist in the CSR arrays and deposit() does update_contacts_after_deposition,
+    add_road_contact and calculate_contact_temperature_at_deposition on the arrays. The results are bitwise identical
+    to RoadStore.
+    """
+
+    def __init__(self, arrays: dict[str, np.ndarray]):
+        """
+        :param arrays: all roads (including travel moves), see roads_to_arrays
+        """
+        deposited = arrays["width"] != 0  # not is_travel()
+        self.road_positions = np.flatnonzero(deposited)  # position of every road of the store in the arrays
+        self.roads = None
+        # contacts are never travel moves
+        indexes = np.cumsum(deposited) - 1
+        self._initialize({field: arrays[field][deposited] for field in ("gcode_line_number", "layer_number", "length",
+                                                                        "width", "layer_height", "free_area")},
+                         np.diff(arrays["contact_pointers"])[deposited], indexes[arrays["contact_indexes"]],
+                         arrays["contact_areas"])
+        self.contact_area_bottom = arrays["contact_area_bottom"][deposited]
+        self.contact_area_top = arrays["contact_area_top"][deposited]
+        self.contact_area_sides = arrays["contact_area_sides"][deposited]
+        self.contact_area_total = arrays["contact_area_total"][deposited]
+        self.avg_contact_temperatures_at_deposition = np.zeros(len(self.road_positions))
+
+    def deposit(self, index: int, current_time=0.0):
+        """
+        Adds a road to the simulation, see RoadStore.deposit.
+        :param index: the roads are deposited in the order of their index
+        :param current_time: deposition time used by the active body
+        """
+        if self.layer_number[index] == 1:
+            temperature = environment_temperature
+        else:
+            temperature = EXTRUSION_TEMPERATURE  # hint: read extrusion temp from gcode
+        contacts_start = self.row_pointers[index]
+        contacts_end = contacts_start + self.forward_counts[index]
+        contacts = self.columns[contacts_start:contacts_end].tolist()
+        contact_areas = self.edge_area[contacts_start:contacts_end].tolist()
+
+        # update_contacts_after_deposition, the road is never in the contacts of the contacted roads yet
+        gcode_line_number = self.gcode_line_number[index]
+        for contact_index, contact_area in zip(contacts, contact_areas):
+            if abs(self.gcode_line_number[contact_index] - gcode_line_number) == 1:
+                # predecessor/successor -> use minimum contact area by using both line widths into account
+                contact_area = min((self.width[index] * self.layer_height[index],
+                                    self.width[contact_index] * self.layer_height[contact_index]))
+            if contact_area > MINIMUM_CONTACT_AREA:
+                self._add_contact(contact_index, index, contact_area)
+
+        self.deposition_time[index] = current_time
+        self.deposited_count = index + 1
+        self.temperature[index] = temperature
+        # see calculate_road_heat_capacity
+        self.heat_capacity[index] = self.length[index] * self.width[index] * self.layer_height[index] * 0.000000001 * \
+            VOLUMETRIC_HEAT_CAPACITY
+        self.in_simulation[index] = True
+        self._active_roads = None
+        if self.history is not None:
+            self.history.deposit(index, current_time, self.road_temperature(index))
+
+        # calculate_contact_temperature_at_deposition, only use previous layer
+        contact_temperatures_at_deposition = []
+        contact_area_at_deposition = []
+        for contact_index, contact_area in zip(contacts, contact_areas):
+            if self.gcode_line_number[contact_index] != gcode_line_number - 1:
+                contact_temperatures_at_deposition.append(self.road_temperature(contact_index))
+                contact_area_at_deposition.append(contact_area)
+        sum_contact_areas = sum(contact_area_at_deposition)
+        if self.layer_number[index] == 1:
+            self.avg_contact_temperatures_at_deposition[index] = environment_temperature
+        elif len(contact_temperatures_at_deposition) > 0:
+            # weight temperature by contact area
+            self.avg_contact_temperatures_at_deposition[index] = sum(
+                temp * (area / sum_contact_areas)
+                for temp, area in zip(contact_temperatures_at_deposition, contact_area_at_deposition))
+        else:
+            self.avg_contact_temperatures_at_deposition[index] = EXTRUSION_TEMPERATURE
+
+    def _add_contact(self, index: int, contact_index: int, contact_area: float):
+        """add_road_contact on the arrays, also updates the free area of the road."""
+        reverse_start = self.row_pointers[index] + self.forward_counts[index]
+        reverse_end = self.row_pointers[index + 1]
+        self.edge_area[reverse_start + np.searchsorted(self.columns[reverse_start:reverse_end], contact_index)] = \
+            contact_area
+        if self.layer_number[contact_index] == self.layer_number[index] - 1:
+            self.contact_area_bottom[index] += contact_area
+            reduce = self.contact_area_bottom[index] > self.length[index] * self.width[index] * 1.0001
+        elif self.layer_number[contact_index] == self.layer_number[index] + 1:
+            self.contact_area_top[index] += contact_area
+            reduce = self.contact_area_top[index] > self.length[index] * self.width[index] * 1.0001
+        elif self.layer_number[contact_index] == self.layer_number[index]:
+            self.contact_area_sides[index] += contact_area
+            reduce = self.contact_area_sides[index] > \
+                (2 * (self.layer_height[index] * self.length[index]) +
+                 2 * (self.layer_height[index] * self.width[index])) * 1.0001
+        else:
+            reduce = False
+        if reduce:
+            # the contacts which do not exist yet have an area of 0 and do not change the sums
+            road = slice(index, index + 1)
+            (self.contact_area_bottom[road], self.contact_area_top[road], self.contact_area_sides[road],
+             self.contact_area_total[road]) = _contact_area_sums(
+                self.row_pointers, self.columns, self.edge_area, self.layer_number, self.length, self.width,
+                self.layer_height, np.array([index]))
+        else:
+            self.contact_area_total[index] += contact_area
+        self.free_area[index] = _free_area(self.length[index], self.width[index], self.layer_height[index],
+                                           self.contact_area_total[index])
+
+    # the state of the deposited roads changed by the simulation
+    _CHECKPOINT_FIELDS = ("temperature", "heat_capacity", "free_area", "duration_temp_above_hdt", "in_simulation",
+                          "deposition_time", "contact_area_bottom", "contact_area_top", "contact_area_sides",
+                          "contact_area_total", "avg_contact_temperatures_at_deposition")
+
+    def checkpoint(self, filename: str, key: str, position: tuple[int, float, float]):
+        """
+        Writes the state of the simulation atomically as uncompressed npz file. Roads which are not deposited yet did
+        not change, so only the deposited roads and their contacts (a prefix of every array) are written.
+        :param filename:
+        :param key: see checkpoint_key
+        :param position: the number of moves done, the simulation time and the gcode time
+        """
+        deposited = slice(0, self.deposited_count)
+        state = {field: getattr(self, field)[deposited] for field in self._CHECKPOINT_FIELDS}
+        state["edge_area"] = self.edge_area[:self.row_pointers[self.deposited_count]]
+        state["active_road_counts"] = np.array(self.active_road_counts, dtype=np.int32)
+        state["simulated_road_counts"] = np.array(self.simulated_road_counts, dtype=np.int32)
+        state["counts"] = np.array((self.deposited_count, self.time_step_count, self.max_inactive_above_hdt,
+                                    position[0]), dtype=np.int64)
+        state["times"] = np.array(position[1:], dtype=float)
+        state["key"] = np.array(key)
+        file_descriptor, temporary_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                                                               suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as checkpoint_file:
+                np.savez(checkpoint_file, **state)
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+            os.replace(temporary_filename, filename)
+        except BaseException:
+            os.remove(temporary_filename)
+            raise
+
+    def resume(self, filename: str, key: str) -> tuple[int, float, float]:
+        """
+        Restores the state of a checkpoint, see checkpoint.
+        :return: the number of moves done, the simulation time and the gcode time, None if there is no checkpoint of
+        these roads and constants (the store is not changed then)
+        """
+        try:
+            with np.load(filename) as state:
+                if str(state["key"]) != key:
+                    print("Ignoring the checkpoint %s of other roads or constants" % filename)
+                    return None
+                state = dict(state)
+        except FileNotFoundError:
+            return None
+        deposited_count, self.time_step_count, self.max_inactive_above_hdt, moves_done = state["counts"].tolist()
+        self.deposited_count = deposited_count
+        for field in self._CHECKPOINT_FIELDS:
+            getattr(self, field)[:deposited_count] = state[field]
+        self.edge_area[:len(state["edge_area"])] = state["edge_area"]
+        self.active_road_counts = state["active_road_counts"].tolist()
+        self.simulated_road_counts = state["simulated_road_counts"].tolist()
+        self._first_simulated = 0
+        self._active_roads = None
+        simulation_time, gcode_time = state["times"].tolist()
+        return moves_done, simulation_time, gcode_time
+
+    def results(self, arrays: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        """
+        :param arrays: the arrays of the store
+        :return: the results of all roads (including travel moves), see road_results
+        """
+        return _array_road_results(arrays, self.road_positions, {
+            "temperature": self.temperature, "duration_temp_above_hdt": self.duration_temp_above_hdt,
+            "avg_contact_temperatures_at_deposition": self.avg_contact_temperatures_at_deposition})
+
+
+def _array_road_results(arrays: dict[str, np.ndarray], road_positions: np.ndarray,
+                        values: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """
+    :param arrays: roads of parse_road_arrays (including travel moves)
+    :param road_positions: position of every deposited road in the arrays
+    :param values: temperature, duration_temp_above_hdt and avg_contact_temperatures_at_deposition per deposited road
+    :return: the results of all roads, see road_results
+    """
+    count = len(arrays["gcode_line_number"])
+    results = {name: arrays[name] for name, _ in ROAD_RESULT_COLUMNS if name in arrays}
+    for name, default in (("temperature", math.nan), ("duration_temp_above_hdt", 0.0),
+                          ("avg_contact_temperatures_at_deposition", 0.0)):
+        results[name] = np.full(count, default)
+        results[name][road_positions] = values[name]
+    return results
+
+
+class StreamingRoadStore(LeanRoadStore):
+    """
+    LeanRoadStore of simulate_streaming which only holds the roads of a few layers. The roads of a layer are added
+    just before the layer is printed (append_roads), the retired roads of the lowest layers are removed once no
+    simulated road can reach them anymore (drop_roads). The index of a road in the store is its index among all
+    deposited roads of the print minus offset.
+    """
+
+    # per road, given by append_roads
+    ROAD_FIELDS = ("gcode_line_number", "layer_number", "length", "width", "layer_height", "free_area",
+                   "contact_area_bottom", "contact_area_top", "contact_area_sides", "contact_area_total")
+
+    def __init__(self):
+        self.offset = 0  # number of removed roads
+        self.roads = None
+        self._initialize({field: np.zeros(0, dtype=np.int64 if field in ("gcode_line_number", "layer_number")
+                                          else float) for field in self.ROAD_FIELDS},
+                         np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+        self.contact_area_bottom = np.zeros(0)
+        self.contact_area_top = np.zeros(0)
+        self.contact_area_sides = np.zeros(0)
+        self.contact_area_total = np.zeros(0)
+        self.avg_contact_temperatures_at_deposition = np.zeros(0)
+        self.max_road_count = 0  # the most roads held at once
+
+    def _state_fields(self) -> tuple[tuple[str, object], ...]:
+        # per road, changed by the simulation: name, value before the deposition
+        return (("temperature", float(environment_temperature)), ("heat_capacity", 1.0),
+                ("duration_temp_above_hdt", 0.0), ("in_simulation", False), ("deposition_time", 0.0),
+                ("avg_contact_temperatures_at_deposition", 0.0))
+
+    def first_kept_layer(self, layer_number: int) -> int:
+        """
+        :param layer_number: the next layer
+        :return: the lowest layer which is still needed when the next layer is printed: the contacts of the simulated
+        roads (active_body follows the contacts NEIGHBOR_DEPTH layers down from the core) and of the previous layer,
+        whose contact areas are reduced on deposition
+        """
+        deposited_count = self.deposited_count
+        simulated = self._simulated_roads()
+        lowest_layer = int(self.layer_number[simulated[0]]) if len(simulated) > 0 else layer_number
+        depth = 1
+        if ACTIVE_BODY and deposited_count > 0:
+            lowest_layer = min(lowest_layer, int(self.layer_number[max(0, deposited_count - N_CORE_ELEMENTS)]))
+            depth = max(1, NEIGHBOR_DEPTH)
+        return min(lowest_layer - depth, layer_number - 2)
+
+    def append_roads(self, roads: dict[str, np.ndarray], forward_counts: np.ndarray, forward_columns: np.ndarray,
+                     forward_areas: np.ndarray):
+        """
+        Adds the roads of the next layer. Their reverse contacts are appended to the rows of the contacted roads, they
+        are deposited after all contacts already in these rows.
+        :param roads: the fields of ROAD_FIELDS per road
+        :param forward_counts: number of contacts per road
+        :param forward_columns: the contacted roads (index among all deposited roads), in the order of the contacts
+        dicts
+        :param forward_areas: the contact areas
+        """
+        count = len(self.layer_number)
+        new_count = len(forward_counts)
+        for field in self.ROAD_FIELDS:
+            setattr(self, field, np.concatenate((getattr(self, field), roads[field])))
+        for field, value in self._state_fields():
+            values = getattr(self, field)
+            setattr(self, field, np.concatenate((values, np.full(new_count, value, dtype=values.dtype))))
+        self.forward_counts = np.concatenate((self.forward_counts, forward_counts))
+
+        forward_columns = forward_columns - self.offset
+        forward_rows = np.repeat(np.arange(count, count + new_count), forward_counts)
+        old_lengths = np.concatenate((np.diff(self.row_pointers), np.zeros(new_count, dtype=np.int64)))
+        forward_lengths = np.concatenate((np.zeros(count, dtype=np.int64), forward_counts))
+        row_pointers = np.concatenate(([0], np.cumsum(old_lengths + forward_lengths +
+                                                      np.bincount(forward_columns, minlength=count + new_count))))
+        columns = np.empty(row_pointers[-1], dtype=np.int64)
+        edge_area = np.zeros(len(columns))
+        edge_thickness_in_m = np.empty(len(columns))
+        old_edges = _concatenated_ranges(row_pointers[:count], row_pointers[:count] + old_lengths[:count])
+        columns[old_edges] = self.columns
+        edge_area[old_edges] = self.edge_area
+        edge_thickness_in_m[old_edges] = self.edge_thickness_in_m
+        forward_edges = _concatenated_ranges(row_pointers[count:-1], row_pointers[count:-1] + forward_counts)
+        columns[forward_edges] = forward_columns
+        edge_area[forward_edges] = forward_areas
+        edge_thickness_in_m[forward_edges] = self._edge_thickness_in_m(forward_rows, forward_columns)
+        # the new contacts are sorted by road, so are the reverse contacts of every contacted road
+        reverse_edges = _concatenated_ranges(row_pointers[:-1] + old_lengths + forward_lengths, row_pointers[1:])
+        order = np.argsort(forward_columns, kind="stable")
+        columns[reverse_edges] = forward_rows[order]
+        edge_thickness_in_m[reverse_edges] = edge_thickness_in_m[forward_edges][order]
+        self.row_pointers = row_pointers
+        self.columns = columns
+        self.edge_area = edge_area
+        self.edge_thickness_in_m = edge_thickness_in_m
+
+        self._active_positions = None  # reallocated for the new roads
+        if self._active_roads is not None:
+            self._set_active_roads(self._active_roads)  # same roads, the edges moved
+        self.max_road_count = max(self.max_road_count, len(self.layer_number))
+
+    def drop_roads(self, count: int) -> dict[str, np.ndarray]:
+        """
+        Removes the first roads, which must be below first_kept_layer (or all roads at the end of the print). The
+        contacts of the remaining roads to them are removed too, these rows are never read again.
+        :param count:
+        :return: temperature, duration_temp_above_hdt and avg_contact_temperatures_at_deposition of the removed roads
+        """
+        results = {field: getattr(self, field)[:count] for field in
+                   ("temperature", "duration_temp_above_hdt", "avg_contact_temperatures_at_deposition")}
+        first_edge = self.row_pointers[count]
+        row_lengths = np.diff(self.row_pointers[count:])
+        columns = self.columns[first_edge:] - count
+        removed = columns < 0
+        # all contacts to removed roads are stored contacts
+        removed_counts = np.bincount(np.repeat(np.arange(len(row_lengths)), row_lengths)[removed],
+                                     minlength=len(row_lengths))
+        self.columns = columns[~removed]
+        self.edge_area = self.edge_area[first_edge:][~removed]
+        self.edge_thickness_in_m = self.edge_thickness_in_m[first_edge:][~removed]
+        self.row_pointers = np.concatenate(([0], np.cumsum(row_lengths - removed_counts)))
+        self.forward_counts = self.forward_counts[count:] - removed_counts
+        for field in self.ROAD_FIELDS + tuple(field for field, _ in self._state_fields()):
+            setattr(self, field, getattr(self, field)[count:].copy())  # a view would keep the removed roads
+
+        self.offset += count
+        self.deposited_count -= count
+        self._first_simulated = max(0, self._first_simulated - count)
+        self._active_positions = None  # the indexes changed
+        if self._active_roads is not None and (len(self._active_roads) == 0 or self._active_roads[0] >= count):
+            self._set_active_roads(self._active_roads - count)
+        else:
+            self._active_roads = None  # all roads are removed at the end of the print
+        return results
+
+
+# sample of the file written by TemperatureHistory
+TEMPERATURE_HISTORY_DTYPE = np.dtype([("gcode_line_number", "<i4"), ("time", "<f8"), ("temperature", "<f4")])
+
+
+class TemperatureHistory(object):
+    """
+    Port of TempHistory.js for all recorded roads of a RoadStore at once. Like TempHistory.buffer the latest sample of
+    every road is held back, it is only kept when the next sample is more than time_sample_rate or
+    temperature_sample_rate away from the last kept sample (so the kept samples are the last ones before the
+    temperature changed noticeably).
+    The kept samples are collected in an array preallocated from the memory budget, when it is full it is appended to
+    the file. The samples of every road are in chronological order in the file.
+    """
+
+    def __init__(self, road_line_numbers: np.ndarray, filename: str, gcode_line_numbers: Iterable[int] = None,
+                 memory_budget: int = None, time_sample_rate: float = None, temperature_sample_rate: float = None):
+        """
+        :param road_line_numbers: gcode line number of every road of the RoadStore
+        :param filename: truncated
+        :param gcode_line_numbers: the recorded roads, None records all roads
+        :param memory_budget: bytes used for the samples and the state of the recorded roads, None uses
+        TEMPERATURE_HISTORY_MEMORY_BUDGET
+        :param time_sample_rate: None uses TIME_SAMPLE_RATE
+        :param temperature_sample_rate: None uses TEMPERATURE_SAMPLE_RATE
+        """
+        # the defaults are read here, so changes of the constants after the import are used
+        if memory_budget is None:
+            memory_budget = TEMPERATURE_HISTORY_MEMORY_BUDGET
+        if time_sample_rate is None:
+            time_sample_rate = TIME_SAMPLE_RATE
+        if temperature_sample_rate is None:
+            temperature_sample_rate = TEMPERATURE_SAMPLE_RATE
+        if gcode_line_numbers is None:
+            recorded = np.ones(len(road_line_numbers), dtype=bool)
+        else:
+            recorded = np.isin(road_line_numbers, np.fromiter(gcode_line_numbers, dtype=np.int64))
+        count = np.count_nonzero(recorded)
+        self.slots = np.full(len(road_line_numbers), -1, dtype=np.int64)  # position of each road in the following arrays
+        self.slots[recorded] = np.arange(count)
+        self.gcode_line_numbers = road_line_numbers[recorded]
+        # last kept sample and the latest sample (TempHistory.buffer) per recorded road, nan if there is none
+        self.kept_time = np.full(count, math.nan)
+        self.kept_temperature = np.full(count, math.nan)
+        self.latest_time = np.full(count, math.nan)
+        self.latest_temperature = np.full(count, math.nan)
+        self.time_sample_rate = time_sample_rate
+        self.temperature_sample_rate = temperature_sample_rate
+
+        state_size = sum(array.nbytes for array in (self.slots, self.gcode_line_numbers, self.kept_time,
+                                                     self.kept_temperature, self.latest_time, self.latest_temperature))
+        capacity = (memory_budget - state_size) // TEMPERATURE_HISTORY_DTYPE.itemsize
+        if capacity < max(count, 1):
+            raise ValueError("a temperature history of %d roads needs a memory budget of at least %d bytes" %
+                             (count, state_size + max(count, 1) * TEMPERATURE_HISTORY_DTYPE.itemsize))
+        self.samples = np.empty(capacity, dtype=TEMPERATURE_HISTORY_DTYPE)
+        self.sample_count = 0  # samples in self.samples
+        self.written_sample_count = 0
+        self.update_count = 0  # samples passed to deposit/update
+        self.file = open(filename, "wb")
+
+    def deposit(self, index: int, time: float, temperature: float):
+        """TempHistory.initialize"""
+        slot = self.slots[index]
+        if slot >= 0:
+            self.latest_time[slot] = time
+            self.latest_temperature[slot] = temperature
+            self.update_count += 1
+
+    def update(self, time: float, indexes: np.ndarray, temperatures: np.ndarray):
+        """
+        TempHistory.updateTemperature of the roads
+        :param time:
+        :param indexes: road indexes of the RoadStore
+        :param temperatures: the new temperature of each road
+        """
+        slots = self.slots[indexes]
+        recorded = slots >= 0
+        slots = slots[recorded]
+        temperatures = temperatures[recorded]
+        self.update_count += len(slots)
+        # comparisons with nan (no kept sample yet) are false
+        close = (time - self.kept_time[slots] <= self.time_sample_rate) & \
+            (np.abs(self.kept_temperature[slots] - temperatures) <= self.temperature_sample_rate)
+        self._keep_latest(slots[~close])
+        self.latest_time[slots] = time
+        self.latest_temperature[slots] = temperatures
+
+    def _keep_latest(self, slots: np.ndarray):
+        if self.sample_count + len(slots) > len(self.samples):
+            self.flush()
+        samples = self.samples[self.sample_count:self.sample_count + len(slots)]
+        samples["gcode_line_number"] = self.gcode_line_numbers[slots]
+        samples["time"] = self.latest_time[slots]
+        samples["temperature"] = self.latest_temperature[slots]
+        self.kept_time[slots] = self.latest_time[slots]
+        self.kept_temperature[slots] = self.latest_temperature[slots]
+        self.sample_count += len(slots)
+
+    def flush(self):
+        """Appends the collected samples to the file."""
+        self.samples[:self.sample_count].tofile(self.file)
+        self.written_sample_count += self.sample_count
+        self.sample_count = 0
+        instrumentation.count("temperature_history_flushes")
+
+    def close(self):
+        """Keeps the latest sample of every deposited road (TempHistory.getTempHistory) and writes all samples."""
+        self._keep_latest(np.flatnonzero(~np.isnan(self.latest_time)))
+        self.flush()
+        self.file.close()
+
+
+def read_temperature_history(filename: str) -> np.ndarray:
+    """
+    :return: the samples of a TemperatureHistory file as read-only memory map with TEMPERATURE_HISTORY_DTYPE
+    """
+    return np.memmap(filename, dtype=TEMPERATURE_HISTORY_DTYPE, mode="r")
+
+
+def road_temperature_history(samples: np.ndarray, gcode_line_number: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    :param samples: see read_temperature_history
+    :param gcode_line_number:
+    :return: time and temperature of the samples of the road in chronological order
+    """
+    road_samples = samples[samples["gcode_line_number"] == gcode_line_number]
+    return road_samples["time"], road_samples["temperature"]
+
+
+# parameters which can be changed per variant of a SweepRoadStore, PRINTED_MATERIAL is a key of _MATERIALS
+SWEEP_PARAMETERS = ("PRINTED_MATERIAL", "HC_ROAD", "ENVIRONMENT_CONVECTION_COEFFICIENT", "EMISSIVITY",
+                    "CONTACT_HEAT_TRANSFER")
+
+
+class SweepRoadStore(RoadStore):
+    """
+    RoadStore simulating several parameter variants at once on the same contact graph. The arrays which depend on the
+    parameters (temperature, heat capacity, duration above HDT) get the variant as first dimension, every time step
+    is one gather/scatter over the edges for all variants.
+    A road is removed from the simulation when it is cold in all variants, a single variant is bitwise identical to
+    RoadStore with the same parameters.
+    """
+
+    def __init__(self, roads: list[Road], variants: list[dict]):
+        """
+        :param roads:
+        :param variants: parameters per variant, see SWEEP_PARAMETERS, missing parameters use the module constants
+        """
+        super().__init__(roads)
+        defaults = {"PRINTED_MATERIAL": _PRINTED_MATERIAL, "HC_ROAD": HC_ROAD,
+                    "ENVIRONMENT_CONVECTION_COEFFICIENT": ENVIRONMENT_CONVECTION_COEFFICIENT, "EMISSIVITY": EMISSIVITY,
+                    "CONTACT_HEAT_TRANSFER": CONTACT_HEAT_TRANSFER}
+        for variant in variants:
+            unknown_parameters = set(variant) - set(SWEEP_PARAMETERS)
+            if unknown_parameters:
+                raise ValueError("unknown sweep parameters %s" % ", ".join(sorted(unknown_parameters)))
+        self.variants = [dict(defaults, **variant) for variant in variants]
+
+        def parameter(values):
+            return np.array(values)[:, None]  # broadcasts over the roads/edges
+
+        materials = [_MATERIALS[variant["PRINTED_MATERIAL"]] for variant in self.variants]
+        self.volumetric_heat_capacity = parameter([density * capacity for density, capacity, _ in materials])
+        self.thermal_conductivity = parameter([conductivity for _, _, conductivity in materials])
+        self.hc_road = parameter([variant["HC_ROAD"] for variant in self.variants])
+        self.convection_coefficient = parameter([variant["ENVIRONMENT_CONVECTION_COEFFICIENT"]
+                                                 for variant in self.variants])
+        self.emissivity = parameter([variant["EMISSIVITY"] for variant in self.variants])
+        self.gap_conductance = parameter([variant["CONTACT_HEAT_TRANSFER"] == "gap_conductance"
+                                          for variant in self.variants])
+
+        count_variants = len(self.variants)
+        self.temperature = np.tile(self.temperature, (count_variants, 1))
+        self.heat_capacity = np.ones((count_variants, len(self.roads)))
+        self.duration_temp_above_hdt = np.zeros((count_variants, len(self.roads)))
+        self.avg_contact_temperatures_at_deposition = np.zeros((count_variants, len(self.roads)))
+        # see calculate_road_heat_capacity
+        self.road_volume_in_m3 = np.array([road.length * road.width * road.layer_height for road in self.roads],
+                                          dtype=float) * 0.000000001
+
+    def deposit(self, road: Road, current_time=0.0):
+        """
+        See RoadStore.deposit, the Road objects get the temperatures of the first variant. Also calculates the
+        contact temperature at deposition of every variant (see calculate_contact_temperature_at_deposition).
+        """
+        super().deposit(road, current_time)
+        self.heat_capacity[:, road.index] = self.road_volume_in_m3[road.index] * self.volumetric_heat_capacity[:, 0]
+
+        contacts = [(contact_road.index, contact_area) for contact_road, contact_area in road.contacts.items()
+                    if contact_road.gcode_line_number != road.gcode_line_number - 1]
+        if road.layer_number == 1:
+            self.avg_contact_temperatures_at_deposition[:, road.index] = environment_temperature
+        elif contacts:
+            sum_contact_areas = sum(contact_area for _, contact_area in contacts)
+            avg_contact_temperatures = 0
+            for contact_index, contact_area in contacts:
+                avg_contact_temperatures = avg_contact_temperatures + \
+                    self.temperature[:, contact_index] * (contact_area / sum_contact_areas)
+            self.avg_contact_temperatures_at_deposition[:, road.index] = avg_contact_temperatures
+        else:
+            self.avg_contact_temperatures_at_deposition[:, road.index] = EXTRUSION_TEMPERATURE
+
+    def road_temperature(self, index: int) -> float:
+        return float(self.temperature[0, index])
+
+    def maximum_temperature(self, roads: np.ndarray) -> np.ndarray:
+        return self.temperature[:, roads].max(axis=0)
+
+    def _variant_rows(self, rows: np.ndarray, count: int) -> np.ndarray:
+        """:return: the rows of every variant in the flattened (variant, road) arrays"""
+        return (rows + (np.arange(len(self.variants)) * count)[:, None]).ravel()
+
+    def _explicit_temperatures(self, simulation_time_step_duration):
+        active_roads = self._active_roads
+        temperature = self.temperature
+        active_temperature = temperature[:, active_roads]
+        count = len(active_roads)
+
+        # 1. conduction to contacts, same operations as RoadStore._explicit_temperatures per variant
+        active_edges = self._active_edges
+        area_in_m = 0.000001 * self.edge_area[active_edges]
+        temperature_difference = active_temperature[:, self._active_rows] - temperature[:, self.columns[active_edges]]
+        edge_energy = np.where(self.gap_conductance, self.hc_road * area_in_m * temperature_difference,
+                               self.thermal_conductivity * area_in_m *
+                               (temperature_difference / self.edge_thickness_in_m[active_edges]))
+        contact_energy = np.bincount(self._variant_rows(self._active_rows, count), weights=edge_energy.ravel(),
+                                     minlength=active_temperature.size).reshape(active_temperature.shape) * \
+            simulation_time_step_duration
+
+        # 2. convection and radiation from free area
+        free_area_in_m = 0.000001 * self.free_area[active_roads]
+        convection_energy = simulation_time_step_duration * free_area_in_m * self.convection_coefficient * \
+            (active_temperature - environment_temperature)
+        active_temperature_in_kelvin = active_temperature - abs_zero_temp
+        radiation_energy = simulation_time_step_duration * free_area_in_m * self.emissivity * BOLTZMAN_CONSTANT * \
+            (active_temperature_in_kelvin * active_temperature_in_kelvin * active_temperature_in_kelvin *
+             active_temperature_in_kelvin - ENVIRONMENT_TEMPERATURE_IN_KELVIN ** 4)
+
+        heat_capacity = self.heat_capacity[:, active_roads]
+        new_temperatures = active_temperature - (contact_energy + convection_energy + radiation_energy) / heat_capacity
+
+        # todo: simulation is apparently not precise enough for small roads
+        imprecise = ((new_temperatures < environment_temperature) | (new_temperatures >= EXTRUSION_TEMPERATURE)) & \
+            (heat_capacity < 0.0001)
+        for variant, position in zip(*np.nonzero(imprecise)):
+            road = self.roads[active_roads[position]]
+            if len(road.contacts) > 0:
+                new_temperatures[variant, position] = min([temperature[variant, r.index] for r in road.contacts])
+            else:
+                new_temperatures[variant, position] = environment_temperature
+        return new_temperatures
+
+    def _implicit_temperatures(self, simulation_time_step_duration):
+        """
+        RoadStore._implicit_temperatures of all variants, the systems of the variants are solved together.
+        """
+        theta = IMPLICIT_THETA
+        active_roads = self._active_roads
+        active_rows = self._active_rows
+        active_edges = self._active_edges
+        temperature = self.temperature
+        active_temperature = temperature[:, active_roads]
+        if simulation_time_step_duration <= 0:
+            return active_temperature  # remainder of a whole number of steps
+        contact_temperature = temperature[:, self.columns[active_edges]]
+        count = len(active_roads)
+
+        area_in_m = 0.000001 * self.edge_area[active_edges]
+        edge_conductance = np.where(self.gap_conductance, self.hc_road * area_in_m,
+                                    self.thermal_conductivity * area_in_m / self.edge_thickness_in_m[active_edges])
+        # layer 1 is fixed to the environment temperature
+        fixed = self.layer_number[active_roads] == 1
+        edge_conductance[:, fixed[active_rows]] = 0
+        contact_positions = self._active_positions[self.columns[active_edges]]
+        # the unknowns are only coupled by existing contacts between simulated roads
+        coupled = (contact_positions >= 0) & (edge_conductance > 0).any(axis=0)
+        coupled_rows = self._variant_rows(active_rows[coupled], count)
+        coupled_positions = self._variant_rows(contact_positions[coupled], count)
+        coupled_conductance = edge_conductance[:, coupled].ravel()
+        variant_rows = self._variant_rows(active_rows, count)
+
+        def row_sums(edge_values):
+            return np.bincount(variant_rows, weights=edge_values.ravel(), minlength=active_temperature.size) \
+                .reshape(active_temperature.shape)
+
+        free_area_in_m = 0.000001 * self.free_area[active_roads]
+        convection_conductance = free_area_in_m * self.convection_coefficient
+        active_temperature_in_kelvin = active_temperature - abs_zero_temp
+        radiation_factor = free_area_in_m * self.emissivity * BOLTZMAN_CONSTANT
+        radiation = radiation_factor * (active_temperature_in_kelvin * active_temperature_in_kelvin *
+                                        active_temperature_in_kelvin * active_temperature_in_kelvin -
+                                        ENVIRONMENT_TEMPERATURE_IN_KELVIN ** 4)
+        radiation_conductance = 4 * radiation_factor * active_temperature_in_kelvin ** 3
+
+        # heat flow out of each road at the current temperatures
+        conductance_sum = row_sums(edge_conductance)
+        heat_flow = conductance_sum * active_temperature - row_sums(edge_conductance * contact_temperature) + \
+            convection_conductance * (active_temperature - environment_temperature) + radiation
+
+        capacity_rate = self.heat_capacity[:, active_roads] / simulation_time_step_duration
+        diagonal = capacity_rate + theta * (conductance_sum + convection_conductance + radiation_conductance)
+        fixed_contacts_flow = row_sums(np.where(coupled, 0, edge_conductance) * contact_temperature)
+        right_hand_side = capacity_rate * active_temperature - (1 - theta) * heat_flow + \
+            theta * (convection_conductance * environment_temperature + radiation_conductance * active_temperature -
+                     radiation + fixed_contacts_flow)
+        diagonal[:, fixed] = 1
+        right_hand_side[:, fixed] = environment_temperature
+
+        def system_product(x):
+            return diagonal * x - theta * np.bincount(coupled_rows, weights=coupled_conductance *
+                                                      x.ravel()[coupled_positions], minlength=x.size).reshape(x.shape)
+
+        # one system per variant
+        new_temperatures = solve_bicgstab(system_product, right_hand_side, active_temperature, diagonal,
+                                          IMPLICIT_SOLVER_TOLERANCE)
+        # only removes the deviations of the iterative solver
+        return np.clip(new_temperatures, environment_temperature, EXTRUSION_TEMPERATURE)
+
+    def write_back(self):
+        """Copies the results of the first variant to the Road objects."""
+        for road in self.roads:
+            road.temperature = self.road_temperature(road.index)
+            road.duration_temp_above_hdt = float(self.duration_temp_above_hdt[0, road.index])
+
+
+def solve_bicgstab(product, right_hand_side, initial_guess, preconditioner_diagonal, tolerance, max_iterations=500):
+    """
+    Solves product(x) = right_hand_side with the Jacobi preconditioned BiCGSTAB method. The conduction matrix is not
+    symmetric (the contact areas of both directions differ), but it is diagonally dominant so a few iterations suffice.
+    With 2d arrays every row is an independent system (the variants of a SweepRoadStore), each row gets its own
+    scalars and stops changing once it converged.
+    :param product: function returning the matrix-vector product
+    :param right_hand_side:
+    :param initial_guess:
+    :param preconditioner_diagonal: the diagonal of the matrix
+    :param tolerance: maximum residual divided by the diagonal, for the heat equation this is roughly the remaining
+    error in K
+    :param max_iterations:
+    :return: the solution
+    """
+    def unconverged(residual_vector):
+        return ~(np.abs(residual_vector / preconditioner_diagonal).max(axis=-1, initial=0, keepdims=True) <= tolerance)
+
+    def dot(a, b):
+        # the stacked matmul adds up every row in the same order as a @ b
+        return a @ b if a.ndim == 1 else np.matmul(a[:, None, :], b[:, :, None])[:, :, 0]
+
+    x = initial_guess.copy()
+    residual = right_hand_side - product(x)
+    remaining = unconverged(residual)
+    if not remaining.any():
+        return x
+    shadow_residual = residual.copy()
+    rho = alpha = omega = 1.0
+    v = np.zeros_like(x)
+    p = np.zeros_like(x)
+    # converged rows may divide by zero in the following iterations, their results are not used anymore
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for _ in range(max_iterations):
+            rho_next = dot(shadow_residual, residual)
+            p = residual + (rho_next / rho) * (alpha / omega) * (p - omega * v)
+            rho = rho_next
+            preconditioned_p = p / preconditioner_diagonal
+            v = product(preconditioned_p)
+            alpha = rho / dot(shadow_residual, v)
+            x += np.where(remaining, alpha * preconditioned_p, 0)
+            s = residual - alpha * v
+            remaining &= unconverged(s)
+            if not remaining.any():
+                return x
+            preconditioned_s = s / preconditioner_diagonal
+            t = product(preconditioned_s)
+            omega = dot(t, s) / dot(t, t)
+            x += np.where(remaining, omega * preconditioned_s, 0)
+            residual = s - omega * t
+            remaining &= unconverged(residual)
+            if not remaining.any():
+                return x
+    raise ArithmeticError("BiCGSTAB did not converge in %s iterations" % max_iterations)
+
+
+def export_for_gcode(gcode_filename, results: dict[str, np.ndarray],
+                     contact_temps_filename="sample-input-output/export_contact_temps.gcode",
+                     time_over_tgt_filename="sample-input-output/export_time_over_tgt.gcode"):
+    """
+    Visualise the temps by using the Gcode speed value as duration over HDT
+    :param results: see road_results
+    """
+    export_gcode_channels(gcode_filename, results,
+                          {contact_temps_filename: contact_temperature_feedrates,
+                           time_over_tgt_filename: time_over_hdt_feedrates})
+
+
+def contact_temperature_feedrates(results: dict[str, np.ndarray]) -> np.ndarray:
+    """:return: F values showing the average contact temperature at deposition, -1 keeps the F value"""
+    temperatures = np.asarray(results["avg_contact_temperatures_at_deposition"], dtype=float)
+    # F in the gcode is in mm/minute, gcode viewer convert it to mm/s
+    return np.where(temperatures > 0, temperatures * 60 * 10, -1).astype(np.int64)
+
+
+def time_over_hdt_feedrates(results: dict[str, np.ndarray]) -> np.ndarray:
+    """:return: F values showing the duration above the HDT, -1 keeps the F value"""
+    durations = np.asarray(results["duration_temp_above_hdt"], dtype=float)
+    # F in the gcode is in mm/minute, gcode viewer convert it to mm/s and this should be the time in ms above HDT
+    return np.where(durations > 0, durations * 60 * 1000, -1).astype(np.int64)
+
+
+def export_gcode_channels(gcode_filename, results: dict[str, np.ndarray],
+                          channels: dict[str, Callable[[dict[str, np.ndarray]], np.ndarray]]):
+    """
+    Writes one copy of the gcode file per channel with the F values of the road lines replaced by the values of the
+    channel, e.g. to show them in a gcode viewer as speed. Road lines without F value get one appended. The source is
+    read once in chunks of GCODE_CHUNK_SIZE bytes, the F fields of a chunk are located once with numpy and every
+    channel is patched and written as one block. The lines after the last road are not copied.
+    :param gcode_filename:
+    :param results: see road_results, sorted by gcode_line_number
+    :param channels: target filename: function of the results returning the F value per road (-1 keeps the line
+    unchanged)
+    """
+    line_numbers = np.asarray(results["gcode_line_number"], dtype=np.int64)
+    with contextlib.ExitStack() as stack:
+        targets = [stack.enter_context(open(filename, "wb")) for filename in channels]
+        source = stack.enter_context(open(gcode_filename, "rb"))
+        first_line_number = 1
+        first_road = 0
+        while first_road < len(line_numbers):
+            chunk = source.read(GCODE_CHUNK_SIZE) + source.readline()
+            if not chunk:
+                break
+            characters = np.frombuffer(chunk.replace(b"\r\n", b"\n"), dtype=np.uint8)
+            line_ends = np.flatnonzero(characters == ord("\n")) + 1
+            if len(line_ends) == 0 or line_ends[-1] != len(characters):
+                line_ends = np.append(line_ends, len(characters))  # last line without newline
+            end_road = np.searchsorted(line_numbers, first_line_number + len(line_ends))
+            if end_road == len(line_numbers):
+                characters = characters[:line_ends[line_numbers[-1] - first_line_number]]
+                line_ends = line_ends[:line_numbers[-1] - first_line_number + 1]
+            starts, ends, edit_roads = _feedrate_edits(characters, line_ends,
+                                                       line_numbers[first_road:end_road] - first_line_number)
+            # the channels of the roads in the chunk only, the results may be a memory map (see read_road_results)
+            chunk_results = {name: values[first_road:end_road] for name, values in results.items()}
+            for target, function in zip(targets, channels.values()):
+                feedrates = np.asarray(function(chunk_results), dtype=np.int64)
+                target.write(_replace_feedrates(characters, starts, ends, feedrates[edit_roads]))
+            first_line_number += len(line_ends)
+            first_road = end_road
+
+
+def _feedrate_edits(characters: np.ndarray, line_ends: np.ndarray, road_lines: np.ndarray) \
+        -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Locates the F fields ("F" followed by digits) of the road lines. A road line without "F" gets its F field inserted
+    before the newline.
+    :param characters: the chunk
+    :param line_ends: end of every line (after the newline)
+    :param road_lines: line of each road in the chunk
+    :return: start and end of every F field to replace (sorted), the road of each field
+    """
+    road_of_line = np.full(len(line_ends), -1, dtype=np.int64)
+    road_of_line[road_lines] = np.arange(len(road_lines))
+    is_digit = (characters >= ord("0")) & (characters <= ord("9"))
+    f_positions = np.flatnonzero(characters == ord("F"))
+    has_f = np.zeros(len(line_ends), dtype=bool)
+    has_f[np.searchsorted(line_ends, f_positions, side="right")] = True
+
+    field_starts = f_positions[is_digit[np.minimum(f_positions + 1, len(characters) - 1)] &
+                               (f_positions + 1 < len(characters))]
+    digit_ends = np.flatnonzero(is_digit & ~np.append(is_digit[1:], False)) + 1
+    field_ends = digit_ends[np.searchsorted(digit_ends, field_starts + 1)]
+    field_roads = road_of_line[np.searchsorted(line_ends, field_starts, side="right")]
+    is_road_field = field_roads >= 0
+
+    insert_lines = road_lines[~has_f[road_lines] & (characters[line_ends[road_lines] - 1] == ord("\n"))]
+    insert_positions = line_ends[insert_lines] - 1
+    starts = np.concatenate((field_starts[is_road_field], insert_positions))
+    order = np.argsort(starts, kind="stable")
+    return (starts[order], np.concatenate((field_ends[is_road_field], insert_positions))[order],
+            np.concatenate((field_roads[is_road_field], road_of_line[insert_lines]))[order])
+
+
+def _replace_feedrates(characters: np.ndarray, starts: np.ndarray, ends: np.ndarray, feedrates: np.ndarray) -> bytes:
+    """
+    :return: the characters with characters[start:end] replaced by " F<feedrate>", negative feedrates are skipped
+    """
+    changed = feedrates >= 0
+    starts, ends, feedrates = starts[changed], ends[changed], feedrates[changed]
+    removed_lengths = ends - starts
+    digit_counts = np.maximum(np.searchsorted(_INTEGER_POWERS_OF_TEN, feedrates, side="right"), 1)
+    field_lengths = 2 + digit_counts
+    # one row per field, right aligned: " F" and the digits
+    width = 2 + digit_counts.max(initial=1)
+    field_characters = np.empty((len(feedrates), width), dtype=np.uint8)
+    field_characters[:, 2:] = feedrates[:, None] // _INTEGER_POWERS_OF_TEN[width - 3::-1] % 10 + ord("0")
+    field_characters[np.arange(len(feedrates)), width - field_lengths] = ord(" ")
+    field_characters[np.arange(len(feedrates)), width - field_lengths + 1] = ord("F")
+    fields = field_characters[np.arange(width) >= (width - field_lengths)[:, None]]
+    field_offsets = np.cumsum(field_lengths) - field_lengths
+
+    # masks instead of index arrays, the chunk is much larger than the fields
+    kept = characters[~_range_mask(starts, ends, len(characters))]
+    output_starts = starts - (np.cumsum(removed_lengths) - removed_lengths) + field_offsets
+    is_field = _range_mask(output_starts, output_starts + field_lengths, len(kept) + len(fields))
+    output = np.empty(len(is_field), dtype=np.uint8)
+    output[~is_field] = kept
+    output[is_field] = fields
+    return output.tobytes()
+
+
+def _range_mask(starts: np.ndarray, ends: np.ndarray, length: int) -> np.ndarray:
+    """:return: mask of the sorted and not overlapping ranges [start, end)"""
+    # alternating runs outside and inside of the ranges
+    run_lengths = np.empty(2 * len(starts) + 1, dtype=np.int64)
+    run_lengths[0::2] = np.concatenate((starts, [length])) - np.concatenate(([0], ends))
+    run_lengths[1::2] = ends - starts
+    return np.repeat(np.arange(len(run_lengths)) % 2 == 1, run_lengths)
+
+
+# columns of write_road_results: name, little endian numpy dtype
+ROAD_RESULT_COLUMNS = (("gcode_line_number", "<i8"), ("layer_number", "<i4"), ("start_x", "<f8"), ("start_y", "<f8"),
+                       ("end_x", "<f8"), ("end_y", "<f8"), ("width", "<f8"), ("length", "<f8"), ("layer_height", "<f8"),
+                       ("duration", "<f8"), ("duration_temp_above_hdt", "<f8"),
+                       ("avg_contact_temperatures_at_deposition", "<f8"), ("temperature", "<f8"))
+_ROAD_RESULT_MAGIC = b"ROADRES1"
+_ROAD_RESULT_ALIGNMENT = 64  # bytes, every column starts at a multiple
+
+
+def road_results(roads: Iterable[Road]) -> dict[str, np.ndarray]:
+    """
+    :param roads: the simulated roads
+    :return: the columns of ROAD_RESULT_COLUMNS, roads without temperature (travel moves) get nan
+    """
+    roads = list(roads)
+    return {name: np.fromiter((getattr(road, name, math.nan) for road in roads), dtype=dtype, count=len(roads))
+            for name, dtype in ROAD_RESULT_COLUMNS}
+
+
+def line_results(results: dict[str, np.ndarray], first_line_numbers: np.ndarray,
+                 last_line_numbers: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Maps the results of meshed roads (see MESH_ROADS) back to the gcode lines: a merged road gives the results of all
+    its gcode lines, the parts of a split gcode line are combined (longest duration above the HDT, highest
+    temperature, length weighted mean contact temperature, summed length and duration, end of the last part).
+    :param results: see road_results, in the order of the roads
+    :param first_line_numbers: the first gcode line of every road
+    :param last_line_numbers: the last gcode line of every road
+    :return: the results per gcode line, see road_results
+    """
+    line_counts = last_line_numbers - first_line_numbers + 1
+    roads = np.repeat(np.arange(len(line_counts)), line_counts)
+    line_numbers = first_line_numbers[roads] + np.arange(len(roads)) - np.repeat(np.cumsum(line_counts) - line_counts,
+                                                                                   line_counts)
+    starts = np.flatnonzero(np.diff(line_numbers, prepend=-1) != 0)
+    ends = np.append(starts[1:], len(roads)) - 1
+    split = ends > starts
+    first_roads = roads[starts]
+    last_roads = roads[ends]
+    lines = {name: np.asarray(results[name])[first_roads] for name, _ in ROAD_RESULT_COLUMNS}
+    lines["gcode_line_number"] = line_numbers[starts]
+    if len(roads) == 0:
+        return lines
+    lengths = np.asarray(results["length"])[roads]
+    for name in ("end_x", "end_y"):
+        lines[name] = np.where(split, np.asarray(results[name])[last_roads], lines[name])
+    for name in ("length", "duration"):
+        lines[name] = np.where(split, np.add.reduceat(np.asarray(results[name])[roads], starts), lines[name])
+    lines["duration_temp_above_hdt"] = np.where(split, np.maximum.reduceat(
+        np.asarray(results["duration_temp_above_hdt"])[roads], starts), lines["duration_temp_above_hdt"])
+    lines["temperature"] = np.where(split, np.fmax.reduceat(np.asarray(results["temperature"])[roads], starts),
+                                    lines["temperature"])
+    summed_lengths = np.add.reduceat(lengths, starts)
+    lines["avg_contact_temperatures_at_deposition"] = np.where(split & (summed_lengths > 0), np.add.reduceat(
+        np.asarray(results["avg_contact_temperatures_at_deposition"])[roads] * lengths, starts) /
+        np.where(summed_lengths > 0, summed_lengths, 1), lines["avg_contact_temperatures_at_deposition"])
+    return lines
+
+
+def write_road_results(filename: str, results: dict[str, np.ndarray], metadata: dict = None):
+    """
+    Writes the per road results as columnar binary file: _ROAD_RESULT_MAGIC, the length of the header as uint64, the
+    JSON header (number of roads, dtype and offset of every column after the header, metadata) and the columns of
+    ROAD_RESULT_COLUMNS without any conversion.
+    :param filename:
+    :param results: see road_results
+    :param metadata: JSON serializable, e.g. the gcode filename
+    """
+    columns = {name: np.asarray(results[name], dtype=dtype) for name, dtype in ROAD_RESULT_COLUMNS}
+    with open(filename, "wb") as result_file:
+        result_file.write(_road_result_header(len(columns["gcode_line_number"]), metadata))
+        for name, _ in ROAD_RESULT_COLUMNS:
+            result_file.write(columns[name].tobytes())
+            result_file.write(bytes(-columns[name].nbytes % _ROAD_RESULT_ALIGNMENT))
+
+
+def _road_result_header(count: int, metadata: dict = None) -> bytes:
+    """:return: the start of a write_road_results file up to the first column"""
+    header_columns = {}
+    offset = 0
+    for name, dtype in ROAD_RESULT_COLUMNS:
+        header_columns[name] = {"dtype": dtype, "offset": offset}
+        offset += -(-count * np.dtype(dtype).itemsize // _ROAD_RESULT_ALIGNMENT) * _ROAD_RESULT_ALIGNMENT
+    header = json.dumps({"count": count, "columns": header_columns, "metadata": metadata or {}}).encode()
+    header_end = len(_ROAD_RESULT_MAGIC) + 8 + len(header)
+    return _ROAD_RESULT_MAGIC + len(header).to_bytes(8, "little") + header + \
+        bytes(-header_end % _ROAD_RESULT_ALIGNMENT)
+
+
+class RoadResultWriter(object):
+    """
+    Writes a file of write_road_results block by block while the roads are simulated (see simulate_streaming). The
+    number of roads is only known at the end, so the columns are collected in temporary files next to the file and
+    copied behind the header by close().
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.count = 0
+        self._column_files = {name: tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(filename)))
+                              for name, _ in ROAD_RESULT_COLUMNS}
+
+    def write(self, results: dict[str, np.ndarray]):
+        """:param results: the next roads, see road_results"""
+        for name, dtype in ROAD_RESULT_COLUMNS:
+            self._column_files[name].write(np.asarray(results[name], dtype=dtype).tobytes())
+        self.count += len(results["gcode_line_number"])
+
+    def close(self, metadata: dict = None):
+        """
+        Writes the file, the temporary files are removed.
+        :param metadata: see write_road_results
+        """
+        with open(self.filename, "wb") as result_file:
+            result_file.write(_road_result_header(self.count, metadata))
+            for name, dtype in ROAD_RESULT_COLUMNS:
+                with self._column_files[name] as column_file:
+                    column_file.seek(0)
+                    shutil.copyfileobj(column_file, result_file)
+                result_file.write(bytes(-(self.count * np.dtype(dtype).itemsize) % _ROAD_RESULT_ALIGNMENT))
+
+
+def read_road_results(filename: str) -> tuple[dict[str, np.ndarray], dict]:
+    """
+    Reads a file of write_road_results without copying, the columns are read-only views of a memory map.
+    :param filename:
+    :return: the columns by name, the metadata
+    """
+    data = np.memmap(filename, dtype=np.uint8, mode="r")
+    if bytes(data[:len(_ROAD_RESULT_MAGIC)]) != _ROAD_RESULT_MAGIC:
+        raise ValueError("%s is not a road result file" % filename)
+    header_start = len(_ROAD_RESULT_MAGIC) + 8
+    header_end = header_start + int.from_bytes(bytes(data[len(_ROAD_RESULT_MAGIC):header_start]), "little")
+    header = json.loads(bytes(data[header_start:header_end]))
+    columns_start = header_end + -header_end % _ROAD_RESULT_ALIGNMENT
+    columns = {}
+    for name, column in header["columns"].items():
+        dtype = np.dtype(column["dtype"])
+        start = columns_start + column["offset"]
+        columns[name] = data[start:start + header["count"] * dtype.itemsize].view(dtype)
+    return columns, header["metadata"]
 
 
 def export_for_threejs(roads_by_geomid):